@@ -0,0 +1,48 @@
+from bisect import bisect_right
+from typing import Dict, Iterable, List, NamedTuple
+
+
+class Achievement(NamedTuple):
+    id: int
+    name: str
+    description: str
+    requirement_type: str
+    requirement_value: int
+    reward_xp: int
+
+
+class AchievementCatalog:
+    """All achievements, compiled into sorted threshold arrays per requirement type.
+
+    ``crossed()`` bisects between a counter's old and new value, so the common
+    case of a message that crosses no threshold is two bisects and nothing else.
+    """
+
+    def __init__(self, achievements: Iterable[Achievement]):
+        self.achievements: List[Achievement] = sorted(achievements, key=lambda a: a.requirement_value)
+        self._by_type: Dict[str, List[Achievement]] = {}
+        for achievement in self.achievements:
+            self._by_type.setdefault(achievement.requirement_type, []).append(achievement)
+        self._thresholds: Dict[str, List[int]] = {
+            req_type: [a.requirement_value for a in items]
+            for req_type, items in self._by_type.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.achievements)
+
+    def crossed(self, req_type: str, old_value: int, new_value: int) -> List[Achievement]:
+        """Achievements whose threshold lies in ``(old_value, new_value]``."""
+        thresholds = self._thresholds.get(req_type)
+        if not thresholds or new_value <= old_value:
+            return []
+        start = bisect_right(thresholds, old_value)
+        end = bisect_right(thresholds, new_value)
+        return self._by_type[req_type][start:end]
+
+    def reached(self, req_type: str, value: int) -> List[Achievement]:
+        """Achievements whose threshold is at or below ``value``."""
+        thresholds = self._thresholds.get(req_type)
+        if not thresholds:
+            return []
+        return self._by_type[req_type][:bisect_right(thresholds, value)]
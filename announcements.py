@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+import discord
+import botsettings
+
+logger = logging.getLogger(__name__)
+
+# Discord accepts at most 10 embeds per message
+MAX_EMBEDS = 10
+# Lines listed in one digest before it switches to "...and N more"
+MAX_DIGEST_LINES = 25
+# Number of tracked channels above which idle ones are forgotten
+PRUNE_THRESHOLD = 1000
+
+
+class _ChannelQueue:
+    """Pending messages of one channel and the token bucket pacing them."""
+
+    def __init__(self, channel: discord.abc.Messageable, rate: float, burst: int):
+        self.channel = channel
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        # (embeds, time queued)
+        self.pending: Deque[Tuple[List[discord.Embed], float]] = deque()
+        self.digest: List[str] = []
+        self.sender: Optional[asyncio.Task] = None
+        self.digest_timer: Optional[asyncio.Task] = None
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class AnnouncementScheduler:
+    """Paced, merged delivery of level-up and achievement announcements.
+
+    Every channel has its own queue drained through a token bucket of
+    ``burst`` messages refilled at ``rate`` per second, so a burst of
+    level-ups can't run into Discord's per-channel limits. Whatever piles up
+    while a channel waits is merged, up to 10 embeds per message.
+
+    With ``digest_interval`` set, level-ups are instead collected per
+    channel and posted as one summary every ``digest_interval`` seconds.
+    """
+
+    def __init__(self, rate: float = None, burst: int = None, max_queue: int = None, digest_interval: float = None):
+        self.rate = rate or botsettings.announce_rate
+        self.burst = burst or botsettings.announce_burst
+        self.max_queue = max_queue or botsettings.announce_queue_size
+        self.digest_interval = botsettings.announce_digest_interval if digest_interval is None else digest_interval
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self._channels: Dict[int, _ChannelQueue] = {}
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue.pending) for queue in self._channels.values())
+
+    def stats(self) -> Dict[str, float]:
+        latencies = sorted(self._latencies)
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "latency_p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+            "latency_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0,
+        }
+
+    def announce(self, channel: discord.abc.Messageable, embeds: List[discord.Embed]):
+        """Queue one event's embeds for ``channel``; they are sent together."""
+        queue = self._queue(channel)
+        if len(queue.pending) >= self.max_queue:
+            self.dropped += 1
+            return
+        for start in range(0, len(embeds), MAX_EMBEDS):
+            queue.pending.append((embeds[start:start + MAX_EMBEDS], time.monotonic()))
+        if queue.sender is None or queue.sender.done():
+            queue.sender = asyncio.create_task(self._send_loop(queue))
+
+    def add_to_digest(self, channel: discord.abc.Messageable, line: str):
+        """Add a line to the channel's next digest."""
+        queue = self._queue(channel)
+        queue.digest.append(line)
+        if queue.digest_timer is None or queue.digest_timer.done():
+            queue.digest_timer = asyncio.create_task(self._digest_later(queue))
+
+    async def close(self, timeout: float = 10):
+        """Post pending digests and send what is queued (for up to ``timeout`` seconds)."""
+        for queue in self._channels.values():
+            if queue.digest_timer is not None:
+                queue.digest_timer.cancel()
+            self._flush_digest(queue)
+        senders = [queue.sender for queue in self._channels.values() if queue.sender and not queue.sender.done()]
+        if senders:
+            done, pending = await asyncio.wait(senders, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Dropped {self.depth} queued announcements on shutdown")
+
+    def _queue(self, channel: discord.abc.Messageable) -> _ChannelQueue:
+        queue = self._channels.get(channel.id)
+        if queue is None:
+            if len(self._channels) >= PRUNE_THRESHOLD:
+                self._prune()
+            queue = self._channels[channel.id] = _ChannelQueue(channel, self.rate, self.burst)
+        return queue
+
+    def _prune(self):
+        # A channel that has been idle long enough to refill its bucket
+        # behaves exactly like a new one, so it can be forgotten
+        refill = self.burst / self.rate
+        now = time.monotonic()
+        for channel_id, queue in list(self._channels.items()):
+            if not queue.pending and not queue.digest and now - queue.updated >= refill:
+                del self._channels[channel_id]
+
+    async def _send_loop(self, queue: _ChannelQueue):
+        while queue.pending:
+            wait = queue.wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            queue.tokens -= 1
+
+            # Merge everything that queued up while we waited
+            embeds, queued_at = queue.pending.popleft()
+            batch = [queued_at]
+            while queue.pending and len(embeds) + len(queue.pending[0][0]) <= MAX_EMBEDS:
+                more, more_queued_at = queue.pending.popleft()
+                embeds = embeds + more
+                batch.append(more_queued_at)
+            self.merged += len(batch) - 1
+
+            try:
+                await queue.channel.send(embeds=embeds)
+                self.sent += 1
+                now = time.monotonic()
+                self._latencies.extend(now - queued_at for queued_at in batch)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error sending announcement to channel {queue.channel.id}: {e}")
+
+    async def _digest_later(self, queue: _ChannelQueue):
+        await asyncio.sleep(self.digest_interval)
+        self._flush_digest(queue)
+
+    def _flush_digest(self, queue: _ChannelQueue):
+        if not queue.digest:
+            return
+        lines, queue.digest = queue.digest, []
+        description = "\n".join(lines[:MAX_DIGEST_LINES])
+        if len(lines) > MAX_DIGEST_LINES:
+            description += f"\n...and {len(lines) - MAX_DIGEST_LINES} more"
+        embed = discord.Embed(
+            title=f"🎉 {len(lines)} Level Up{'s' if len(lines) != 1 else ''}!",
+            description=description,
+            color=discord.Color.gold()
+        )
+        self.announce(queue.channel, [embed])
@@ -0,0 +1,89 @@
+"""Stand-ins for the few discord.py objects the message path touches.
+
+They carry only the attributes ``on_message`` and ``process_xp`` read, and
+their API calls (sending, adding roles) just count and optionally sleep
+``api_latency`` seconds to model the round trip to Discord.
+"""
+import asyncio
+from typing import Dict, List, Optional
+
+
+class FakeAsset:
+    def __init__(self, url: str):
+        self.url = url
+
+
+class FakeRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+        self.name = f"role-{role_id}"
+        self.mention = f"<@&{role_id}>"
+
+
+class FakeUser:
+    """The bot's own user; only its id is ever compared."""
+
+    def __init__(self, user_id: int, name: str = "bench"):
+        self.id = user_id
+        self.name = name
+        self.global_name = None
+        self.display_name = name
+        self.bot = True
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, api_latency: float = 0.0):
+        self.id = guild_id
+        self.api_latency = api_latency
+        self.roles: Dict[int, FakeRole] = {}
+        self.role_edits = 0
+
+    def add_role(self, role_id: int) -> FakeRole:
+        role = self.roles[role_id] = FakeRole(role_id)
+        return role
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return self.roles.get(role_id)
+
+
+class FakeMember:
+    def __init__(self, user_id: int, guild: FakeGuild):
+        self.id = user_id
+        self.guild = guild
+        self.bot = False
+        self.name = f"user-{user_id}"
+        self.global_name = None
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+        self.display_avatar = FakeAsset(f"https://cdn.example/avatars/{user_id}.png")
+        self.roles: List[FakeRole] = []
+
+    async def add_roles(self, *roles: FakeRole, reason: str = None):
+        if self.guild.api_latency:
+            await asyncio.sleep(self.guild.api_latency)
+        self.guild.role_edits += 1
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild: FakeGuild):
+        self.id = channel_id
+        self.guild = guild
+        self.sent = 0
+
+    async def send(self, content: str = None, *, embeds=None, embed=None):
+        if self.guild.api_latency:
+            await asyncio.sleep(self.guild.api_latency)
+        self.sent += 1
+
+
+class FakeMessage:
+    __slots__ = ("author", "guild", "channel", "content", "_state")
+
+    def __init__(self, author: FakeMember, channel: FakeChannel, content: str, state=None):
+        self.author = author
+        self.guild = channel.guild
+        self.channel = channel
+        self.content = content
+        # commands.Context copies the connection state off the message
+        self._state = state
@@ -0,0 +1,208 @@
+"""Drive the bot's real message path with synthetic traffic.
+
+Fake guilds, members and messages are fed through ``main.on_message`` against
+a scratch SQLite database, exactly as the gateway would deliver them:
+
+    python -m benchmarks.loadtest --guilds 50 --users 20000 --messages 50000 --skew 1.1
+    python -m benchmarks.loadtest --rate 500 --write-behind --json results.json
+
+Reports throughput, per-stage latency, database growth and peak memory.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+from benchmarks import support
+from benchmarks.fakes import FakeChannel, FakeGuild, FakeMember, FakeMessage, FakeUser
+
+# Levels that get a rank role in every guild with --rank-roles
+RANK_ROLE_LEVELS = range(5, 61, 5)
+
+
+def record_samples(histogram) -> Dict[str, List[float]]:
+    """Keep every raw observation of ``histogram``, by its first label."""
+    samples: Dict[str, List[float]] = defaultdict(list)
+    observe = histogram.observe
+
+    def recording_observe(value: float, *labels: str):
+        samples[labels[0] if labels else ""].append(value)
+        observe(value, *labels)
+
+    histogram.observe = recording_observe
+    return samples
+
+
+async def run(args, database: str) -> dict:
+    support.configure(database, args.write_behind, args.rank_index, args.cooldown)
+    # main reads the settings above at import time
+    import main
+    from metrics import STAGE_LATENCY
+
+    db_manager = main.db_manager
+    try:
+        return await _drive(args, database, main, STAGE_LATENCY)
+    finally:
+        # Open connections would keep the process alive after an error
+        await db_manager.close()
+
+
+async def _drive(args, database: str, main, stage_latency) -> dict:
+    db_manager = main.db_manager
+    await db_manager.init_database()
+    await db_manager.initialize_default_achievements()
+    main.bot._connection.user = FakeUser(1)
+
+    api_latency = args.api_latency_ms / 1000
+    guilds = [FakeGuild(support.ID_BASE + g * 1000, api_latency) for g in range(args.guilds)]
+    channels = [FakeChannel(guild.id + 1, guild) for guild in guilds]
+    if args.rank_roles:
+        for guild in guilds:
+            for level in RANK_ROLE_LEVELS:
+                role = guild.add_role(guild.id + 100 + level)
+                await db_manager.add_rank_role(guild.id, level, role.id)
+
+    member_ids = support.user_ids(args.users, args.seed)
+    members = [FakeMember(user_id, guilds[i % len(guilds)]) for i, user_id in enumerate(member_ids)]
+    if args.preload:
+        await support.populate(db_manager, [guild.id for guild in guilds], member_ids, args.seed)
+    if db_manager.rank_index is not None:
+        await db_manager.rank_index.get()
+
+    picks = support.skewed_choices(args.messages, args.users, args.skew, args.seed)
+    await support.checkpoint(db_manager)
+    size_before = support.database_size(database)
+    stage_samples = record_samples(stage_latency)
+    on_message_samples: List[float] = []
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+    for n, index in enumerate(picks):
+        if args.rate:
+            delay = started + n / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        member = members[index]
+        message = FakeMessage(member, channels[index % len(guilds)], "just chatting", main.bot._connection)
+        sent_at = time.perf_counter()
+        await main.on_message(message)
+        on_message_samples.append(time.perf_counter() - sent_at)
+        if not args.rate:
+            # Let the XP workers run, as the gateway would between events
+            await asyncio.sleep(0)
+    offered = time.perf_counter() - started
+
+    await main.xp_pipeline.close(timeout=3600)
+    if db_manager.xp_buffer is not None:
+        await db_manager.xp_buffer.flush()
+    elapsed = time.perf_counter() - started
+
+    python_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+    size_after = support.database_size(database)
+    pipeline_stats = main.xp_pipeline.stats()
+    announcer_stats = main.announcer.stats()
+    await main.announcer.close(timeout=0)
+    await db_manager.close()
+    size_closed = support.database_size(database)
+
+    stages = {"on_message": support.summarize(on_message_samples)}
+    stages.update((stage, support.summarize(samples)) for stage, samples in sorted(stage_samples.items()))
+    return {
+        "config": {name: value for name, value in vars(args).items() if name not in ("json", "keep_db", "database")},
+        "environment": support.environment(),
+        "throughput": {
+            "messages": args.messages,
+            "offered_seconds": offered,
+            "elapsed_seconds": elapsed,
+            "messages_per_second": args.messages / elapsed if elapsed else 0.0,
+        },
+        "pipeline": pipeline_stats,
+        "announcements": {
+            "sent": announcer_stats["sent"],
+            "merged": announcer_stats["merged"],
+            "dropped": announcer_stats["dropped"],
+            "left_queued": announcer_stats["depth"],
+            "role_edits": sum(guild.role_edits for guild in guilds),
+        },
+        "stages": stages,
+        "database": {
+            "before_bytes": size_before,
+            "after_bytes": size_after,
+            "closed_bytes": size_closed,
+            "growth_bytes": size_closed - size_before,
+        },
+        "memory": {
+            "peak_rss_mb": support.peak_rss_mb(),
+            "python_peak_mb": python_peak / (1024 * 1024) if python_peak is not None else None,
+        },
+    }
+
+
+def print_report(results: dict):
+    throughput = results["throughput"]
+    print(f"{throughput['messages']} messages in {throughput['elapsed_seconds']:.2f}s "
+          f"({throughput['messages_per_second']:,.0f} msg/s, offered over {throughput['offered_seconds']:.2f}s)")
+    print("pipeline: " + ", ".join(f"{name}={value}" for name, value in results["pipeline"].items()))
+    print("announcements: " + ", ".join(f"{name}={value}" for name, value in results["announcements"].items()))
+    print()
+    print(f"{'stage':<16}{'count':>10}{'mean ms':>12}{'p50 ms':>12}{'p99 ms':>12}")
+    for stage, summary in results["stages"].items():
+        print(f"{stage:<16}{summary['count']:>10}{summary['mean_ms']:>12.3f}{summary['p50_ms']:>12.3f}{summary['p99_ms']:>12.3f}")
+    print()
+    database = results["database"]
+    print(f"database: {database['before_bytes'] / 1024:,.0f} KiB -> {database['closed_bytes'] / 1024:,.0f} KiB "
+          f"(WAL peak {database['after_bytes'] / 1024:,.0f} KiB)")
+    memory = results["memory"]
+    line = f"peak RSS: {memory['peak_rss_mb']:.1f} MiB" if memory["peak_rss_mb"] is not None else "peak RSS: n/a"
+    if memory["python_peak_mb"] is not None:
+        line += f", Python heap peak: {memory['python_peak_mb']:.1f} MiB"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the XP message path with synthetic traffic.")
+    parser.add_argument("--guilds", type=int, default=10, help="number of guilds")
+    parser.add_argument("--users", type=int, default=5000, help="number of members, spread evenly over the guilds")
+    parser.add_argument("--messages", type=int, default=20000, help="messages to send")
+    parser.add_argument("--rate", type=float, default=0, help="messages per second (default: as fast as possible)")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of who talks (0 = uniform)")
+    parser.add_argument("--cooldown", type=int, default=0, help="XP cooldown in seconds (default: 0, every message earns XP)")
+    parser.add_argument("--preload", action="store_true", help="store a score for every member before starting")
+    parser.add_argument("--rank-roles", action="store_true", help=f"give every guild rank roles at levels {RANK_ROLE_LEVELS.start}-{RANK_ROLE_LEVELS.stop - 1}")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="simulated Discord API latency")
+    parser.add_argument("--write-behind", action="store_true", help="enable XP_WRITE_BEHIND")
+    parser.add_argument("--rank-index", action="store_true", help="enable RANK_INDEX_ENABLED")
+    parser.add_argument("--tracemalloc", action="store_true", help="also measure the Python heap peak (slower)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database", default=None, help="database file to use (default: a temporary file)")
+    parser.add_argument("--keep-db", action="store_true", help="keep the temporary database")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+    if args.guilds <= 0 or args.users < args.guilds or args.messages <= 0:
+        parser.error("need at least one guild, one user per guild and one message")
+
+    workdir = None
+    database = args.database
+    if database is None:
+        workdir = tempfile.mkdtemp(prefix="knott-bench-")
+        database = os.path.join(workdir, "bench.db")
+    try:
+        results = asyncio.run(run(args, database))
+    finally:
+        if workdir is not None and not args.keep_db:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    if args.json:
+        support.save_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Time each DatabaseManager method on a populated scratch database.
+
+    python -m benchmarks.microbench                 # compare with stored baselines
+    python -m benchmarks.microbench --save          # record new baselines
+    python -m benchmarks.microbench --rank-index --only leaderboard
+
+Baselines are kept per mode (write-behind and rank index on or off) in
+benchmarks/baselines.json. A method whose median is more than ``--threshold``
+slower than its baseline is reported as a regression; with
+``--fail-on-regression`` that also makes the exit status non-zero. Baselines
+are only comparable on the machine that recorded them.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple
+from benchmarks import support
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+class Context(NamedTuple):
+    db_manager: object
+    guild_ids: List[int]
+    member_ids: List[int]
+
+    def user(self, i: int) -> int:
+        return self.member_ids[i * 7919 % len(self.member_ids)]
+
+    def guild(self, i: int) -> int:
+        return self.guild_ids[i % len(self.guild_ids)]
+
+    def member(self, i: int):
+        # Member n belongs to guild n % guilds (see support.populate)
+        n = i * 7919 % len(self.member_ids)
+        return self.member_ids[n], self.guild_ids[n % len(self.guild_ids)]
+
+
+class Benchmark(NamedTuple):
+    name: str
+    iterations: int
+    # Receives the context and returns the call to time, given the iteration number
+    setup: Callable[[Context], Awaitable[Callable[[int], Awaitable]]]
+
+
+def simple(name: str, iterations: int, call: Callable[[Context, int], Awaitable]) -> Benchmark:
+    async def setup(ctx: Context):
+        return lambda i: call(ctx, i)
+    return Benchmark(name, iterations, setup)
+
+
+async def _after_first_page(ctx: Context):
+    from database import page_cursor
+    cursors = {}
+    for guild_id in ctx.guild_ids:
+        cursors[guild_id] = page_cursor(await ctx.db_manager.get_leaderboard_page(guild_id, None, 100))
+    return lambda i: ctx.db_manager.get_leaderboard_page(ctx.guild(i), cursors[ctx.guild(i)], 10)
+
+
+async def _levels_page(ctx: Context):
+    cursors = {}
+    for guild_id in ctx.guild_ids:
+        user_id, level, xp, _ = (await ctx.db_manager.get_guild_levels_page(guild_id, None, 100))[-1]
+        cursors[guild_id] = (level, xp, user_id)
+    return lambda i: ctx.db_manager.get_guild_levels_page(ctx.guild(i), cursors[ctx.guild(i)], 500)
+
+
+async def _period_after_first_page(ctx: Context):
+    from database import period_page_cursor
+    cursors = {}
+    for guild_id in ctx.guild_ids:
+        cursors[guild_id] = period_page_cursor(await ctx.db_manager.get_period_leaderboard_page(guild_id, "month", None, 100))
+    return lambda i: ctx.db_manager.get_period_leaderboard_page(ctx.guild(i), "month", cursors[ctx.guild(i)], 10)
+
+
+async def _voice_tick(ctx: Context):
+    gains = [(*ctx.member(i), 1) for i in range(100)]
+    return lambda i: ctx.db_manager.add_voice_xp(gains, int(time.time()))
+
+
+async def _xp_batch(ctx: Context):
+    rows = [ctx.member(i) for i in range(100)]
+    global_rows = [(user_id, 10, 5, 100, 0) for user_id, _ in rows]
+    server_rows = [(user_id, guild_id, 10, 5, 100, 0) for user_id, guild_id in rows]
+    return lambda i: ctx.db_manager.write_xp_batch(global_rows, server_rows)
+
+
+async def _drain_leaderboard(ctx: Context, guild_id):
+    async for _ in ctx.db_manager.iter_leaderboard(guild_id):
+        pass
+
+
+def _award_achievements(ctx: Context, i: int):
+    user_id, guild_id = ctx.member(i)
+    return ctx.db_manager.check_and_award_achievements(user_id, guild_id, 1 + i % 60, 1 + i)
+
+
+BENCHMARKS = [
+    simple("get_user_data.global", 5000, lambda ctx, i: ctx.db_manager.get_user_data(ctx.user(i))),
+    simple("get_user_data.guild", 5000, lambda ctx, i: ctx.db_manager.get_user_data(*ctx.member(i))),
+    simple("get_xp_state", 5000, lambda ctx, i: ctx.db_manager.get_xp_state(*ctx.member(i))),
+    simple("update_user_xp", 5000, lambda ctx, i: ctx.db_manager.update_user_xp(*ctx.member(i), 1, i)),
+    simple("check_and_award_achievements", 5000, _award_achievements),
+    Benchmark("add_voice_xp.100", 500, _voice_tick),
+    simple("get_user_rank.global", 2000, lambda ctx, i: ctx.db_manager.get_user_rank(ctx.user(i))),
+    simple("get_user_rank.guild", 2000, lambda ctx, i: ctx.db_manager.get_user_rank(*ctx.member(i))),
+    simple("get_leaderboard.global", 1000, lambda ctx, i: ctx.db_manager.get_leaderboard(None, 10)),
+    simple("get_leaderboard.guild", 1000, lambda ctx, i: ctx.db_manager.get_leaderboard(ctx.guild(i), 10)),
+    Benchmark("get_leaderboard_page.after", 1000, _after_first_page),
+    simple("get_leaderboard_snapshot.guild", 5000, lambda ctx, i: ctx.db_manager.get_leaderboard_snapshot(ctx.guild(i), 10)),
+    simple("get_period_leaderboard_page.week", 1000, lambda ctx, i: ctx.db_manager.get_period_leaderboard_page(ctx.guild(i), "week")),
+    Benchmark("get_period_leaderboard_page.after", 1000, _period_after_first_page),
+    simple("get_period_rank.week", 2000, lambda ctx, i: ctx.db_manager.get_period_rank(*ctx.member(i), "week")),
+    simple("iter_leaderboard.guild", 20, lambda ctx, i: _drain_leaderboard(ctx, ctx.guild(i))),
+    simple("get_guild_settings", 5000, lambda ctx, i: ctx.db_manager.get_guild_settings(ctx.guild(i))),
+    simple("get_xp_rules", 5000, lambda ctx, i: ctx.db_manager.get_xp_rules(ctx.guild(i))),
+    simple("update_guild_settings", 1000, lambda ctx, i: ctx.db_manager.update_guild_settings(ctx.guild(i), xp_multiplier=1.0 + i % 2)),
+    simple("get_user_achievements", 2000, lambda ctx, i: ctx.db_manager.get_user_achievements(*ctx.member(i))),
+    simple("get_rank_roles_for_level", 5000, lambda ctx, i: ctx.db_manager.get_rank_roles_for_level(ctx.guild(i), 1 + i % 60)),
+    simple("count_guild_users", 500, lambda ctx, i: ctx.db_manager.count_guild_users(ctx.guild(i))),
+    Benchmark("get_guild_levels_page", 500, _levels_page),
+    simple("set_user_level", 2000, lambda ctx, i: ctx.db_manager.set_user_level(ctx.user(i), 1 + i % 60)),
+    Benchmark("write_xp_batch.100", 500, _xp_batch),
+]
+
+
+def mode_name(args) -> str:
+    flags = [name for name, enabled in (("write-behind", args.write_behind), ("rank-index", args.rank_index)) if enabled]
+    return "+".join(flags) or "default"
+
+
+async def time_benchmark(benchmark: Benchmark, ctx: Context, scale: float) -> Dict[str, float]:
+    call = await benchmark.setup(ctx)
+    iterations = max(1, int(benchmark.iterations * scale))
+    for i in range(min(50, iterations // 10)):
+        await call(i)
+
+    samples = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        await call(i)
+        samples.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return {
+        "iterations": iterations,
+        "ops_per_second": round(iterations / elapsed, 1) if elapsed else 0.0,
+        "p50_us": round(support.percentile(samples, 0.5) * 1e6, 2),
+        "p99_us": round(support.percentile(samples, 0.99) * 1e6, 2),
+    }
+
+
+async def run(args, database: str) -> Dict[str, Dict[str, float]]:
+    support.configure(database, args.write_behind, args.rank_index)
+    from database import DatabaseManager
+
+    db_manager = DatabaseManager(database)
+    try:
+        await db_manager.init_database()
+        await db_manager.initialize_default_achievements()
+        guild_ids = [support.ID_BASE + g * 1000 for g in range(args.guilds)]
+        member_ids = support.user_ids(args.users, args.seed)
+        await support.populate(db_manager, guild_ids, member_ids, args.seed)
+        rng = random.Random(args.seed)
+        for guild_id in guild_ids:
+            for level in range(5, 61, 5):
+                await db_manager.add_rank_role(guild_id, level, rng.randrange(10 ** 17))
+            await db_manager.add_xp_rule(guild_id, "pattern", r"(?i:free\s*nitro)")
+        ctx = Context(db_manager, guild_ids, member_ids)
+
+        results = {}
+        for benchmark in BENCHMARKS:
+            if args.only and args.only not in benchmark.name:
+                continue
+            results[benchmark.name] = await time_benchmark(benchmark, ctx, args.scale)
+            print(f"  {benchmark.name}", file=sys.stderr)
+        return results
+    finally:
+        await db_manager.close()
+
+
+def print_report(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    """Print the results next to ``baseline``; returns the names that regressed."""
+    regressions = []
+    print(f"{'benchmark':<34}{'ops/s':>12}{'p50 us':>11}{'p99 us':>11}{'base p50':>11}{'change':>9}")
+    for name, result in results.items():
+        line = f"{name:<34}{result['ops_per_second']:>12,.0f}{result['p50_us']:>11.1f}{result['p99_us']:>11.1f}"
+        base = baseline.get(name)
+        if base:
+            change = result["p50_us"] / base["p50_us"] - 1 if base["p50_us"] else 0.0
+            line += f"{base['p50_us']:>11.1f}{change:>+9.0%}"
+            if change > threshold:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark every DatabaseManager method.")
+    parser.add_argument("--guilds", type=int, default=20, help="number of guilds")
+    parser.add_argument("--users", type=int, default=20000, help="number of stored users, spread over the guilds")
+    parser.add_argument("--write-behind", action="store_true", help="enable XP_WRITE_BEHIND")
+    parser.add_argument("--rank-index", action="store_true", help="enable RANK_INDEX_ENABLED")
+    parser.add_argument("--only", default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every benchmark's iteration count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baselines", default=BASELINES_FILE, help="baselines file")
+    parser.add_argument("--save", action="store_true", help="store these results as the baselines for this mode")
+    parser.add_argument("--threshold", type=float, default=0.25, help="median slowdown reported as a regression (default: 0.25)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if anything regressed")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="knott-microbench-")
+    try:
+        results = asyncio.run(run(args, os.path.join(workdir, "bench.db")))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    mode = mode_name(args)
+    config = {"guilds": args.guilds, "users": args.users}
+    baselines = support.load_json(args.baselines) or {}
+    stored = baselines.get(mode, {})
+    baseline = stored.get("results", {})
+    if baseline and stored.get("config") != config:
+        print(f"Baselines for {mode} were recorded with {stored.get('config')}, not comparing", file=sys.stderr)
+        baseline = {}
+
+    print(f"mode: {mode}, {args.users} users in {args.guilds} guilds")
+    regressions = print_report(results, baseline, args.threshold)
+
+    if args.json:
+        support.save_json(args.json, {"mode": mode, "config": config, "environment": support.environment(), "results": results})
+    if args.save:
+        # Keep baselines of benchmarks that were skipped with --only
+        merged = dict(baseline)
+        merged.update(results)
+        baselines[mode] = {"config": config, "environment": support.environment(), "results": merged}
+        support.save_json(args.baselines, baselines)
+        print(f"Saved baselines for {mode} to {args.baselines}")
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Helpers shared by the load test and the microbenchmarks."""
+import json
+import os
+import platform
+import random
+import sqlite3
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import botsettings
+
+# Snowflake-sized ids so keys and partitioning behave like production
+ID_BASE = 100_000_000_000_000_000
+
+
+def configure(database: str, write_behind: bool, rank_index: bool, cooldown: int = None):
+    """Point the bot's settings at a scratch database before anything reads them."""
+    botsettings.database_name = database
+    botsettings.xp_write_behind = write_behind
+    botsettings.rank_index_enabled = rank_index
+    if cooldown is not None:
+        botsettings.xp_cooldown = cooldown
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def user_ids(count: int, seed: int) -> List[int]:
+    rng = random.Random(seed)
+    return [ID_BASE + rng.randrange(10 ** 16) for _ in range(count)]
+
+
+def skewed_choices(count: int, population: int, skew: float, seed: int) -> np.ndarray:
+    """``count`` indexes into ``population`` following a Zipf law of exponent ``skew``.
+
+    A skew of 0 is uniform; around 1 a few users send most of the messages,
+    which is what busy servers look like.
+    """
+    weights = 1.0 / np.arange(1, population + 1) ** skew
+    rng = np.random.default_rng(seed)
+    return rng.choice(population, size=count, p=weights / weights.sum())
+
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    if not len(samples):
+        return 0.0
+    return float(np.percentile(samples, q * 100))
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    """Count, mean, p50 and p99 of latencies in seconds, reported in milliseconds."""
+    return {
+        "count": len(samples),
+        "mean_ms": float(np.mean(samples)) * 1000 if len(samples) else 0.0,
+        "p50_ms": percentile(samples, 0.5) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
+
+
+def database_size(path: str) -> int:
+    """Bytes used by the database file and its WAL and shared-memory files."""
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal", "-shm") if os.path.exists(path + suffix))
+
+
+async def checkpoint(db_manager):
+    """Fold the WAL back into the database file so its size can be compared."""
+    async with db_manager._write() as db:
+        await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def peak_rss_mb() -> Optional[float]:
+    from metrics import peak_rss_bytes
+    peak = peak_rss_bytes()
+    return peak / (1024 * 1024) if peak is not None else None
+
+
+async def populate(db_manager, guild_ids: List[int], member_ids: List[int], seed: int, batch_size: int = 5000):
+    """Store a random score for every member in every guild they belong to.
+
+    Member ``i`` belongs to guild ``i % len(guild_ids)``. Each member also
+    gained some XP on a random recent day, for the rolling-window boards.
+    """
+    import leveling
+
+    rng = random.Random(seed)
+    base = botsettings.level_up_base
+    today = leveling.xp_day(int(time.time()))
+    global_rows: List[Tuple] = []
+    server_rows: List[Tuple] = []
+    period_gains: List[Tuple] = []
+    for i, user_id in enumerate(member_ids):
+        level = rng.randint(1, 60)
+        messages = rng.randint(1, 5000)
+        guild_id = guild_ids[i % len(guild_ids)]
+        global_rows.append((user_id, rng.randrange(level * base), level, messages, 0))
+        server_rows.append((user_id, guild_id, rng.randrange(level * base), level, messages, 0))
+        period_gains.append((user_id, guild_id, today - rng.randrange(leveling.BUCKET_DAYS), rng.randint(1, 500)))
+        if len(global_rows) >= batch_size:
+            await db_manager.write_xp_batch(global_rows, server_rows, period_gains=period_gains)
+            global_rows, server_rows, period_gains = [], [], []
+    if global_rows:
+        await db_manager.write_xp_batch(global_rows, server_rows, period_gains=period_gains)
+
+
+def load_json(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_json(path: str, data: dict):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
@@ -8,12 +8,84 @@ token = os.getenv('BOT_TOKEN', 'your_bot_token_here')
 owner_id = int(os.getenv('OWNER_ID', '697509268085145630'))
 
 database_name = os.getenv('DATABASE_NAME', 'Users.db')
+database_readers = int(os.getenv('DATABASE_READERS', '4'))
+database_synchronous = os.getenv('DATABASE_SYNCHRONOUS', 'NORMAL')
+database_cache_size = int(os.getenv('DATABASE_CACHE_SIZE', '-16000'))
+database_mmap_size = int(os.getenv('DATABASE_MMAP_SIZE', '268435456'))
+database_busy_timeout = int(os.getenv('DATABASE_BUSY_TIMEOUT', '5000'))
 
 command_prefix = os.getenv('COMMAND_PREFIX', 'k')
 xp_per_message = int(os.getenv('XP_PER_MESSAGE', '1'))
 xp_cooldown = int(os.getenv('XP_COOLDOWN', '60'))
+cooldown_max_entries = int(os.getenv('COOLDOWN_MAX_ENTRIES', '1000000'))
 level_up_base = int(os.getenv('LEVEL_UP_BASE', '50'))
 
+# Voice XP: every VOICE_XP_INTERVAL seconds, members active in a voice channel with
+# at least VOICE_XP_MIN_MEMBERS active humans earn VOICE_XP_PER_TICK (times the multiplier)
+voice_xp_enabled = os.getenv('VOICE_XP_ENABLED', 'False').lower() == 'true'
+voice_xp_interval = int(os.getenv('VOICE_XP_INTERVAL', '60'))
+voice_xp_per_tick = int(os.getenv('VOICE_XP_PER_TICK', '1'))
+voice_xp_min_members = int(os.getenv('VOICE_XP_MIN_MEMBERS', '2'))
+
+# Write-behind XP: batch XP gains in memory and flush them in one transaction
+xp_write_behind = os.getenv('XP_WRITE_BEHIND', 'False').lower() == 'true'
+xp_flush_interval_ms = int(os.getenv('XP_FLUSH_INTERVAL_MS', '1000'))
+xp_flush_max_events = int(os.getenv('XP_FLUSH_MAX_EVENTS', '500'))
+# Append-only log of buffered XP so a crash loses nothing between flushes
+xp_event_log_dir = os.getenv('XP_EVENT_LOG_DIR', '')
+xp_event_log_segment_mb = int(os.getenv('XP_EVENT_LOG_SEGMENT_MB', '64'))
+
+# In-memory rank index for O(log n) rank and leaderboard lookups
+rank_index_enabled = os.getenv('RANK_INDEX_ENABLED', 'False').lower() == 'true'
+rank_index_max_guilds = int(os.getenv('RANK_INDEX_MAX_GUILDS', '1000'))
+
+# Low-memory mode: no full member cache or startup chunking, members are fetched when needed
+low_memory_mode = os.getenv('LOW_MEMORY_MODE', 'False').lower() == 'true'
+member_cache_size = int(os.getenv('MEMBER_CACHE_SIZE', '10000'))
+member_cache_ttl = int(os.getenv('MEMBER_CACHE_TTL', '300'))
+
+# Display names for leaderboard rows of users the client hasn't cached
+display_name_cache_size = int(os.getenv('DISPLAY_NAME_CACHE_SIZE', '100000'))
+display_name_fetch_concurrency = int(os.getenv('DISPLAY_NAME_FETCH_CONCURRENCY', '2'))
+display_name_fetches_per_second = float(os.getenv('DISPLAY_NAME_FETCHES_PER_SECOND', '5'))
+
+# Guild settings cache (TTL in seconds, 0 = never expire)
+guild_settings_cache_size = int(os.getenv('GUILD_SETTINGS_CACHE_SIZE', '10000'))
+guild_settings_cache_ttl = float(os.getenv('GUILD_SETTINGS_CACHE_TTL', '0'))
+
+# Leaderboard snapshot cache (TTL in seconds caps how stale a board can get)
+leaderboard_cache_size = int(os.getenv('LEADERBOARD_CACHE_SIZE', '1000'))
+leaderboard_cache_ttl = float(os.getenv('LEADERBOARD_CACHE_TTL', '60'))
+
+# Last achievement-checked counters remembered per (user, guild)
+achievement_evaluated_cache_size = int(os.getenv('ACHIEVEMENT_EVALUATED_CACHE_SIZE', '100000'))
+
+# XP processing pipeline (workers, total queue size, ms to wait for room before dropping)
+xp_workers = int(os.getenv('XP_WORKERS', '4'))
+xp_queue_size = int(os.getenv('XP_QUEUE_SIZE', '10000'))
+xp_enqueue_timeout_ms = int(os.getenv('XP_ENQUEUE_TIMEOUT_MS', '250'))
+
+# Announcements (messages per second and burst per channel, queued messages per channel,
+# seconds between level-up digests, 0 = announce every level-up on its own)
+announce_rate = float(os.getenv('ANNOUNCE_RATE', '1'))
+announce_burst = int(os.getenv('ANNOUNCE_BURST', '5'))
+announce_queue_size = int(os.getenv('ANNOUNCE_QUEUE_SIZE', '100'))
+announce_digest_interval = float(os.getenv('ANNOUNCE_DIGEST_INTERVAL', '0'))
+
+# Prometheus metrics endpoint (port 0 = disabled)
+metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+metrics_port = int(os.getenv('METRICS_PORT', '0'))
+
+# Sharding (see launcher.py): SHARD_COUNT 0 lets Discord pick, SHARD_IDS limits
+# this process to some shards, STORAGE_SOCKET sends writes to the storage process
+shard_count = int(os.getenv('SHARD_COUNT', '0'))
+shard_ids = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id.strip()]
+storage_socket = os.getenv('STORAGE_SOCKET', '')
+
+# Background rank role sync (concurrent role edits across all syncs, users per checkpoint)
+role_sync_concurrency = int(os.getenv('ROLE_SYNC_CONCURRENCY', '4'))
+role_sync_page_size = int(os.getenv('ROLE_SYNC_PAGE_SIZE', '500'))
+
 enable_global_leaderboard = os.getenv('ENABLE_GLOBAL_LEADERBOARD', 'True').lower() == 'true'
 enable_server_leaderboard = os.getenv('ENABLE_SERVER_LEADERBOARD', 'True').lower() == 'true'
 enable_rank_roles = os.getenv('ENABLE_RANK_ROLES', 'False').lower() == 'true'
@@ -1,6 +1,5 @@
 import discord
 from discord.ext import commands
-from database import DatabaseManager
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,7 +7,7 @@ logger = logging.getLogger(__name__)
 class AchievementCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db_manager = DatabaseManager()
+        self.db_manager = bot.db_manager
     
     @commands.command()
     async def achievements(self, ctx, member: discord.Member = None):
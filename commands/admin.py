@@ -1,15 +1,25 @@
 import discord
 from discord.ext import commands
 import botsettings
-from database import DatabaseManager
 import logging
+import xprules
 
 logger = logging.getLogger(__name__)
 
+def describe_rule(rule: str, value: str) -> str:
+    """Which messages an XP rule covers, e.g. "sent in #memes"."""
+    if rule == xprules.CHANNEL:
+        return f"sent in <#{value}>"
+    if rule == xprules.ROLE:
+        return f"from members with <@&{value}>"
+    if rule == xprules.MIN_LENGTH:
+        return f"shorter than {value} characters"
+    return f"matching `{value}`"
+
 class AdminCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db_manager = DatabaseManager()
+        self.db_manager = bot.db_manager
     
     @commands.command()
     @commands.has_permissions(administrator=True)
@@ -81,7 +91,7 @@ class AdminCommands(commands.Cog):
     async def toggleannouncements(self, ctx):
         try:
             guild_settings = await self.db_manager.get_guild_settings(ctx.guild.id)
-            current_setting = guild_settings[2] if guild_settings else True
+            current_setting = guild_settings.announcement_enabled if guild_settings else True
             
             new_setting = not current_setting
             await self.db_manager.update_guild_settings(
@@ -138,5 +148,109 @@ class AdminCommands(commands.Cog):
             logger.error(f"Error in serverconfig command: {e}")
             await ctx.send("An error occurred while retrieving server configuration.")
 
+    async def _rule_value(self, ctx, rule: str, value: str) -> str:
+        """Turn a channel or role given by mention or name into its id."""
+        if rule == xprules.CHANNEL:
+            return str((await commands.GuildChannelConverter().convert(ctx, value)).id)
+        if rule == xprules.ROLE:
+            return str((await commands.RoleConverter().convert(ctx, value)).id)
+        return value
+    
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def addxprule(self, ctx, rule: str, *, value: str):
+        try:
+            rule = rule.lower()
+            try:
+                value = xprules.parse_rule(rule, await self._rule_value(ctx, rule, value))
+            except (ValueError, commands.BadArgument) as e:
+                await ctx.send(str(e))
+                return
+            
+            rules = await self.db_manager.get_xp_rules(ctx.guild.id)
+            if len(rules.rules) >= xprules.MAX_RULES:
+                await ctx.send(f"A server can have at most {xprules.MAX_RULES} XP rules.")
+                return
+            if rule == xprules.PATTERN:
+                try:
+                    xprules.check_pattern_cost(
+                        [pattern for kind, pattern in rules.rules if kind == xprules.PATTERN] + [value]
+                    )
+                except ValueError as e:
+                    await ctx.send(str(e))
+                    return
+            
+            await self.db_manager.add_xp_rule(ctx.guild.id, rule, value)
+            
+            embed = discord.Embed(
+                title="XP Rule Added",
+                description=f"Messages {describe_rule(rule, value)} will no longer earn XP.",
+                color=discord.Color.green()
+            )
+            await ctx.send(embed=embed)
+            
+        except Exception as e:
+            logger.error(f"Error in addxprule command: {e}")
+            await ctx.send("An error occurred while adding the XP rule.")
+    
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def removexprule(self, ctx, rule: str, *, value: str = None):
+        try:
+            rule = rule.lower()
+            if value is not None:
+                try:
+                    value = xprules.parse_rule(rule, await self._rule_value(ctx, rule, value))
+                except (ValueError, commands.BadArgument) as e:
+                    await ctx.send(str(e))
+                    return
+            elif rule not in xprules.RULE_TYPES:
+                await ctx.send(f"Rule type must be one of: {', '.join(xprules.RULE_TYPES)}")
+                return
+            
+            removed = await self.db_manager.remove_xp_rule(ctx.guild.id, rule, value)
+            
+            embed = discord.Embed(
+                title="XP Rule Removed" if removed else "No Matching XP Rule",
+                description=f"Removed {removed} {rule} rule{'s' if removed != 1 else ''}.",
+                color=discord.Color.orange() if removed else discord.Color.red()
+            )
+            await ctx.send(embed=embed)
+            
+        except Exception as e:
+            logger.error(f"Error in removexprule command: {e}")
+            await ctx.send("An error occurred while removing the XP rule.")
+    
+    # Named apart from the command so it doesn't shadow the xprules module
+    @commands.command(name="xprules")
+    @commands.has_permissions(administrator=True)
+    async def xprules_command(self, ctx):
+        try:
+            rules = await self.db_manager.get_xp_rules(ctx.guild.id)
+            
+            if not rules:
+                embed = discord.Embed(
+                    title="No XP Rules",
+                    description="Every message that isn't a command earns XP. Add rules with `kaddxprule <channel|role|minlength|pattern> <value>`.",
+                    color=discord.Color.blue()
+                )
+            else:
+                description = "Messages earn no XP when they are:\n" + "\n".join(
+                    f"• {describe_rule(rule, value)}" for rule, value in rules.rules
+                )
+                if len(description) > 4096:
+                    description = description[:4095] + "…"
+                embed = discord.Embed(
+                    title=f"XP Rules - {ctx.guild.name}",
+                    description=description,
+                    color=discord.Color.blue()
+                )
+            
+            await ctx.send(embed=embed)
+            
+        except Exception as e:
+            logger.error(f"Error in xprules command: {e}")
+            await ctx.send("An error occurred while retrieving XP rules.")
+
 async def setup(bot):
     await bot.add_cog(AdminCommands(bot))
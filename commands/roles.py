@@ -1,14 +1,38 @@
 import discord
 from discord.ext import commands
-from database import DatabaseManager
+import getrank
 import logging
+from rolesync import RoleSyncJobs
 
 logger = logging.getLogger(__name__)
 
 class RoleCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db_manager = DatabaseManager()
+        self.db_manager = bot.db_manager
+        self.role_sync = RoleSyncJobs(bot)
+        self._resumed = False
+    
+    async def cog_load(self):
+        if self.bot.is_ready():
+            await self._resume_syncs()
+    
+    async def cog_unload(self):
+        # Keep the checkpoints so the syncs resume after a reload
+        self.role_sync.stop_all()
+    
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self._resume_syncs()
+    
+    async def _resume_syncs(self):
+        if self._resumed:
+            return
+        self._resumed = True
+        try:
+            await self.role_sync.resume_all()
+        except Exception as e:
+            logger.error(f"Error resuming rank syncs: {e}")
     
     @commands.command()
     @commands.has_permissions(administrator=True)
@@ -87,45 +111,103 @@ class RoleCommands(commands.Cog):
     
     @commands.command()
     @commands.has_permissions(administrator=True)
-    async def syncranks(self, ctx):
+    async def addranktitle(self, ctx, level: int, *, title: str):
         try:
-            rank_roles = await self.db_manager.get_rank_roles(ctx.guild.id)
-            if not rank_roles:
-                await ctx.send("No rank roles configured for this server.")
+            if level < 1 or len(title) > 100:
+                await ctx.send("Level must be at least 1 and titles can be at most 100 characters.")
                 return
             
-            leaderboard = await self.db_manager.get_leaderboard(ctx.guild.id, limit=1000)
-            
-            synced_count = 0
-            for user_id, level, xp, total_messages in leaderboard:
-                member = ctx.guild.get_member(user_id)
-                if not member:
-                    continue
-                
-                earned_roles = []
-                for role_level, role_id in rank_roles:
-                    if level >= role_level:
-                        role = ctx.guild.get_role(role_id)
-                        if role:
-                            earned_roles.append(role)
-                
-                for role in earned_roles:
-                    if role not in member.roles:
-                        try:
-                            await member.add_roles(role, reason="Rank role sync")
-                            synced_count += 1
-                        except discord.Forbidden:
-                            logger.warning(f"Cannot add role {role.name} to {member.display_name}")
-                        except Exception as e:
-                            logger.error(f"Error adding role to {member.display_name}: {e}")
+            await self.db_manager.set_rank_title(ctx.guild.id, level, title)
+            getrank.set_guild_ladder(ctx.guild.id, await self.db_manager.get_rank_titles(ctx.guild.id))
             
             embed = discord.Embed(
-                title="Rank Sync Complete",
-                description=f"Synced roles for {synced_count} users based on their current levels.",
+                title="Rank Title Added",
+                description=f"Users from level {level} will now have the title **{title}**!",
                 color=discord.Color.green()
             )
             await ctx.send(embed=embed)
             
+        except Exception as e:
+            logger.error(f"Error in addranktitle command: {e}")
+            await ctx.send("An error occurred while adding the rank title.")
+    
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def removeranktitle(self, ctx, level: int):
+        try:
+            await self.db_manager.remove_rank_title(ctx.guild.id, level)
+            getrank.set_guild_ladder(ctx.guild.id, await self.db_manager.get_rank_titles(ctx.guild.id))
+            
+            embed = discord.Embed(
+                title="Rank Title Removed",
+                description=f"Custom rank title for level {level} has been removed.",
+                color=discord.Color.orange()
+            )
+            await ctx.send(embed=embed)
+            
+        except Exception as e:
+            logger.error(f"Error in removeranktitle command: {e}")
+            await ctx.send("An error occurred while removing the rank title.")
+    
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def ranktitles(self, ctx):
+        try:
+            rank_titles = await self.db_manager.get_rank_titles(ctx.guild.id)
+            
+            if not rank_titles:
+                embed = discord.Embed(
+                    title="No Custom Rank Titles",
+                    description="This server uses the default rank titles. Use `kaddranktitle <level> <title>` to add your own.",
+                    color=discord.Color.orange()
+                )
+                await ctx.send(embed=embed)
+                return
+            
+            embed = discord.Embed(
+                title="Custom Rank Titles",
+                description="Users get these titles from the specified levels:",
+                color=discord.Color.blue()
+            )
+            embed.add_field(
+                name="Rank Titles",
+                value="\n".join(f"Level {level}: {title}" for level, title in rank_titles[:25]),
+                inline=False
+            )
+            
+            await ctx.send(embed=embed)
+            
+        except Exception as e:
+            logger.error(f"Error in ranktitles command: {e}")
+            await ctx.send("An error occurred while retrieving rank titles.")
+    
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def syncranks(self, ctx, action: str = None):
+        try:
+            if action == "cancel":
+                if await self.role_sync.cancel(ctx.guild.id):
+                    await ctx.send("Rank sync cancelled.")
+                else:
+                    await ctx.send("No rank sync is running for this server.")
+                return
+            if action not in (None, "restart"):
+                await ctx.send("Usage: `ksyncranks [restart|cancel]`")
+                return
+            
+            rank_roles = await self.db_manager.get_rank_roles(ctx.guild.id)
+            if not rank_roles:
+                await ctx.send("No rank roles configured for this server.")
+                return
+            if not ctx.guild.me.guild_permissions.manage_roles:
+                await ctx.send("I need the Manage Roles permission to sync rank roles.")
+                return
+            if self.role_sync.running(ctx.guild.id):
+                await ctx.send("A rank sync is already running. Use `ksyncranks cancel` to stop it.")
+                return
+            
+            await self.role_sync.start(ctx.guild, ctx.channel, restart=action == "restart")
+            
         except Exception as e:
             logger.error(f"Error in syncranks command: {e}")
             await ctx.send("An error occurred while syncing ranks.")
@@ -0,0 +1,51 @@
+from typing import Dict
+import botsettings
+
+
+class CooldownStore:
+    """Per-(user, guild) XP cooldowns that expire on their own.
+
+    Entries live in two generations. Once the current generation is a full
+    cooldown old it becomes the previous one and the old previous generation
+    is dropped wholesale, which can only discard entries that have already
+    expired. Keys are packed into a single int, so a check-and-set is two dict
+    lookups and no allocation beyond the key itself.
+
+    ``max_entries`` is a hard cap on the total number of entries. Reaching it
+    rotates early, which may let a few users earn XP slightly before their
+    cooldown is up, but never lets memory grow past the cap.
+    """
+
+    def __init__(self, cooldown: int = None, max_entries: int = None):
+        self.cooldown = botsettings.xp_cooldown if cooldown is None else cooldown
+        self.max_entries = max_entries or botsettings.cooldown_max_entries
+        self._current: Dict[int, int] = {}
+        self._previous: Dict[int, int] = {}
+        self._generation_start = 0
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def try_acquire(self, user_id: int, guild_id: int, now: int) -> bool:
+        """Start a cooldown and return True, or return False if one is running."""
+        if now - self._generation_start >= self.cooldown or len(self._current) >= self.max_entries // 2:
+            self._rotate(now)
+
+        key = (user_id << 64) | guild_id
+        last = self._current.get(key)
+        if last is None:
+            last = self._previous.get(key)
+        if last is not None and now - last < self.cooldown:
+            return False
+
+        self._current[key] = now
+        return True
+
+    def clear(self):
+        self._current = {}
+        self._previous = {}
+
+    def _rotate(self, now: int):
+        self._previous = self._current
+        self._current = {}
+        self._generation_start = now
@@ -1,95 +1,504 @@
 import aiosqlite
 import asyncio
-from typing import Optional, List, Tuple
+import functools
+import inspect
+import logging
+import pathlib
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, NamedTuple, Optional, List, Tuple
 import botsettings
+import leveling
+from achievementcatalog import Achievement, AchievementCatalog
+from cache import LRUCache, MISSING
+from leaderboardcache import LeaderboardCache, LeaderboardSnapshot
+from metrics import instrument_methods
+from rankindex import RankIndexes
+from storage import StorageClient
+from xpbuffer import XPWriteBuffer
+from xprules import MIN_LENGTH, NO_RULES, XPRules
 
+logger = logging.getLogger(__name__)
+
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+# Boards are ordered by (level, xp, user_id) so every row has a unique
+# position that the next page can continue from
+GLOBAL_LEADERBOARD_SQL = "SELECT user_id, global_level, global_xp, total_global_messages FROM global_users ORDER BY global_level DESC, global_xp DESC, user_id DESC LIMIT ?"
+GLOBAL_LEADERBOARD_AFTER_SQL = "SELECT user_id, global_level, global_xp, total_global_messages FROM global_users WHERE (global_level, global_xp, user_id) < (?, ?, ?) ORDER BY global_level DESC, global_xp DESC, user_id DESC LIMIT ?"
+SERVER_LEADERBOARD_SQL = "SELECT user_id, level, xp, total_messages FROM users WHERE guild_id = ? ORDER BY level DESC, xp DESC, user_id DESC LIMIT ?"
+SERVER_LEADERBOARD_AFTER_SQL = "SELECT user_id, level, xp, total_messages FROM users WHERE guild_id = ? AND (level, xp, user_id) < (?, ?, ?) ORDER BY level DESC, xp DESC, user_id DESC LIMIT ?"
+GLOBAL_RANK_SQL = "SELECT COUNT(*) + 1 FROM global_users WHERE (global_level, global_xp) > (?, ?)"
+SERVER_RANK_SQL = "SELECT COUNT(*) + 1 FROM users WHERE guild_id = ? AND (level, xp) > (?, ?)"
+# Rolling-window boards (see leveling.PERIODS); guild_id 0 is the global board
+PERIOD_LEADERBOARD_SQL = "SELECT user_id, xp FROM xp_window WHERE guild_id = ? AND period = ? ORDER BY xp DESC, user_id DESC LIMIT ?"
+PERIOD_LEADERBOARD_AFTER_SQL = "SELECT user_id, xp FROM xp_window WHERE guild_id = ? AND period = ? AND (xp, user_id) < (?, ?) ORDER BY xp DESC, user_id DESC LIMIT ?"
+PERIOD_RANK_SQL = "SELECT COUNT(*) + 1 FROM xp_window WHERE guild_id = ? AND period = ? AND xp > ?"
+# Rank role syncs page through a guild's users but plan roles by global level, as level-ups grant them
+SERVER_LEVELS_FIRST_PAGE_SQL = "SELECT users.user_id, users.level, users.xp, COALESCE(global_users.global_level, 1) FROM users LEFT JOIN global_users ON global_users.user_id = users.user_id WHERE users.guild_id = ? ORDER BY users.level, users.xp, users.user_id LIMIT ?"
+SERVER_LEVELS_PAGE_SQL = "SELECT users.user_id, users.level, users.xp, COALESCE(global_users.global_level, 1) FROM users LEFT JOIN global_users ON global_users.user_id = users.user_id WHERE users.guild_id = ? AND (users.level, users.xp, users.user_id) > (?, ?, ?) ORDER BY users.level, users.xp, users.user_id LIMIT ?"
+
+# Hot read queries and the index each one must be answered from, checked by
+# check_query_plans() so a query change can't silently fall back to a scan
+INDEXED_QUERIES = [
+    (GLOBAL_LEADERBOARD_SQL, (10,), "idx_global_users_board"),
+    (GLOBAL_LEADERBOARD_AFTER_SQL, (1, 0, 0, 10), "idx_global_users_board"),
+    (SERVER_LEADERBOARD_SQL, (0, 10), "idx_users_guild_rank"),
+    (SERVER_LEADERBOARD_AFTER_SQL, (0, 1, 0, 0, 10), "idx_users_guild_rank"),
+    (GLOBAL_RANK_SQL, (1, 0), "idx_global_users_board"),
+    (SERVER_RANK_SQL, (0, 1, 0), "idx_users_guild_rank"),
+    (SERVER_LEVELS_PAGE_SQL, (0, 1, 0, 0, 10), "idx_users_guild_rank"),
+    (PERIOD_LEADERBOARD_SQL, (0, "week", 10), "idx_xp_window_board"),
+    (PERIOD_LEADERBOARD_AFTER_SQL, (0, "week", 1, 0, 10), "idx_xp_window_board"),
+    (PERIOD_RANK_SQL, (0, "week", 1), "idx_xp_window_board"),
+]
+
+
+class GuildSettings(NamedTuple):
+    xp_multiplier: float
+    level_up_channel: Optional[int]
+    announcement_enabled: bool
+    custom_prefix: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> "GuildSettings":
+        # RETURNING yields values before column affinity is applied, so
+        # normalise the types here for both read and write paths
+        xp_multiplier, level_up_channel, announcement_enabled, custom_prefix = row
+        return cls(
+            float(xp_multiplier) if xp_multiplier is not None else 1.0,
+            level_up_channel,
+            bool(announcement_enabled) if announcement_enabled is not None else True,
+            custom_prefix
+        )
+
+
+GUILD_SETTINGS_COLUMNS = "xp_multiplier, level_up_channel, announcement_enabled, custom_prefix"
+
+
+def page_cursor(rows: List[Tuple]) -> Optional[Tuple[int, int, int]]:
+    """Cursor for the leaderboard page after ``rows``, or None if they are empty."""
+    if not rows:
+        return None
+    user_id, level, xp, _ = rows[-1]
+    return level, xp, user_id
+
+
+def period_page_cursor(rows: List[Tuple]) -> Optional[Tuple[int, int]]:
+    """page_cursor() for the ``(user_id, xp)`` rows of a rolling-window board."""
+    if not rows:
+        return None
+    user_id, xp = rows[-1]
+    return xp, user_id
+
+
+class RankSyncState(NamedTuple):
+    """Checkpoint of a rank role sync; ``last_*`` is the last user synced."""
+    guild_id: int
+    channel_id: Optional[int]
+    message_id: Optional[int]
+    last_level: Optional[int] = None
+    last_xp: Optional[int] = None
+    last_user_id: Optional[int] = None
+    processed: int = 0
+    changed: int = 0
+    failed: int = 0
+
+
+RANK_SYNC_STATE_COLUMNS = "guild_id, channel_id, message_id, last_level, last_xp, last_user_id, processed, changed, failed"
+
+# Most ids per IN (...) list when reading XP state in bulk
+STATE_QUERY_CHUNK = 500
+
+# Tables holding a level curve: table -> (level column, xp column)
+LEVEL_TABLES = {
+    "global_users": ("global_level", "global_xp"),
+    "users": ("level", "xp"),
+}
+
+
+async def _create_schema(db: aiosqlite.Connection):
+    """Version 1: the schema from before it was versioned, created where missing."""
+    # Global users table for cross-server data
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS global_users (
+            user_id INTEGER PRIMARY KEY,
+            global_xp INTEGER DEFAULT 0,
+            global_level INTEGER DEFAULT 1,
+            total_global_messages INTEGER DEFAULT 0,
+            last_global_message_time INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Server-specific users table (kept for server-specific stats)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER,
+            xp INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            last_message_time INTEGER DEFAULT 0,
+            total_messages INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, guild_id)
+        )
+    """)
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS guild_settings (
+            guild_id INTEGER PRIMARY KEY,
+            xp_multiplier REAL DEFAULT 1.0,
+            level_up_channel INTEGER,
+            announcement_enabled BOOLEAN DEFAULT TRUE,
+            custom_prefix TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS rank_roles (
+            guild_id INTEGER,
+            level INTEGER,
+            role_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (guild_id, level)
+        )
+    """)
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS achievements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            requirement_type TEXT NOT NULL,
+            requirement_value INTEGER NOT NULL,
+            reward_xp INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_achievements (
+            user_id INTEGER,
+            guild_id INTEGER,
+            achievement_id INTEGER,
+            earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, guild_id, achievement_id),
+            FOREIGN KEY (achievement_id) REFERENCES achievements (id)
+        )
+    """)
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS rank_titles (
+            guild_id INTEGER,
+            level INTEGER,
+            title TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (guild_id, level)
+        )
+    """)
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS rank_sync_state (
+            guild_id INTEGER PRIMARY KEY,
+            channel_id INTEGER,
+            message_id INTEGER,
+            last_level INTEGER,
+            last_xp INTEGER,
+            last_user_id INTEGER,
+            processed INTEGER DEFAULT 0,
+            changed INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Last XP event log record already written to the tables (see xplog.py)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS xp_log_state (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            lsn INTEGER NOT NULL
+        )
+    """)
+    
+    # Covering indexes for leaderboards and rank counts
+    await db.execute("DROP INDEX IF EXISTS idx_global_users_rank")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_global_users_board ON global_users (global_level, global_xp, user_id, total_global_messages)"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_guild_rank ON users (guild_id, level, xp, user_id, total_messages)"
+    )
+
+
+async def _create_display_names(db: aiosqlite.Connection):
+    """Version 2: names of users seen or fetched, for rendering leaderboards."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS display_names (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL
+        )
+    """)
+
+
+async def _create_xp_rules(db: aiosqlite.Connection):
+    """Version 3: per-guild rules for which messages earn XP (see xprules.py)."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS xp_rules (
+            guild_id INTEGER,
+            rule TEXT,
+            value TEXT,
+            PRIMARY KEY (guild_id, rule, value)
+        )
+    """)
+
+
+async def _create_xp_windows(db: aiosqlite.Connection):
+    """Version 4: daily XP buckets and the rolling-window totals kept from them."""
+    # XP gained per user and day; guild_id 0 holds the global buckets
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS xp_daily (
+            day INTEGER,
+            guild_id INTEGER,
+            user_id INTEGER,
+            xp INTEGER NOT NULL,
+            PRIMARY KEY (day, guild_id, user_id)
+        ) WITHOUT ROWID
+    """)
+    # Sum of the buckets from xp_window_state.first_day on, per period
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS xp_window (
+            guild_id INTEGER,
+            period TEXT,
+            user_id INTEGER,
+            xp INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, period, user_id)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_xp_window_board ON xp_window (guild_id, period, xp, user_id)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS xp_window_state (
+            period TEXT PRIMARY KEY,
+            first_day INTEGER NOT NULL
+        )
+    """)
+
+
+# Schema migrations in order; MIGRATIONS[n] takes a database from version n
+# to n + 1. Only ever append, a released migration must not change.
+MIGRATIONS = [_create_schema, _create_display_names, _create_xp_rules, _create_xp_windows]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+# Names of the DatabaseManager methods that change the database
+# (recompute_levels forwards itself, as its progress callback can't be sent)
+WRITE_METHODS = {"recompute_levels"}
+
+
+def writes(method):
+    """Mark a method that changes the database.
+
+    In a sharded deployment only the storage process writes: shards send the
+    call there (see storage.py) instead of running it themselves.
+    """
+    WRITE_METHODS.add(method.__name__)
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if self.storage is not None:
+            return await self.storage.call(method.__name__, args, kwargs)
+        return await method(self, *args, **kwargs)
+    return wrapper
+
+
+@instrument_methods
 class DatabaseManager:
-    def __init__(self, db_path: str = None):
+    """Shared data layer for the bot and all of its cogs.
+
+    Writes go through a single long-lived writer connection guarded by a lock,
+    reads are served from a small pool of read-only connections. The database
+    runs in WAL mode so readers never block the writer (and vice versa).
+
+    With ``storage_socket`` set (STORAGE_SOCKET) this process is a shard:
+    reads still use the local pool, writes go to the storage process, and
+    the changes it broadcasts keep the in-memory views below current.
+    """
+
+    def __init__(self, db_path: str = None, reader_count: int = None, storage_socket: str = None,
+                 write_behind: bool = None):
         self.db_path = db_path or botsettings.database_name
-        
+        self.reader_count = botsettings.database_readers if reader_count is None else reader_count
+        storage_socket = botsettings.storage_socket if storage_socket is None else storage_socket
+        write_behind = botsettings.xp_write_behind if write_behind is None else write_behind
+        self.storage: Optional[StorageClient] = StorageClient(storage_socket, self) if storage_socket else None
+        # Called with every change this process writes, e.g. to tell shards about it
+        self.on_change: Optional[Callable[[tuple], None]] = None
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_connections: List[aiosqlite.Connection] = []
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        # Optional write-behind mode: XP gains are batched in memory
+        self.xp_buffer: Optional[XPWriteBuffer] = XPWriteBuffer(self) if write_behind and self.storage is None else None
+        # Optional in-memory rank index answering rank and top-K in O(log n)
+        self.rank_index: Optional[RankIndexes] = RankIndexes(self) if botsettings.rank_index_enabled else None
+        # Top-of-board snapshots, dropped when a score that could show on them changes
+        self.leaderboards = LeaderboardCache()
+        # Guild settings are read on every message but almost never change
+        self.guild_settings_cache = LRUCache(
+            botsettings.guild_settings_cache_size,
+            ttl=botsettings.guild_settings_cache_ttl
+        )
+        # Compiled XP rules, checked on every message; a guild without rules holds NO_RULES
+        self.xp_rules_cache = LRUCache(
+            botsettings.guild_settings_cache_size,
+            ttl=botsettings.guild_settings_cache_ttl
+        )
+        self._achievement_catalog: Optional[AchievementCatalog] = None
+        # period -> first day its rolling window covers, set by roll_xp_windows()
+        self._window_starts: Dict[str, int] = {}
+        # (level, total_messages) at the last achievement check per (user, guild)
+        self._achievements_evaluated = LRUCache(botsettings.achievement_evaluated_cache_size)
+
+    def cache_hit_rates(self) -> Dict[str, float]:
+        return {
+            "guild_settings": self.guild_settings_cache.hit_rate,
+            "xp_rules": self.xp_rules_cache.hit_rate,
+            "leaderboard": self.leaderboards.hit_rate,
+            "achievements_evaluated": self._achievements_evaluated.hit_rate,
+        }
+    
+    async def connect(self):
+        """Open the writer and reader connections. Safe to call more than once."""
+        if self._writer is not None:
+            return
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            writer = await aiosqlite.connect(self.db_path)
+            await writer.execute("PRAGMA journal_mode = WAL")
+            await self._apply_pragmas(writer)
+
+            readers = []
+            if self.reader_count > 0 and self.db_path != ":memory:":
+                uri = pathlib.Path(self.db_path).resolve().as_uri() + "?mode=ro"
+                for _ in range(self.reader_count):
+                    reader = await aiosqlite.connect(uri, uri=True)
+                    await self._apply_pragmas(reader)
+                    readers.append(reader)
+
+            self._write_lock = asyncio.Lock()
+            if readers:
+                self._readers = asyncio.Queue()
+                for reader in readers:
+                    self._readers.put_nowait(reader)
+            self._reader_connections = readers
+            self._writer = writer
+
+    async def close(self):
+        """Flush buffered XP and close every pooled connection."""
+        if self.storage is not None:
+            await self.storage.close()
+        if self._writer is None:
+            return
+        if self.xp_buffer is not None:
+            await self.xp_buffer.close()
+        for reader in self._reader_connections:
+            await reader.close()
+        await self._writer.close()
+        self._writer = None
+        self._readers = None
+        self._reader_connections = []
+
+    async def _apply_pragmas(self, db: aiosqlite.Connection):
+        synchronous = botsettings.database_synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid DATABASE_SYNCHRONOUS value: {botsettings.database_synchronous}")
+        await db.execute(f"PRAGMA synchronous = {synchronous}")
+        await db.execute(f"PRAGMA cache_size = {int(botsettings.database_cache_size)}")
+        await db.execute(f"PRAGMA mmap_size = {int(botsettings.database_mmap_size)}")
+        await db.execute(f"PRAGMA busy_timeout = {int(botsettings.database_busy_timeout)}")
+
+    @asynccontextmanager
+    async def _read(self):
+        """Borrow a read-only connection from the pool."""
+        await self.connect()
+        if self._readers is None:
+            yield self._writer
+            return
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def _write(self):
+        """Run a write transaction on the shared writer connection."""
+        await self.connect()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    @writes
     async def init_database(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            # Global users table for cross-server data
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS global_users (
-                    user_id INTEGER PRIMARY KEY,
-                    global_xp INTEGER DEFAULT 0,
-                    global_level INTEGER DEFAULT 1,
-                    total_global_messages INTEGER DEFAULT 0,
-                    last_global_message_time INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Server-specific users table (kept for server-specific stats)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    guild_id INTEGER,
-                    xp INTEGER DEFAULT 0,
-                    level INTEGER DEFAULT 1,
-                    last_message_time INTEGER DEFAULT 0,
-                    total_messages INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(user_id, guild_id)
-                )
-            """)
-            
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS guild_settings (
-                    guild_id INTEGER PRIMARY KEY,
-                    xp_multiplier REAL DEFAULT 1.0,
-                    level_up_channel INTEGER,
-                    announcement_enabled BOOLEAN DEFAULT TRUE,
-                    custom_prefix TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS rank_roles (
-                    guild_id INTEGER,
-                    level INTEGER,
-                    role_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (guild_id, level)
-                )
-            """)
-            
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS achievements (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    requirement_type TEXT NOT NULL,
-                    requirement_value INTEGER NOT NULL,
-                    reward_xp INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_achievements (
-                    user_id INTEGER,
-                    guild_id INTEGER,
-                    achievement_id INTEGER,
-                    earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (user_id, guild_id, achievement_id),
-                    FOREIGN KEY (achievement_id) REFERENCES achievements (id)
-                )
-            """)
-            
-            await db.commit()
+        """Bring the schema up to SCHEMA_VERSION, running only the migrations it lacks.
+
+        The version lives in ``PRAGMA user_version``, so on an up-to-date
+        database this is a single pragma read.
+        """
+        async with self._write() as db:
+            # Explicit, so each migration commits together with its version bump
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute("PRAGMA user_version") as cursor:
+                version = (await cursor.fetchone())[0]
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(f"Database schema version {version} is newer than this bot supports ({SCHEMA_VERSION})")
+            for version, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+                await migrate(db)
+                await db.execute(f"PRAGMA user_version = {version}")
+                logger.info(f"Migrated database schema to version {version}")
+        
+        for problem in await self.check_query_plans():
+            logger.warning(problem)
+        # Before replaying buffered XP, so it lands in the right windows
+        await self.roll_xp_windows()
+        if self.xp_buffer is not None:
+            await self.xp_buffer.recover()
+    
+    async def check_query_plans(self) -> List[str]:
+        """Return a description of every hot query that doesn't use its index."""
+        problems = []
+        async with self._read() as db:
+            for sql, params, index in INDEXED_QUERIES:
+                async with db.execute(f"EXPLAIN QUERY PLAN {sql}", params) as cursor:
+                    plan = [row[3] for row in await cursor.fetchall()]
+                if not any(index in step for step in plan) or any("TEMP B-TREE" in step for step in plan):
+                    problems.append(f"Query not using {index}: {sql} -> {'; '.join(plan)}")
+        return problems
+    
     
     async def get_user_data(self, user_id: int, guild_id: int = None) -> Optional[Tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
+        if self.xp_buffer is not None:
+            buffered = self.xp_buffer.get_global(user_id)
+            if buffered:
+                return buffered
+        async with self._read() as db:
             # Always return global data for levels and XP
-            cursor = await db.execute(
+            async with db.execute(
                 "SELECT global_xp, global_level, total_global_messages FROM global_users WHERE user_id = ?",
                 (user_id,)
-            )
-            global_data = await cursor.fetchone()
+            ) as cursor:
+                global_data = await cursor.fetchone()
             
             if global_data:
                 return global_data
@@ -99,205 +508,865 @@ class DatabaseManager:
     
     async def get_global_user_data(self, user_id: int) -> Optional[Tuple]:
         """Get global user data across all servers"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
+        if self.xp_buffer is not None:
+            buffered = self.xp_buffer.get_global(user_id)
+            if buffered:
+                return buffered
+        async with self._read() as db:
+            async with db.execute(
                 "SELECT global_xp, global_level, total_global_messages FROM global_users WHERE user_id = ?",
                 (user_id,)
-            )
-            return await cursor.fetchone()
+            ) as cursor:
+                return await cursor.fetchone()
     
     async def get_server_user_data(self, user_id: int, guild_id: int) -> Optional[Tuple]:
         """Get server-specific user data"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
+        if self.xp_buffer is not None:
+            buffered = self.xp_buffer.get_server(user_id, guild_id)
+            if buffered:
+                return buffered
+        async with self._read() as db:
+            async with db.execute(
                 "SELECT xp, level, total_messages FROM users WHERE user_id = ? AND guild_id = ?",
                 (user_id, guild_id)
-            )
-            return await cursor.fetchone()
+            ) as cursor:
+                return await cursor.fetchone()
     
-    async def update_user_xp(self, user_id: int, guild_id: int, xp_gain: int, current_time: int) -> Tuple[int, int, bool]:
-        async with aiosqlite.connect(self.db_path) as db:
-            # Update global user data
-            cursor = await db.execute(
-                "SELECT global_xp, global_level, total_global_messages FROM global_users WHERE user_id = ?",
-                (user_id,)
+    async def get_xp_state(self, user_id: int, guild_id: int) -> Tuple[Optional[Tuple], Optional[Tuple]]:
+        """Global and server ``(xp, level, total_messages, last_message_time)`` rows in one query."""
+        async with self._read() as db:
+            async with db.execute("""
+                SELECT g.global_xp, g.global_level, g.total_global_messages, g.last_global_message_time,
+                       u.xp, u.level, u.total_messages, u.last_message_time
+                FROM (SELECT 1)
+                LEFT JOIN global_users g ON g.user_id = ?
+                LEFT JOIN users u ON u.user_id = ? AND u.guild_id = ?
+            """, (user_id, user_id, guild_id)) as cursor:
+                row = await cursor.fetchone()
+        global_row = row[:4] if row[1] is not None else None
+        server_row = row[4:] if row[5] is not None else None
+        return global_row, server_row
+    
+    async def get_xp_states(self, keys: List[Tuple[int, int]]) -> Dict[Tuple[int, int], Tuple[Optional[Tuple], Optional[Tuple]]]:
+        """get_xp_state() for many ``(user_id, guild_id)`` pairs, a few queries in all."""
+        user_ids = list({user_id for user_id, _ in keys})
+        users_by_guild: Dict[int, List[int]] = {}
+        for user_id, guild_id in keys:
+            users_by_guild.setdefault(guild_id, []).append(user_id)
+        
+        global_rows = {}
+        server_rows = {}
+        async with self._read() as db:
+            for i in range(0, len(user_ids), STATE_QUERY_CHUNK):
+                chunk = user_ids[i:i + STATE_QUERY_CHUNK]
+                async with db.execute(f"""
+                    SELECT user_id, global_xp, global_level, total_global_messages, last_global_message_time
+                    FROM global_users WHERE user_id IN ({", ".join("?" * len(chunk))})
+                """, chunk) as cursor:
+                    for row in await cursor.fetchall():
+                        global_rows[row[0]] = row[1:]
+            for guild_id, guild_user_ids in users_by_guild.items():
+                for i in range(0, len(guild_user_ids), STATE_QUERY_CHUNK):
+                    chunk = guild_user_ids[i:i + STATE_QUERY_CHUNK]
+                    async with db.execute(f"""
+                        SELECT user_id, xp, level, total_messages, last_message_time
+                        FROM users WHERE guild_id = ? AND user_id IN ({", ".join("?" * len(chunk))})
+                    """, [guild_id] + chunk) as cursor:
+                        for row in await cursor.fetchall():
+                            server_rows[(row[0], guild_id)] = row[1:]
+        return {(user_id, guild_id): (global_rows.get(user_id), server_rows.get((user_id, guild_id)))
+                for user_id, guild_id in keys}
+    
+    async def get_xp_log_lsn(self) -> int:
+        """The last XP event log record written back to the tables, 0 if none."""
+        async with self._read() as db:
+            async with db.execute("SELECT lsn FROM xp_log_state WHERE id = 0") as cursor:
+                row = await cursor.fetchone()
+        return row[0] if row else 0
+    
+    @writes
+    async def update_user_xp(self, user_id: int, guild_id: int, xp_gain: int, current_time: int) -> Tuple[int, int, bool, int]:
+        """Apply an XP gain and return ``(new_xp, new_level, leveled_up, total_messages)``."""
+        return (await self._apply_xp([(user_id, guild_id, xp_gain, current_time)]))[0]
+    
+    @writes
+    async def update_user_xp_batch(self, events: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, bool, int]]:
+        """Apply ``(user_id, guild_id, xp_gain, current_time)`` gains in one transaction.
+        
+        Returns what update_user_xp() would have returned for each event, in order.
+        """
+        return await self._apply_xp(events)
+    
+    @writes
+    async def add_voice_xp(self, gains: List[Tuple[int, int, int]], current_time: int) -> List[Tuple[int, int, int, int]]:
+        """Award ``(user_id, guild_id, xp_gain)`` voice XP in one transaction.
+        
+        Unlike update_user_xp() no message is counted. Returns ``(user_id,
+        guild_id, new_level, total_messages)`` for every user whose global
+        level went up.
+        """
+        if not gains:
+            return []
+        if self.xp_buffer is not None:
+            level_ups = []
+            for (user_id, guild_id, _), leveled_up in zip(gains, await self.xp_buffer.add_voice(gains, current_time)):
+                new_xp, new_level, total_messages = self.xp_buffer.get_global(user_id)
+                server_xp, server_level, server_messages = self.xp_buffer.get_server(user_id, guild_id)
+                self._publish_score(None, user_id, new_level, new_xp, total_messages)
+                self._publish_score(guild_id, user_id, server_level, server_xp, server_messages)
+                if leveled_up:
+                    level_ups.append((user_id, guild_id, new_level, total_messages))
+            return level_ups
+        
+        # Staged in a temporary table so each table is updated by one statement
+        # however many users are in voice; new rows level up like leveling.apply_xp(),
+        # so an existing row adds back the level-up to get the whole gain from excluded
+        async with self._write() as db:
+            await db.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS voice_gains (user_id INTEGER, guild_id INTEGER, xp_gain INTEGER)"
             )
-            global_result = await cursor.fetchone()
-            
-            if global_result:
-                current_xp, current_level, total_messages = global_result
-                new_xp = current_xp + xp_gain
-                new_level = current_level
-                leveled_up = False
-                
-                # Check for level up
-                xp_needed = current_level * botsettings.level_up_base
-                if new_xp >= xp_needed:
-                    new_xp = new_xp - xp_needed
-                    new_level += 1
-                    leveled_up = True
-                
-                # Update global user data
-                await db.execute(
-                    "UPDATE global_users SET global_xp = ?, global_level = ?, last_global_message_time = ?, total_global_messages = ? WHERE user_id = ?",
-                    (new_xp, new_level, current_time, total_messages + 1, user_id)
-                )
-            else:
-                # Create new global user
-                new_xp = xp_gain
-                new_level = 1
-                leveled_up = False
+            await db.execute("DELETE FROM temp.voice_gains")
+            await db.executemany("INSERT INTO temp.voice_gains (user_id, guild_id, xp_gain) VALUES (?, ?, ?)", gains)
+            params = {"base": botsettings.level_up_base}
+            async with db.execute("""
+                INSERT INTO global_users (user_id, global_xp, global_level)
+                SELECT user_id,
+                       CASE WHEN SUM(xp_gain) >= :base THEN SUM(xp_gain) - :base ELSE SUM(xp_gain) END,
+                       CASE WHEN SUM(xp_gain) >= :base THEN 2 ELSE 1 END
+                FROM temp.voice_gains WHERE true GROUP BY user_id
+                ON CONFLICT(user_id) DO UPDATE SET
+                    global_xp = CASE
+                        WHEN global_xp + excluded.global_xp + (excluded.global_level - 1) * :base >= global_level * :base
+                        THEN global_xp + excluded.global_xp + (excluded.global_level - 1) * :base - global_level * :base
+                        ELSE global_xp + excluded.global_xp + (excluded.global_level - 1) * :base
+                    END,
+                    global_level = CASE
+                        WHEN global_xp + excluded.global_xp + (excluded.global_level - 1) * :base >= global_level * :base
+                        THEN global_level + 1
+                        ELSE global_level
+                    END
+                RETURNING user_id, global_xp, global_level, total_global_messages
+            """, params) as cursor:
+                global_scores = await cursor.fetchall()
+            async with db.execute("""
+                INSERT INTO users (user_id, guild_id, xp, level)
+                SELECT user_id, guild_id,
+                       CASE WHEN xp_gain >= :base THEN xp_gain - :base ELSE xp_gain END,
+                       CASE WHEN xp_gain >= :base THEN 2 ELSE 1 END
+                FROM temp.voice_gains WHERE true
+                ON CONFLICT(user_id, guild_id) DO UPDATE SET
+                    xp = CASE
+                        WHEN xp + excluded.xp + (excluded.level - 1) * :base >= level * :base
+                        THEN xp + excluded.xp + (excluded.level - 1) * :base - level * :base
+                        ELSE xp + excluded.xp + (excluded.level - 1) * :base
+                    END,
+                    level = CASE
+                        WHEN xp + excluded.xp + (excluded.level - 1) * :base >= level * :base
+                        THEN level + 1
+                        ELSE level
+                    END
+                RETURNING user_id, guild_id, xp, level, total_messages
+            """, params) as cursor:
+                server_scores = await cursor.fetchall()
+            await self._add_voice_period_xp(db, leveling.xp_day(current_time))
+        
+        gained: Dict[int, int] = {}
+        guild_of: Dict[int, int] = {}
+        for user_id, guild_id, xp_gain in gains:
+            gained[user_id] = gained.get(user_id, 0) + xp_gain
+            guild_of.setdefault(user_id, guild_id)
+        level_ups = []
+        for user_id, new_xp, new_level, total_messages in global_scores:
+            self._publish_score(None, user_id, new_level, new_xp, total_messages)
+            # As in _apply_xp, only a level-up leaves less XP than was gained
+            if new_xp < gained[user_id]:
+                level_ups.append((user_id, guild_of[user_id], new_level, total_messages))
+        for user_id, guild_id, server_xp, server_level, server_messages in server_scores:
+            self._publish_score(guild_id, user_id, server_level, server_xp, server_messages)
+        return level_ups
+    
+    async def _apply_xp(self, events: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, bool, int]]:
+        if self.xp_buffer is not None:
+            results = []
+            for user_id, guild_id, xp_gain, current_time in events:
+                result = await self.xp_buffer.add(user_id, guild_id, xp_gain, current_time)
+                new_xp, new_level, _, total_messages = result
+                server_xp, server_level, server_messages = self.xp_buffer.get_server(user_id, guild_id)
+                self._publish_score(None, user_id, new_level, new_xp, total_messages)
+                self._publish_score(guild_id, user_id, server_level, server_xp, server_messages)
+                results.append(result)
+            return results
+        
+        scores = []
+        async with self._write() as db:
+            for user_id, guild_id, xp_gain, current_time in events:
+                params = {
+                    "user_id": user_id,
+                    "guild_id": guild_id,
+                    "xp_gain": xp_gain,
+                    "now": current_time,
+                    "base": botsettings.level_up_base,
+                }
+                # Update global user data and check for level up in one statement
+                async with db.execute("""
+                    INSERT INTO global_users (user_id, global_xp, global_level, last_global_message_time, total_global_messages)
+                    VALUES (:user_id, :xp_gain, 1, :now, 1)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        global_xp = CASE
+                            WHEN global_xp + excluded.global_xp >= global_level * :base
+                            THEN global_xp + excluded.global_xp - global_level * :base
+                            ELSE global_xp + excluded.global_xp
+                        END,
+                        global_level = CASE
+                            WHEN global_xp + excluded.global_xp >= global_level * :base
+                            THEN global_level + 1
+                            ELSE global_level
+                        END,
+                        last_global_message_time = excluded.last_global_message_time,
+                        total_global_messages = total_global_messages + 1
+                    RETURNING global_xp, global_level, total_global_messages
+                """, params) as cursor:
+                    global_score = await cursor.fetchone()
                 
-                await db.execute(
-                    "INSERT INTO global_users (user_id, global_xp, global_level, last_global_message_time, total_global_messages) VALUES (?, ?, ?, ?, ?)",
-                    (user_id, new_xp, new_level, current_time, 1)
-                )
-            
-            # Also update server-specific data for server stats
-            cursor = await db.execute(
-                "SELECT xp, level, total_messages FROM users WHERE user_id = ? AND guild_id = ?",
-                (user_id, guild_id)
-            )
-            server_result = await cursor.fetchone()
-            
-            if server_result:
-                server_xp, server_level, server_messages = server_result
-                await db.execute(
-                    "UPDATE users SET xp = xp + ?, last_message_time = ?, total_messages = ? WHERE user_id = ? AND guild_id = ?",
-                    (xp_gain, current_time, server_messages + 1, user_id, guild_id)
-                )
-            else:
-                await db.execute(
-                    "INSERT INTO users (user_id, guild_id, xp, level, last_message_time, total_messages) VALUES (?, ?, ?, ?, ?, ?)",
-                    (user_id, guild_id, xp_gain, 1, current_time, 1)
-                )
+                # Also update server-specific data for server stats
+                async with db.execute("""
+                    INSERT INTO users (user_id, guild_id, xp, level, last_message_time, total_messages)
+                    VALUES (:user_id, :guild_id, :xp_gain, 1, :now, 1)
+                    ON CONFLICT(user_id, guild_id) DO UPDATE SET
+                        xp = CASE
+                            WHEN xp + excluded.xp >= level * :base
+                            THEN xp + excluded.xp - level * :base
+                            ELSE xp + excluded.xp
+                        END,
+                        level = CASE
+                            WHEN xp + excluded.xp >= level * :base
+                            THEN level + 1
+                            ELSE level
+                        END,
+                        last_message_time = excluded.last_message_time,
+                        total_messages = total_messages + 1
+                    RETURNING xp, level, total_messages
+                """, params) as cursor:
+                    server_score = await cursor.fetchone()
+                scores.append((global_score, server_score))
+            await self._add_period_xp(db, [
+                (user_id, guild_id, leveling.xp_day(current_time), xp_gain)
+                for user_id, guild_id, xp_gain, current_time in events
+            ])
+        
+        results = []
+        for (user_id, guild_id, xp_gain, _), (global_score, server_score) in zip(events, scores):
+            new_xp, new_level, total_messages = global_score
+            server_xp, server_level, server_messages = server_score
+            self._publish_score(None, user_id, new_level, new_xp, total_messages)
+            self._publish_score(guild_id, user_id, server_level, server_xp, server_messages)
             
-            await db.commit()
-            return new_xp, new_level, leveled_up
+            # Stored XP is always below the level threshold, so after a level-up
+            # the remaining XP is the only way to end up below what was just gained
+            leveled_up = new_xp < xp_gain
+            results.append((new_xp, new_level, leveled_up, total_messages))
+        return results
+    
+    def _publish_score(self, guild_id: Optional[int], user_id: int, level: int, xp: int, messages: int):
+        """Tell the in-memory views of a board (``guild_id`` None = global) about a new score."""
+        if self.rank_index is not None:
+            self.rank_index.set_score(guild_id, user_id, level, xp, messages)
+        self.leaderboards.score_changed(guild_id, user_id, level, xp)
+        if self.on_change is not None:
+            self.on_change(("score", guild_id, user_id, level, xp, messages))
+    
+    def apply_change(self, change: tuple):
+        """Bring the in-memory views up to date with a change another process wrote."""
+        kind = change[0]
+        if kind == "score":
+            self._publish_score(*change[1:])
+        elif kind == "guild_settings":
+            _, guild_id, row = change
+            self.guild_settings_cache.set(guild_id, GuildSettings.from_row(row))
+        elif kind == "xp_rules":
+            _, guild_id, rules = change
+            self.xp_rules_cache.set(guild_id, XPRules(rules) if rules else NO_RULES)
+        elif kind == "achievements":
+            self._achievement_catalog = None
+        elif kind == "reset":
+            self.reset_cached_state()
+    
+    def reset_cached_state(self):
+        """Forget everything cached from the database; it is reloaded on demand."""
+        if self.rank_index is not None:
+            self.rank_index.invalidate()
+        self.leaderboards.clear()
+        self.guild_settings_cache.clear()
+        self.xp_rules_cache.clear()
+        self._achievements_evaluated.clear()
+        self._achievement_catalog = None
+    
+    @writes
+    async def write_xp_batch(self, global_rows: List[Tuple], server_rows: List[Tuple], log_lsn: int = None,
+                             period_gains: List[Tuple[int, int, int, int]] = ()):
+        """Persist buffered XP in a single transaction.
+
+        ``global_rows`` hold ``(user_id, global_xp, global_level,
+        total_global_messages, last_global_message_time)`` and ``server_rows``
+        hold ``(user_id, guild_id, xp, level, total_messages,
+        last_message_time)``, both as absolute values. ``period_gains`` are
+        the ``(user_id, guild_id, day, xp)`` gained since the last batch, for
+        the rolling-window boards. ``log_lsn`` is the last XP event log
+        record they include, when the buffer keeps a log.
+        """
+        async with self._write() as db:
+            if log_lsn is not None:
+                await db.execute("""
+                    INSERT INTO xp_log_state (id, lsn) VALUES (0, ?)
+                    ON CONFLICT(id) DO UPDATE SET lsn = excluded.lsn
+                """, (log_lsn,))
+            await db.executemany("""
+                INSERT INTO global_users (user_id, global_xp, global_level, total_global_messages, last_global_message_time)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    global_xp = excluded.global_xp,
+                    global_level = excluded.global_level,
+                    total_global_messages = excluded.total_global_messages,
+                    last_global_message_time = excluded.last_global_message_time
+            """, global_rows)
+            await db.executemany("""
+                INSERT INTO users (user_id, guild_id, xp, level, total_messages, last_message_time)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, guild_id) DO UPDATE SET
+                    xp = excluded.xp,
+                    level = excluded.level,
+                    total_messages = excluded.total_messages,
+                    last_message_time = excluded.last_message_time
+            """, server_rows)
+            await self._add_period_xp(db, period_gains)
+    
+    async def _add_period_xp(self, db: aiosqlite.Connection, gains: List[Tuple[int, int, int, int]]):
+        """Add ``(user_id, guild_id, day, xp)`` gains to the daily buckets and the windows covering them.
+
+        Runs inside the caller's write transaction, so the buckets and
+        windows always move together with the all-time totals.
+        """
+        if not gains:
+            return
+        oldest_day = min(self._window_starts.values(), default=None)
+        buckets: Dict[Tuple[int, int, int], int] = {}
+        for user_id, guild_id, day, xp in gains:
+            if oldest_day is not None and day < oldest_day:
+                # Replayed from before every window (and already pruned)
+                continue
+            for board_id in (guild_id, 0):
+                key = (day, board_id, user_id)
+                buckets[key] = buckets.get(key, 0) + xp
+        
+        windows: Dict[Tuple[int, str, int], int] = {}
+        for (day, board_id, user_id), xp in buckets.items():
+            for period, first_day in self._window_starts.items():
+                if day >= first_day:
+                    key = (board_id, period, user_id)
+                    windows[key] = windows.get(key, 0) + xp
+        
+        await db.executemany("""
+            INSERT INTO xp_daily (day, guild_id, user_id, xp) VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, guild_id, user_id) DO UPDATE SET xp = xp + excluded.xp
+        """, [(*key, xp) for key, xp in buckets.items()])
+        await db.executemany("""
+            INSERT INTO xp_window (guild_id, period, user_id, xp) VALUES (?, ?, ?, ?)
+            ON CONFLICT(guild_id, period, user_id) DO UPDATE SET xp = xp + excluded.xp
+        """, [(*key, xp) for key, xp in windows.items()])
+    
+    async def _add_voice_period_xp(self, db: aiosqlite.Connection, day: int):
+        """_add_period_xp() for the gains staged in ``temp.voice_gains``, all on ``day``.
+
+        One statement per table and window however many users are in voice.
+        """
+        if day < min(self._window_starts.values(), default=day):
+            return
+        gains_sql = """
+            SELECT guild_id, user_id, SUM(xp_gain) AS xp FROM temp.voice_gains WHERE true GROUP BY guild_id, user_id
+            UNION ALL
+            SELECT 0, user_id, SUM(xp_gain) FROM temp.voice_gains WHERE true GROUP BY user_id
+        """
+        await db.execute(f"""
+            INSERT INTO xp_daily (day, guild_id, user_id, xp)
+            SELECT ?, guild_id, user_id, xp FROM ({gains_sql}) WHERE true
+            ON CONFLICT(day, guild_id, user_id) DO UPDATE SET xp = xp + excluded.xp
+        """, (day,))
+        for period, first_day in self._window_starts.items():
+            if day >= first_day:
+                await db.execute(f"""
+                    INSERT INTO xp_window (guild_id, period, user_id, xp)
+                    SELECT guild_id, ?, user_id, xp FROM ({gains_sql}) WHERE true
+                    ON CONFLICT(guild_id, period, user_id) DO UPDATE SET xp = xp + excluded.xp
+                """, (period,))
+    
+    @writes
+    async def roll_xp_windows(self, today: int = None) -> int:
+        """Move every rolling window up to end on ``today`` and prune expired buckets.
+
+        The buckets of days leaving a window are subtracted from its totals
+        in one statement, so this costs one pass over those days however
+        old the totals are. Returns how many buckets were pruned.
+        """
+        today = leveling.xp_day(int(time.time())) if today is None else today
+        async with self._write() as db:
+            async with db.execute("SELECT period, first_day FROM xp_window_state") as cursor:
+                starts = dict(await cursor.fetchall())
+            for period, days in leveling.PERIODS.items():
+                first_day = today - days + 1
+                previous = starts.get(period)
+                if previous is not None and first_day <= previous:
+                    continue
+                if previous is None:
+                    # A new period starts out with whatever buckets there are
+                    await db.execute("""
+                        INSERT INTO xp_window (guild_id, period, user_id, xp)
+                        SELECT guild_id, ?, user_id, SUM(xp) FROM xp_daily WHERE day >= ? GROUP BY guild_id, user_id
+                    """, (period, first_day))
+                else:
+                    await db.execute("""
+                        UPDATE xp_window SET xp = xp_window.xp - expired.xp
+                        FROM (
+                            SELECT guild_id, user_id, SUM(xp) AS xp FROM xp_daily
+                            WHERE day >= ? AND day < ? GROUP BY guild_id, user_id
+                        ) AS expired
+                        WHERE xp_window.period = ? AND xp_window.guild_id = expired.guild_id
+                          AND xp_window.user_id = expired.user_id
+                    """, (previous, first_day, period))
+                    await db.execute("DELETE FROM xp_window WHERE period = ? AND xp <= 0", (period,))
+                await db.execute("""
+                    INSERT INTO xp_window_state (period, first_day) VALUES (?, ?)
+                    ON CONFLICT(period) DO UPDATE SET first_day = excluded.first_day
+                """, (period, first_day))
+                starts[period] = first_day
+            cursor = await db.execute("DELETE FROM xp_daily WHERE day <= ?", (today - leveling.BUCKET_DAYS,))
+            pruned = cursor.rowcount
+        self._window_starts = {period: starts[period] for period in leveling.PERIODS}
+        return pruned
     
     async def get_leaderboard(self, guild_id: int = None, limit: int = 20) -> List[Tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
+        return await self.get_leaderboard_page(guild_id, None, limit)
+    
+    async def get_leaderboard_page(self, guild_id: int = None, after: Optional[Tuple[int, int, int]] = None,
+                                   limit: int = 10) -> List[Tuple]:
+        """``(user_id, level, xp, total_messages)`` rows, best first.
+        
+        ``after`` is the ``(level, xp, user_id)`` of the last row of the
+        previous page (see page_cursor()), so any page is one index seek
+        however deep into the board it is.
+        """
+        if self.rank_index is not None:
+            index = await self.rank_index.get(guild_id)
+            return index.top(limit) if after is None else index.after(*after, limit)
+        
+        async with self._read() as db:
             if guild_id:
                 # Server-specific leaderboard (server stats only)
-                cursor = await db.execute(
-                    "SELECT user_id, level, xp, total_messages FROM users WHERE guild_id = ? ORDER BY level DESC, xp DESC LIMIT ?",
-                    (guild_id, limit)
-                )
+                if after is None:
+                    sql, params = SERVER_LEADERBOARD_SQL, (guild_id, limit)
+                else:
+                    sql, params = SERVER_LEADERBOARD_AFTER_SQL, (guild_id, *after, limit)
             else:
                 # Global leaderboard using global_users table
-                cursor = await db.execute(
-                    "SELECT user_id, global_level, global_xp, total_global_messages FROM global_users ORDER BY global_level DESC, global_xp DESC LIMIT ?",
-                    (limit,)
-                )
-            return await cursor.fetchall()
+                if after is None:
+                    sql, params = GLOBAL_LEADERBOARD_SQL, (limit,)
+                else:
+                    sql, params = GLOBAL_LEADERBOARD_AFTER_SQL, (*after, limit)
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+    
+    async def iter_leaderboard(self, guild_id: int = None, page_size: int = 1000):
+        """Stream a whole board, best first, in pages of ``page_size`` rows."""
+        after = None
+        while True:
+            rows = await self.get_leaderboard_page(guild_id, after, page_size)
+            if not rows:
+                return
+            yield rows
+            after = page_cursor(rows)
+    
+    async def get_leaderboard_snapshot(self, guild_id: int = None, limit: int = 10) -> LeaderboardSnapshot:
+        """Cached top of a board; identical requests skip the database entirely."""
+        return await self.leaderboards.get(guild_id, limit, lambda: self._load_leaderboard(guild_id, limit))
+    
+    async def _load_leaderboard(self, guild_id: Optional[int], limit: int) -> List[Tuple]:
+        if self.xp_buffer is not None and self.rank_index is None:
+            # Buffered gains aren't in the tables yet, and once flushed they
+            # won't invalidate a snapshot read without them, so write them first
+            await self.xp_buffer.flush()
+        return await self.get_leaderboard(guild_id, limit)
     
     async def get_user_rank(self, user_id: int, guild_id: int = None) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            if guild_id:
-                # Server-specific rank (but still use global level for consistency)
-                cursor = await db.execute(
-                    "SELECT COUNT(*) + 1 FROM global_users WHERE (global_level > (SELECT global_level FROM global_users WHERE user_id = ?) OR (global_level = (SELECT global_level FROM global_users WHERE user_id = ?) AND global_xp > (SELECT global_xp FROM global_users WHERE user_id = ?)))",
-                    (user_id, user_id, user_id)
-                )
-            else:
-                # Global rank
-                cursor = await db.execute(
-                    "SELECT COUNT(*) + 1 FROM global_users WHERE (global_level > (SELECT global_level FROM global_users WHERE user_id = ?) OR (global_level = (SELECT global_level FROM global_users WHERE user_id = ?) AND global_xp > (SELECT global_xp FROM global_users WHERE user_id = ?)))",
-                    (user_id, user_id, user_id)
-                )
-            result = await cursor.fetchone()
+        if self.rank_index is not None:
+            index = await self.rank_index.get(guild_id)
+            rank = index.rank(user_id)
+            return rank if rank is not None else len(index) + 1
+        
+        if guild_id:
+            user_data = await self.get_server_user_data(user_id, guild_id)
+            sql = SERVER_RANK_SQL
+        else:
+            user_data = await self.get_global_user_data(user_id)
+            sql = GLOBAL_RANK_SQL
+        if not user_data:
+            return 1
+        xp, level, _ = user_data
+        params = (guild_id, level, xp) if guild_id else (level, xp)
+        async with self._read() as db:
+            # Row-value comparison keeps this a single range count on the index
+            async with db.execute(sql, params) as cursor:
+                result = await cursor.fetchone()
             return result[0] if result else 0
     
-    async def get_guild_settings(self, guild_id: int) -> Optional[Tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                "SELECT xp_multiplier, level_up_channel, announcement_enabled, custom_prefix FROM guild_settings WHERE guild_id = ?",
+    async def get_period_leaderboard_page(self, guild_id: int = None, period: str = "week",
+                                          after: Optional[Tuple[int, int]] = None, limit: int = 10) -> List[Tuple]:
+        """``(user_id, xp)`` rows of XP gained in a rolling window (see leveling.PERIODS), best first.
+        
+        ``after`` is the ``(xp, user_id)`` of the last row of the previous
+        page (see period_page_cursor()).
+        """
+        async with self._read() as db:
+            if after is None:
+                cursor = await db.execute(PERIOD_LEADERBOARD_SQL, (guild_id or 0, period, limit))
+            else:
+                cursor = await db.execute(PERIOD_LEADERBOARD_AFTER_SQL, (guild_id or 0, period, *after, limit))
+            async with cursor:
+                return await cursor.fetchall()
+    
+    async def get_period_rank(self, user_id: int, guild_id: int = None, period: str = "week") -> Optional[Tuple[int, int]]:
+        """``(xp, rank)`` of a user in a rolling window, or None if they gained no XP in it."""
+        async with self._read() as db:
+            async with db.execute(
+                "SELECT xp FROM xp_window WHERE guild_id = ? AND period = ? AND user_id = ?",
+                (guild_id or 0, period, user_id)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return None
+            async with db.execute(PERIOD_RANK_SQL, (guild_id or 0, period, row[0])) as cursor:
+                (rank,) = await cursor.fetchone()
+        return row[0], rank
+    
+    async def iter_scores(self, guild_id: int = None, chunk_size: int = 10000):
+        """Stream ``(user_id, level, xp, total_messages)`` rows in chunks."""
+        if guild_id:
+            sql = "SELECT user_id, level, xp, total_messages FROM users WHERE guild_id = ?"
+            params = (guild_id,)
+        else:
+            sql = "SELECT user_id, global_level, global_xp, total_global_messages FROM global_users"
+            params = ()
+        async with self._read() as db:
+            async with db.execute(sql, params) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+    
+    @writes
+    async def set_user_level(self, user_id: int, level: int):
+        """Set a user's global level, starting them at 0 XP into it."""
+        if self.xp_buffer is not None and self.xp_buffer.set_global_level(user_id, level, 0):
+            xp, level, messages = self.xp_buffer.get_global(user_id)
+        else:
+            async with self._write() as db:
+                async with db.execute("""
+                    INSERT INTO global_users (user_id, global_xp, global_level) VALUES (?, 0, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET global_xp = 0, global_level = excluded.global_level
+                    RETURNING global_xp, global_level, total_global_messages
+                """, (user_id, level)) as cursor:
+                    xp, level, messages = await cursor.fetchone()
+        self._publish_score(None, user_id, level, xp, messages)
+    
+    async def recompute_levels(self, old_base: int, new_base: int = None, chunk_size: int = 50000,
+                               progress: Callable = None) -> Dict[str, int]:
+        """Re-level every stored user after the XP curve changed from ``old_base``.
+        
+        Each user keeps the total XP they earned; only its split into level and
+        XP towards the next level changes. Tables are streamed in rowid order,
+        ``chunk_size`` rows at a time, one transaction per chunk, and
+        ``progress(table, done, total, elapsed)`` (sync or async) is called
+        after every chunk. Returns the number of rows changed per table.
+        """
+        new_base = new_base or botsettings.level_up_base
+        if self.storage is not None:
+            # A progress callback can't cross processes; the storage process runs it without one
+            return await self.storage.call("recompute_levels", (old_base, new_base, chunk_size), {})
+        if self.xp_buffer is None:
+            updated = await self._recompute_tables(old_base, new_base, chunk_size, progress)
+        else:
+            # Keep buffered state out of the database until it has been
+            # re-levelled too, then let the next flush write it back
+            async with self.xp_buffer.flush_lock:
+                updated = await self._recompute_tables(old_base, new_base, chunk_size, progress)
+                self.xp_buffer.recompute_levels(old_base, new_base)
+        
+        if self.rank_index is not None:
+            self.rank_index.invalidate()
+        self.leaderboards.clear()
+        self._achievements_evaluated.clear()
+        if self.on_change is not None:
+            self.on_change(("reset",))
+        return updated
+    
+    async def _recompute_tables(self, old_base: int, new_base: int, chunk_size: int,
+                                progress: Optional[Callable]) -> Dict[str, int]:
+        updated = {}
+        for table, (level_column, xp_column) in LEVEL_TABLES.items():
+            async with self._read() as db:
+                async with db.execute(f"SELECT COUNT(*) FROM {table}") as cursor:
+                    total = (await cursor.fetchone())[0]
+            
+            updated[table] = done = 0
+            last_rowid = -(1 << 63)
+            started = time.perf_counter()
+            while True:
+                async with self._read() as db:
+                    async with db.execute(
+                        f"SELECT rowid, {level_column}, {xp_column} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                        (last_rowid, chunk_size)
+                    ) as cursor:
+                        rows = await cursor.fetchall()
+                if not rows:
+                    break
+                
+                changed = leveling.recompute_chunk(rows, old_base, new_base)
+                if changed:
+                    async with self._write() as db:
+                        await db.executemany(
+                            f"UPDATE {table} SET {level_column} = ?, {xp_column} = ? WHERE rowid = ?", changed
+                        )
+                updated[table] += len(changed)
+                done += len(rows)
+                last_rowid = rows[-1][0]
+                
+                if progress is not None:
+                    result = progress(table, done, total, time.perf_counter() - started)
+                    if inspect.isawaitable(result):
+                        await result
+        return updated
+    
+    async def get_guild_settings(self, guild_id: int) -> Optional[GuildSettings]:
+        settings = self.guild_settings_cache.get(guild_id)
+        if settings is not MISSING:
+            return settings
+        
+        async with self._read() as db:
+            async with db.execute(
+                f"SELECT {GUILD_SETTINGS_COLUMNS} FROM guild_settings WHERE guild_id = ?",
                 (guild_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        
+        # Guilds without a row are cached too, as None
+        settings = GuildSettings.from_row(row) if row else None
+        self.guild_settings_cache.set(guild_id, settings)
+        return settings
+
+    async def warm_caches(self) -> Dict[str, int]:
+        """Load up front what the first messages would otherwise fetch one query at a time.
+
+        Fills the guild settings and XP rules caches (up to their size), the
+        achievement catalog and the rank index, and returns how many entries
+        each got.
+        """
+        async with self._read() as db:
+            async with db.execute(
+                f"SELECT guild_id, {GUILD_SETTINGS_COLUMNS} FROM guild_settings LIMIT ?",
+                (self.guild_settings_cache.maxsize,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            async with db.execute("SELECT guild_id, rule, value FROM xp_rules ORDER BY guild_id") as cursor:
+                rule_rows = await cursor.fetchall()
+        for row in rows:
+            self.guild_settings_cache.set(row[0], GuildSettings.from_row(row[1:]))
+        rules_by_guild: Dict[int, List[Tuple[str, str]]] = {}
+        for guild_id, rule, value in rule_rows:
+            rules_by_guild.setdefault(guild_id, []).append((rule, value))
+        for guild_id, rules in list(rules_by_guild.items())[:self.xp_rules_cache.maxsize]:
+            self.xp_rules_cache.set(guild_id, XPRules(rules))
+
+        warmed = {
+            "guild_settings": len(rows),
+            "xp_rules": min(len(rules_by_guild), self.xp_rules_cache.maxsize),
+            "achievements": len(await self.get_achievement_catalog()),
+        }
+        if self.rank_index is not None:
+            warmed["rank_index"] = len(await self.rank_index.get())
+        return warmed
+
+    @writes
+    async def update_guild_settings(self, guild_id: int, **kwargs):
+        columns = list(kwargs.keys())
+        placeholders = ", ".join(["?"] * (len(columns) + 1))
+        set_clause = ", ".join([f"{key} = excluded.{key}" for key in columns])
+        values = [guild_id] + list(kwargs.values())
+        
+        async with self._write() as db:
+            async with db.execute(f"""
+                INSERT INTO guild_settings (guild_id, {', '.join(columns)}) VALUES ({placeholders})
+                ON CONFLICT(guild_id) DO UPDATE SET {set_clause}
+                RETURNING {GUILD_SETTINGS_COLUMNS}
+            """, values) as cursor:
+                row = await cursor.fetchone()
+        
+        # Write-through so the next read never has to hit the database
+        self.guild_settings_cache.set(guild_id, GuildSettings.from_row(row))
+        if self.on_change is not None:
+            self.on_change(("guild_settings", guild_id, tuple(row)))
+    
+    async def get_xp_rules(self, guild_id: int) -> XPRules:
+        rules = self.xp_rules_cache.get(guild_id)
+        if rules is not MISSING:
+            return rules
+        
+        async with self._read() as db:
+            async with db.execute("SELECT rule, value FROM xp_rules WHERE guild_id = ?", (guild_id,)) as cursor:
+                rows = await cursor.fetchall()
+        
+        rules = XPRules(rows) if rows else NO_RULES
+        self.xp_rules_cache.set(guild_id, rules)
+        return rules
+    
+    @writes
+    async def add_xp_rule(self, guild_id: int, rule: str, value: str):
+        async with self._write() as db:
+            if rule == MIN_LENGTH:
+                # A guild has one minimum length
+                await db.execute("DELETE FROM xp_rules WHERE guild_id = ? AND rule = ?", (guild_id, rule))
+            await db.execute(
+                "INSERT OR IGNORE INTO xp_rules (guild_id, rule, value) VALUES (?, ?, ?)",
+                (guild_id, rule, value)
             )
-            return await cursor.fetchone()
+            await self._recompile_xp_rules(db, guild_id)
     
-    async def update_guild_settings(self, guild_id: int, **kwargs):
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT guild_id FROM guild_settings WHERE guild_id = ?", (guild_id,))
-            exists = await cursor.fetchone()
-            
-            if exists:
-                set_clause = ", ".join([f"{key} = ?" for key in kwargs.keys()])
-                values = list(kwargs.values()) + [guild_id]
-                await db.execute(f"UPDATE guild_settings SET {set_clause} WHERE guild_id = ?", values)
+    @writes
+    async def remove_xp_rule(self, guild_id: int, rule: str, value: str = None) -> int:
+        """Remove one rule, or every rule of a type if ``value`` is None; returns how many went."""
+        async with self._write() as db:
+            if value is None:
+                cursor = await db.execute("DELETE FROM xp_rules WHERE guild_id = ? AND rule = ?", (guild_id, rule))
             else:
-                columns = ["guild_id"] + list(kwargs.keys())
-                placeholders = ", ".join(["?"] * len(columns))
-                values = [guild_id] + list(kwargs.values())
-                await db.execute(f"INSERT INTO guild_settings ({', '.join(columns)}) VALUES ({placeholders})", values)
-            
-            await db.commit()
+                cursor = await db.execute(
+                    "DELETE FROM xp_rules WHERE guild_id = ? AND rule = ? AND value = ?",
+                    (guild_id, rule, value)
+                )
+            await self._recompile_xp_rules(db, guild_id)
+            return cursor.rowcount
+    
+    async def _recompile_xp_rules(self, db: aiosqlite.Connection, guild_id: int):
+        async with db.execute("SELECT rule, value FROM xp_rules WHERE guild_id = ?", (guild_id,)) as cursor:
+            rows = [tuple(row) for row in await cursor.fetchall()]
+        self.xp_rules_cache.set(guild_id, XPRules(rows) if rows else NO_RULES)
+        if self.on_change is not None:
+            self.on_change(("xp_rules", guild_id, rows))
     
     async def get_user_achievements(self, user_id: int, guild_id: int = None) -> List[Tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
+        async with self._read() as db:
+            async with db.execute("""
                 SELECT a.name, a.description, ua.earned_at 
                 FROM user_achievements ua
                 JOIN achievements a ON ua.achievement_id = a.id
                 WHERE ua.user_id = ? AND ua.guild_id = ?
                 ORDER BY ua.earned_at DESC
-            """, (user_id, guild_id))
-            return await cursor.fetchall()
+            """, (user_id, guild_id)) as cursor:
+                return await cursor.fetchall()
+    
+    async def get_achievement_catalog(self) -> AchievementCatalog:
+        if self._achievement_catalog is None:
+            async with self._read() as db:
+                async with db.execute(
+                    "SELECT id, name, description, requirement_type, requirement_value, reward_xp FROM achievements"
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            self._achievement_catalog = AchievementCatalog(Achievement(*row) for row in rows)
+            self._achievements_evaluated.clear()
+        return self._achievement_catalog
     
     async def get_all_achievements(self) -> List[Tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                "SELECT name, description, requirement_type, requirement_value FROM achievements ORDER BY requirement_value"
-            )
-            return await cursor.fetchall()
+        catalog = await self.get_achievement_catalog()
+        return [
+            (a.name, a.description, a.requirement_type, a.requirement_value)
+            for a in catalog.achievements
+        ]
     
     async def get_total_achievements(self) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT COUNT(*) FROM achievements")
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+        catalog = await self.get_achievement_catalog()
+        return len(catalog)
     
+    @writes
     async def check_and_award_achievements(self, user_id: int, guild_id: int, level: int, total_messages: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
-                SELECT a.id, a.name, a.requirement_type, a.requirement_value, a.reward_xp
-                FROM achievements a
-                WHERE a.id NOT IN (
-                    SELECT achievement_id FROM user_achievements 
-                    WHERE user_id = ? AND guild_id = ?
-                )
-            """, (user_id, guild_id))
-            
-            available_achievements = await cursor.fetchall()
-            earned_achievements = []
-            
-            for achievement in available_achievements:
-                achievement_id, name, req_type, req_value, reward_xp = achievement
+        """Award achievements reached at ``level`` / ``total_messages``.
+
+        The counters seen at the last check for each user and server are
+        remembered, so only thresholds crossed since then are considered and
+        most calls return without touching the database. The first check for
+        a user in a server looks at every threshold.
+        """
+        catalog = await self.get_achievement_catalog()
+        key = (user_id << 64) | guild_id
+        last_checked = self._achievements_evaluated.get(key, count=False)
+        self._achievements_evaluated.set(key, (level, total_messages))
+        if last_checked is MISSING:
+            candidates = catalog.reached("level", level) + catalog.reached("messages", total_messages)
+        else:
+            previous_level, previous_messages = last_checked
+            candidates = (
+                catalog.crossed("level", previous_level, level)
+                + catalog.crossed("messages", previous_messages, total_messages)
+            )
+        
+        if not candidates:
+            return []
+        
+        try:
+            async with self._write() as db:
+                # One statement for all candidates; RETURNING tells us which ones are new
+                placeholders = ", ".join(["(?, ?, ?)"] * len(candidates))
+                values = [value for a in candidates for value in (user_id, guild_id, a.id)]
+                async with db.execute(
+                    f"INSERT OR IGNORE INTO user_achievements (user_id, guild_id, achievement_id) VALUES {placeholders} RETURNING achievement_id",
+                    values
+                ) as cursor:
+                    new_ids = {achievement_id for (achievement_id,) in await cursor.fetchall()}
                 
-                if req_type == "level" and level >= req_value:
-                    earned_achievements.append((achievement_id, name, reward_xp))
-                elif req_type == "messages" and total_messages >= req_value:
-                    earned_achievements.append((achievement_id, name, reward_xp))
-            
-            for achievement_id, name, reward_xp in earned_achievements:
-                await db.execute(
-                    "INSERT INTO user_achievements (user_id, guild_id, achievement_id) VALUES (?, ?, ?)",
-                    (user_id, guild_id, achievement_id)
-                )
+                earned_achievements = [(a.id, a.name, a.reward_xp) for a in candidates if a.id in new_ids]
+                reward_xp = sum(a.reward_xp for a in candidates if a.id in new_ids)
                 
-                if reward_xp > 0:
-                    await db.execute(
-                        "UPDATE users SET xp = xp + ? WHERE user_id = ? AND guild_id = ?",
-                        (reward_xp, user_id, guild_id)
-                    )
+                server_data = None
+                if reward_xp > 0 and self.xp_buffer is None:
+                    # Levelled like any other gain, in the same transaction as the read
+                    async with db.execute(
+                        "SELECT xp, level, total_messages FROM users WHERE user_id = ? AND guild_id = ?",
+                        (user_id, guild_id)
+                    ) as cursor:
+                        row = await cursor.fetchone()
+                    if row is not None:
+                        server_xp, server_level = leveling.apply_bonus(row[0], row[1], reward_xp)
+                        await db.execute(
+                            "UPDATE users SET xp = ?, level = ? WHERE user_id = ? AND guild_id = ?",
+                            (server_xp, server_level, user_id, guild_id)
+                        )
+                        server_data = (server_xp, server_level, row[2])
             
-            await db.commit()
-            return earned_achievements
+            if reward_xp > 0 and self.xp_buffer is not None:
+                # The users row may only exist in the buffer so far
+                server_data = await self.xp_buffer.add_bonus(user_id, guild_id, reward_xp)
+        except Exception:
+            # Forget what was checked so the next call re-evaluates everything
+            self._achievements_evaluated.pop(key)
+            raise
+        
+        if server_data:
+            server_xp, server_level, server_messages = server_data
+            self._publish_score(guild_id, user_id, server_level, server_xp, server_messages)
+        
+        return earned_achievements
     
+    @writes
     async def initialize_default_achievements(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT COUNT(*) FROM achievements")
-            count = await cursor.fetchone()
+        async with self._write() as db:
+            async with db.execute("SELECT COUNT(*) FROM achievements") as cursor:
+                count = await cursor.fetchone()
             
             if count[0] == 0:
                 default_achievements = [
@@ -318,43 +1387,140 @@ class DatabaseManager:
                     ("Legendary", "Reach level 375", "level", 375, 5000),
                 ]
                 
-                for achievement in default_achievements:
-                    await db.execute(
-                        "INSERT INTO achievements (name, description, requirement_type, requirement_value, reward_xp) VALUES (?, ?, ?, ?, ?)",
-                        achievement
-                    )
-                
-                await db.commit()
+                await db.executemany(
+                    "INSERT INTO achievements (name, description, requirement_type, requirement_value, reward_xp) VALUES (?, ?, ?, ?, ?)",
+                    default_achievements
+                )
+                self._achievement_catalog = None
+        
+        if count[0] == 0 and self.on_change is not None:
+            self.on_change(("achievements",))
     
+    @writes
     async def add_rank_role(self, guild_id: int, level: int, role_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute(
                 "INSERT OR REPLACE INTO rank_roles (guild_id, level, role_id) VALUES (?, ?, ?)",
                 (guild_id, level, role_id)
             )
-            await db.commit()
     
+    @writes
     async def remove_rank_role(self, guild_id: int, level: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute(
                 "DELETE FROM rank_roles WHERE guild_id = ? AND level = ?",
                 (guild_id, level)
             )
-            await db.commit()
     
     async def get_rank_roles(self, guild_id: int) -> List[Tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
+        async with self._read() as db:
+            async with db.execute(
                 "SELECT level, role_id FROM rank_roles WHERE guild_id = ? ORDER BY level",
                 (guild_id,)
-            )
-            return await cursor.fetchall()
+            ) as cursor:
+                return await cursor.fetchall()
     
     async def get_rank_roles_for_level(self, guild_id: int, level: int) -> List[int]:
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
+        async with self._read() as db:
+            async with db.execute(
                 "SELECT role_id FROM rank_roles WHERE guild_id = ? AND level <= ? ORDER BY level",
                 (guild_id, level)
-            )
-            results = await cursor.fetchall()
+            ) as cursor:
+                results = await cursor.fetchall()
             return [role_id for (role_id,) in results]
+    
+    async def count_guild_users(self, guild_id: int) -> int:
+        async with self._read() as db:
+            async with db.execute("SELECT COUNT(*) FROM users WHERE guild_id = ?", (guild_id,)) as cursor:
+                return (await cursor.fetchone())[0]
+    
+    async def get_guild_levels_page(self, guild_id: int, after: Optional[Tuple[int, int, int]] = None,
+                                    limit: int = 500) -> List[Tuple]:
+        """``(user_id, level, xp, global_level)`` rows of a guild in ascending ``(level, xp, user_id)`` order.
+        
+        ``after`` is the ``(level, xp, user_id)`` of the last row of the
+        previous page. Users only move forward in this order as they gain XP,
+        so paging never skips anyone who levels up mid-way.
+        """
+        async with self._read() as db:
+            if after is None:
+                sql, params = SERVER_LEVELS_FIRST_PAGE_SQL, (guild_id, limit)
+            else:
+                sql, params = SERVER_LEVELS_PAGE_SQL, (guild_id, *after, limit)
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+    
+    async def get_rank_sync_state(self, guild_id: int) -> Optional[RankSyncState]:
+        async with self._read() as db:
+            async with db.execute(
+                f"SELECT {RANK_SYNC_STATE_COLUMNS} FROM rank_sync_state WHERE guild_id = ?", (guild_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        return RankSyncState(*row) if row else None
+    
+    async def get_rank_sync_states(self) -> List[RankSyncState]:
+        async with self._read() as db:
+            async with db.execute(f"SELECT {RANK_SYNC_STATE_COLUMNS} FROM rank_sync_state") as cursor:
+                return [RankSyncState(*row) for row in await cursor.fetchall()]
+    
+    @writes
+    async def save_rank_sync_state(self, state: RankSyncState):
+        async with self._write() as db:
+            await db.execute(
+                f"INSERT OR REPLACE INTO rank_sync_state ({RANK_SYNC_STATE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                state
+            )
+    
+    @writes
+    async def clear_rank_sync_state(self, guild_id: int):
+        async with self._write() as db:
+            await db.execute("DELETE FROM rank_sync_state WHERE guild_id = ?", (guild_id,))
+    
+    @writes
+    async def set_rank_title(self, guild_id: int, level: int, title: str):
+        async with self._write() as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO rank_titles (guild_id, level, title) VALUES (?, ?, ?)",
+                (guild_id, level, title)
+            )
+    
+    @writes
+    async def remove_rank_title(self, guild_id: int, level: int):
+        async with self._write() as db:
+            await db.execute(
+                "DELETE FROM rank_titles WHERE guild_id = ? AND level = ?",
+                (guild_id, level)
+            )
+    
+    async def get_rank_titles(self, guild_id: int) -> List[Tuple]:
+        async with self._read() as db:
+            async with db.execute(
+                "SELECT level, title FROM rank_titles WHERE guild_id = ? ORDER BY level",
+                (guild_id,)
+            ) as cursor:
+                return await cursor.fetchall()
+    
+    async def get_all_rank_titles(self) -> List[Tuple]:
+        async with self._read() as db:
+            async with db.execute("SELECT guild_id, level, title FROM rank_titles") as cursor:
+                return await cursor.fetchall()
+    
+    async def get_display_names(self, user_ids: List[int]) -> Dict[int, str]:
+        """Stored display names of whichever ``user_ids`` have one."""
+        if not user_ids:
+            return {}
+        placeholders = ", ".join("?" * len(user_ids))
+        async with self._read() as db:
+            async with db.execute(
+                f"SELECT user_id, name FROM display_names WHERE user_id IN ({placeholders})", list(user_ids)
+            ) as cursor:
+                return dict(await cursor.fetchall())
+    
+    @writes
+    async def save_display_names(self, names: List[Tuple[int, str]]):
+        """Store ``(user_id, name)`` pairs, replacing older names."""
+        async with self._write() as db:
+            await db.executemany("""
+                INSERT INTO display_names (user_id, name) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET name = excluded.name
+            """, names)
@@ -1,3 +1,5 @@
+from bisect import bisect_right
+
 ranks = {
     range(1, 5): "New Member",
     range(5, 10): "Fresh Face",
@@ -78,11 +80,96 @@ ranks = {
 }
 
 
-def get_rank(level):
-    for level_range, rank in ranks.items():
-        if level in level_range:
-            if level >= 50:
-                return f"{rank} <:knottcheckmark:1140442264859054211>  "
-            else:
-                return rank
-    return "Unknown Rank"
+UNKNOWN_RANK = "Unknown Rank"
+VERIFIED_LEVEL = 50
+
+
+def format_rank(level, rank):
+    if level >= VERIFIED_LEVEL:
+        return f"{rank} <:knottcheckmark:1140442264859054211>  "
+    else:
+        return rank
+
+
+class RankLadder:
+    """Rank titles compiled into a bisect-searchable array of level thresholds.
+
+    Every title is formatted once up front, so a lookup is a single bisect
+    and returns a prebuilt string.
+    """
+
+    def __init__(self, entries):
+        # entries: (min_level, title) pairs; a None title means "Unknown Rank"
+        thresholds = []
+        titles = []
+        for min_level, title in sorted(entries, key=lambda entry: entry[0]):
+            if thresholds and thresholds[-1] == min_level:
+                titles[-1] = title
+                continue
+            thresholds.append(min_level)
+            titles.append(title)
+
+        # Split the title spanning the verified level so formatting only
+        # depends on the threshold
+        index = bisect_right(thresholds, VERIFIED_LEVEL) - 1
+        if index >= 0 and thresholds[index] < VERIFIED_LEVEL:
+            thresholds.insert(index + 1, VERIFIED_LEVEL)
+            titles.insert(index + 1, titles[index])
+
+        self.entries = list(zip(thresholds, titles))
+        self.thresholds = thresholds
+        self.titles = [
+            format_rank(level, title) if title is not None else UNKNOWN_RANK
+            for level, title in zip(thresholds, titles)
+        ]
+
+    @classmethod
+    def from_ranges(cls, rank_ranges):
+        entries = []
+        for level_range, rank in rank_ranges.items():
+            entries.append((level_range.start, rank))
+        # Levels outside every range have no title
+        starts = {level_range.start for level_range in rank_ranges}
+        for level_range in rank_ranges:
+            if level_range.stop not in starts:
+                entries.append((level_range.stop, None))
+        return cls(entries)
+
+    def get(self, level):
+        index = bisect_right(self.thresholds, level) - 1
+        return self.titles[index] if index >= 0 else UNKNOWN_RANK
+
+
+default_ladder = RankLadder.from_ranges(ranks)
+
+# guild_id -> compiled custom ladder
+guild_ladders = {}
+
+
+def set_guild_ladder(guild_id, entries):
+    """Register a guild's custom titles as (min_level, title) pairs.
+
+    Levels below the guild's lowest title keep the default titles.
+    """
+    entries = list(entries)
+    if not entries:
+        guild_ladders.pop(guild_id, None)
+        return
+    lowest = min(level for level, _ in entries)
+    defaults = [(level, title) for level, title in default_ladder.entries if level < lowest]
+    guild_ladders[guild_id] = RankLadder(defaults + entries)
+
+
+def load_guild_ladders(rows):
+    """Load every custom ladder from (guild_id, level, title) rows."""
+    grouped = {}
+    for guild_id, level, title in rows:
+        grouped.setdefault(guild_id, []).append((level, title))
+    guild_ladders.clear()
+    for guild_id, entries in grouped.items():
+        set_guild_ladder(guild_id, entries)
+
+
+def get_rank(level, guild_id=None):
+    ladder = guild_ladders.get(guild_id, default_ladder) if guild_id is not None else default_ladder
+    return ladder.get(level)
@@ -0,0 +1,148 @@
+"""Run the bot as several sharded processes sharing one database.
+
+Starts the storage process (storage.py), which owns every database write,
+then PROCESSES bot processes that each run a contiguous range of the
+SHARDS gateway shards and send their writes to it:
+
+    python launcher.py --shards 16 --processes 4
+
+A process that exits is restarted with a growing delay. On Ctrl+C or
+SIGTERM the shards are stopped first, so their queued XP reaches the storage
+process, and the storage process last. With METRICS_PORT set, the storage
+process serves metrics on that port and shard process ``i`` on
+METRICS_PORT + 1 + i.
+
+XP cooldowns and guild settings are keyed by guild, and a guild's events
+always arrive on the same shard, so they stay in the one process that owns
+the guild. Global scores, which any shard can change, reach every process
+through the storage process.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Dict, List
+import botsettings
+
+logger = logging.getLogger("launcher")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# A process that stayed up this long is considered healthy again
+HEALTHY_AFTER = 60
+MAX_RESTART_DELAY = 60
+
+
+def shard_ranges(shard_count: int, processes: int) -> List[List[int]]:
+    """Split shards 0..shard_count-1 into ``processes`` contiguous, near-equal ranges."""
+    size, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return [shard_ids for shard_ids in ranges if shard_ids]
+
+
+class Supervisor:
+    def __init__(self):
+        self.stopping = asyncio.Event()
+        self._processes: Dict[str, asyncio.subprocess.Process] = {}
+
+    async def run(self, name: str, script: str, env: Dict[str, str]):
+        """Keep ``script`` running until stop() is called."""
+        failures = 0
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            # In their own session, so a Ctrl+C reaches only the launcher and
+            # it can stop the shards before the storage process
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.join(HERE, script), env=env, cwd=HERE, start_new_session=True
+            )
+            self._processes[name] = process
+            logger.info(f"Started {name} (pid {process.pid})")
+            code = await process.wait()
+            self._processes.pop(name, None)
+            if self.stopping.is_set():
+                break
+            failures = 0 if time.monotonic() - started >= HEALTHY_AFTER else failures + 1
+            delay = min(MAX_RESTART_DELAY, 2 ** failures)
+            logger.warning(f"{name} exited with code {code}, restarting in {delay}s")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self, names: List[str], timeout: float = 30):
+        """Interrupt ``names`` (like Ctrl+C, so they shut down cleanly) and wait for them."""
+        processes = [self._processes[name] for name in names if name in self._processes]
+        for process in processes:
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(process.wait() for process in processes)), timeout)
+        except asyncio.TimeoutError:
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+
+
+async def wait_for_socket(path: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"Storage process did not open {path} within {timeout:.0f}s")
+        await asyncio.sleep(0.1)
+
+
+async def launch(args):
+    env = dict(os.environ, STORAGE_SOCKET=args.socket)
+    metrics_port = botsettings.metrics_port
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+
+    supervisor = Supervisor()
+    tasks = [asyncio.create_task(supervisor.run("storage", "storage.py", env))]
+    await wait_for_socket(args.socket)
+
+    shard_names = []
+    for i, shard_ids in enumerate(shard_ranges(args.shards, args.processes)):
+        name = f"shards {shard_ids[0]}-{shard_ids[-1]}"
+        shard_env = dict(env, SHARD_COUNT=str(args.shards), SHARD_IDS=",".join(map(str, shard_ids)))
+        if metrics_port:
+            shard_env["METRICS_PORT"] = str(metrics_port + 1 + i)
+        shard_names.append(name)
+        tasks.append(asyncio.create_task(supervisor.run(name, "main.py", shard_env)))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    logger.info("Stopping shards")
+    supervisor.stopping.set()
+    await supervisor.stop(shard_names)
+    logger.info("Stopping storage process")
+    await supervisor.stop(["storage"])
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot as sharded processes with one storage process.")
+    parser.add_argument("--shards", type=int, default=botsettings.shard_count or None, required=not botsettings.shard_count,
+                        help="total number of gateway shards (default: SHARD_COUNT)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="bot processes to spread the shards over (default: CPU count)")
+    parser.add_argument("--socket", default=botsettings.storage_socket or f"{os.path.abspath(botsettings.database_name)}.sock",
+                        help="storage process socket (default: STORAGE_SOCKET, or next to the database)")
+    args = parser.parse_args()
+    if args.shards <= 0 or args.processes <= 0:
+        parser.error("--shards and --processes must be positive")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(launch(args))
+
+
+if __name__ == "__main__":
+    main()
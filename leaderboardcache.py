@@ -0,0 +1,83 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import botsettings
+from cache import LRUCache, MISSING
+
+
+class LeaderboardSnapshot:
+    """The top rows of one board, plus whatever a caller rendered from them."""
+
+    __slots__ = ("rows", "limit", "user_ids", "threshold", "rendered")
+
+    def __init__(self, rows: List[Tuple], limit: int):
+        self.rows = rows
+        self.limit = limit
+        self.user_ids = {row[0] for row in rows}
+        # Once the window is full, a score below its last row can't get in
+        self.threshold: Optional[Tuple[int, int]] = (rows[-1][1], rows[-1][2]) if len(rows) >= limit else None
+        self.rendered: Any = None
+
+    def affected_by(self, user_id: int, level: int, xp: int) -> bool:
+        return user_id in self.user_ids or self.threshold is None or (level, xp) >= self.threshold
+
+
+class LeaderboardCache:
+    """Snapshots of the top of the global board and of each guild board.
+
+    A snapshot is dropped when a score that is on it, or that could enter
+    it, changes, and in any case after ``ttl`` seconds. Changes that land
+    while a snapshot is being loaded keep that load from being cached.
+    """
+
+    def __init__(self, maxsize: int = None, ttl: float = None):
+        self._snapshots = LRUCache(
+            maxsize or botsettings.leaderboard_cache_size,
+            ttl=botsettings.leaderboard_cache_ttl if ttl is None else ttl
+        )
+        # guild_id -> [loads in flight, score changes seen since they started]
+        self._loading: Dict[Optional[int], List[int]] = {}
+
+    @property
+    def hits(self) -> int:
+        return self._snapshots.hits
+
+    @property
+    def misses(self) -> int:
+        return self._snapshots.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self._snapshots.hit_rate
+
+    async def get(self, guild_id: Optional[int], limit: int,
+                  fetch: Callable[[], Awaitable[List[Tuple]]]) -> LeaderboardSnapshot:
+        snapshot = self._snapshots.get(guild_id)
+        if snapshot is not MISSING and snapshot.limit == limit:
+            return snapshot
+
+        loading = self._loading.setdefault(guild_id, [0, 0])
+        loading[0] += 1
+        changes = loading[1]
+        try:
+            rows = await fetch()
+        finally:
+            loading[0] -= 1
+            if not loading[0]:
+                self._loading.pop(guild_id, None)
+
+        snapshot = LeaderboardSnapshot(rows, limit)
+        if loading[1] == changes:
+            self._snapshots.set(guild_id, snapshot)
+        return snapshot
+
+    def score_changed(self, guild_id: Optional[int], user_id: int, level: int, xp: int):
+        loading = self._loading.get(guild_id)
+        if loading is not None:
+            loading[1] += 1
+        snapshot = self._snapshots.get(guild_id, None, count=False)
+        if snapshot is not None and snapshot.affected_by(user_id, level, xp):
+            self._snapshots.pop(guild_id)
+
+    def clear(self):
+        self._snapshots.clear()
+        for loading in self._loading.values():
+            loading[1] += 1
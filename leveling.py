@@ -0,0 +1,77 @@
+from typing import Tuple
+import botsettings
+
+# Rolling leaderboard windows (kboard week/month): name -> days covered, today included
+PERIODS = {"week": 7, "month": 30}
+# Days of XP buckets kept, enough for the longest window
+BUCKET_DAYS = max(PERIODS.values())
+
+
+def xp_day(timestamp: int) -> int:
+    """The UTC day (days since the epoch) XP gained at ``timestamp`` is bucketed under."""
+    return timestamp // 86400
+
+
+def xp_needed(level: int, base: int = None) -> int:
+    """XP needed to go from ``level`` to the next level."""
+    return level * (botsettings.level_up_base if base is None else base)
+
+
+def apply_xp(xp: int, level: int, xp_gain: int, base: int = None) -> Tuple[int, int, bool]:
+    """Add an XP gain, levelling up at most once, like the SQL write path."""
+    new_xp = xp + xp_gain
+    needed = xp_needed(level, base)
+    if new_xp >= needed:
+        return new_xp - needed, level + 1, True
+    return new_xp, level, False
+
+
+def apply_bonus(xp: int, level: int, xp_gain: int, base: int = None) -> Tuple[int, int]:
+    """Add bonus XP (e.g. an achievement reward) and return the new ``(xp, level)``.
+
+    Unlike apply_xp() a bonus can be worth several levels, so it levels up
+    as often as it takes to keep ``xp`` below the next level's threshold.
+    """
+    level, xp = level_for_total(total_xp(level, xp, base) + xp_gain, base)
+    return xp, level
+
+
+def total_xp(level: int, xp: int, base: int = None) -> int:
+    """All XP earned to reach ``level`` with ``xp`` towards the next one."""
+    base = botsettings.level_up_base if base is None else base
+    return base * level * (level - 1) // 2 + xp
+
+
+def level_for_total(total: int, base: int = None) -> Tuple[int, int]:
+    """Inverse of total_xp(): the ``(level, xp)`` reached with ``total`` XP."""
+    base = botsettings.level_up_base if base is None else base
+    level = max(1, int((1 + (1 + 8 * total / base) ** 0.5) / 2))
+    # Correct for floating point error around exact level boundaries
+    while level > 1 and total_xp(level, 0, base) > total:
+        level -= 1
+    while total_xp(level + 1, 0, base) <= total:
+        level += 1
+    return level, total - total_xp(level, 0, base)
+
+
+def recompute_chunk(rows, old_base: int, new_base: int):
+    """Re-level ``(rowid, level, xp)`` rows from ``old_base`` to ``new_base``.
+
+    Vectorized with NumPy; returns ``(level, xp, rowid)`` for the rows that
+    changed, ready for executemany().
+    """
+    import numpy as np
+
+    data = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    rowids, levels, xps = data[:, 0], np.maximum(data[:, 1], 1), data[:, 2]
+
+    total = np.maximum(old_base * levels * (levels - 1) // 2 + xps, 0)
+    new_levels = np.floor((1 + np.sqrt(1 + 8 * total / new_base)) / 2).astype(np.int64)
+    new_levels = np.maximum(new_levels, 1)
+    # Correct for floating point error around exact level boundaries
+    new_levels -= (new_base * new_levels * (new_levels - 1) // 2 > total) & (new_levels > 1)
+    new_levels += new_base * (new_levels + 1) * new_levels // 2 <= total
+    new_xps = total - new_base * new_levels * (new_levels - 1) // 2
+
+    changed = (new_levels != data[:, 1]) | (new_xps != xps)
+    return list(zip(new_levels[changed].tolist(), new_xps[changed].tolist(), rowids[changed].tolist()))
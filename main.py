@@ -4,70 +4,246 @@ import getrank
 import asyncio
 import time
 import logging
-from typing import Optional
+from typing import Dict, Optional, Tuple
 import botsettings
-from database import DatabaseManager
+import leveling
+from database import DatabaseManager, page_cursor, period_page_cursor
+from cooldowns import CooldownStore
+from pipeline import XPPipeline
+from announcements import AnnouncementScheduler
+from members import MemberCache
+from names import DisplayNameCache
+from voicexp import VoiceTracker
+import metrics
+from metrics import MESSAGES, RECONNECT_LATENCY, STAGE_LATENCY, VOICE_TICK_LATENCY, XP_RULE_DENIALS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 BOTNAME = botsettings.name
+EXTENSIONS = ('commands.admin', 'commands.achievements', 'commands.roles')
 
 db_manager = DatabaseManager()
+# Seconds spent in each startup phase, and until the first on_ready ("ready")
+startup_timings: Dict[str, float] = {}
+# Shard id -> when it lost its gateway connection
+shard_disconnected_at: Dict[Optional[int], float] = {}
+
+
+class KnottBot(commands.AutoShardedBot):
+    def __init__(self, db_manager: DatabaseManager, **kwargs):
+        super().__init__(**kwargs)
+        # Shared by every cog so the whole bot uses one connection pool
+        self.db_manager = db_manager
+        # Members looked up by id, for when discord.py doesn't cache them (low-memory mode)
+        self.member_cache = MemberCache(self)
+        # Names for leaderboard rows of users discord.py hasn't cached
+        self.display_names = DisplayNameCache(self)
+        self.metrics_runner = None
+
+    async def setup_hook(self):
+        # Runs once, before the gateway connects; on_ready fires again on
+        # every reconnect that can't resume, so it must not do setup work
+        started = time.perf_counter()
+        register_metrics()
+        if botsettings.metrics_port:
+            self.metrics_runner = await metrics.start_http_server(botsettings.metrics_host, botsettings.metrics_port)
+        
+        await timed("database", self.db_manager.init_database())
+        await asyncio.gather(
+            timed("extensions", asyncio.gather(*(load_extension(name) for name in EXTENSIONS))),
+            timed("achievements", initialize_achievements()),
+            timed("rank_titles", load_rank_titles()),
+        )
+        warmed = await timed("caches", self.db_manager.warm_caches())
+        print("Caches warmed: " + ", ".join(f"{name} {count:,}" for name, count in warmed.items()))
+        update_presence.start()
+        roll_xp_windows.start()
+        if botsettings.voice_xp_enabled:
+            award_voice_xp.start()
+        
+        startup_timings["setup"] = time.perf_counter() - started
+        print("Setup finished in " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_timings.items()))
+    
+    async def close(self):
+        # Drain queued work while the connection to Discord is still open
+        award_voice_xp.cancel()
+        roll_xp_windows.cancel()
+        await xp_pipeline.close()
+        await announcer.close()
+        await super().close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await self.display_names.close()
+        await self.db_manager.close()
+
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
 intents.members = True
 
-bot = commands.Bot(
+bot = KnottBot(
+    db_manager,
     command_prefix=botsettings.command_prefix, 
     intents=intents,
-    help_command=None
+    help_command=None,
+    # launcher.py gives every process its own range of shards
+    shard_count=botsettings.shard_count or None,
+    shard_ids=botsettings.shard_ids or None,
+    # Low-memory mode keeps no member lists; MemberCache fetches members when needed
+    member_cache_flags=discord.MemberCacheFlags.none() if botsettings.low_memory_mode else discord.MemberCacheFlags.from_intents(intents),
+    chunk_guilds_at_startup=not botsettings.low_memory_mode
 )
 
-user_cooldowns = {}
+user_cooldowns = CooldownStore()
+announcer = AnnouncementScheduler()
 
-@bot.event
-async def on_ready():
-    print(f'Logged in as {bot.user.name}')
-    await db_manager.init_database()
-    
+async def timed(phase: str, coro):
+    """Await ``coro``, recording how long it took as a startup phase."""
+    started = time.perf_counter()
     try:
-        await bot.load_extension('commands.admin')
-        print("Admin commands loaded successfully")
-    except Exception as e:
-        logger.error(f"Failed to load admin commands: {e}")
-    
-    try:
-        await bot.load_extension('commands.achievements')
-        print("Achievement commands loaded successfully")
-    except Exception as e:
-        logger.error(f"Failed to load achievement commands: {e}")
-    
+        return await coro
+    finally:
+        startup_timings[phase] = time.perf_counter() - started
+
+async def load_extension(name: str):
     try:
-        await bot.load_extension('commands.roles')
-        print("Role commands loaded successfully")
+        await bot.load_extension(name)
+        print(f"Loaded {name}")
     except Exception as e:
-        logger.error(f"Failed to load role commands: {e}")
-    
+        logger.error(f"Failed to load {name}: {e}")
+
+async def initialize_achievements():
     try:
         await db_manager.initialize_default_achievements()
         print("Default achievements initialized")
     except Exception as e:
         logger.error(f"Failed to initialize achievements: {e}")
-    
-    update_presence.start()
+
+async def load_rank_titles():
+    try:
+        getrank.load_guild_ladders(await db_manager.get_all_rank_titles())
+        print(f"Custom rank titles loaded for {len(getrank.guild_ladders)} servers")
+    except Exception as e:
+        logger.error(f"Failed to load custom rank titles: {e}")
+
+@bot.event
+async def on_ready():
+    if "ready" in startup_timings:
+        print(f'Ready again as {bot.user.name}')
+        return
+    # From process start, so it includes imports and connecting to the gateway
+    startup_timings["ready"] = metrics.REGISTRY.uptime()
+    print(f'Logged in as {bot.user.name}, ready {startup_timings["ready"]:.2f}s after start '
+          f'({"low-memory" if botsettings.low_memory_mode else "full member cache"}, '
+          f'{cached_member_count():,} members cached, peak RSS {_format_bytes(metrics.peak_rss_bytes())})')
+
+def cached_member_count() -> int:
+    return sum(len(guild.members) for guild in bot.guilds)
+
+def _format_bytes(size: Optional[int]) -> str:
+    return f"{size / (1024 * 1024):.1f} MiB" if size is not None else "unknown"
+
+@bot.event
+async def on_shard_disconnect(shard_id: int):
+    shard_disconnected_at.setdefault(shard_id, time.perf_counter())
+
+@bot.event
+async def on_shard_resumed(shard_id: int):
+    _shard_reconnected(shard_id, "resumed")
+
+@bot.event
+async def on_shard_ready(shard_id: int):
+    _shard_reconnected(shard_id, "identified")
+
+def _shard_reconnected(shard_id: int, how: str):
+    disconnected_at = shard_disconnected_at.pop(shard_id, None)
+    if disconnected_at is None:
+        return
+    seconds = time.perf_counter() - disconnected_at
+    RECONNECT_LATENCY.observe(seconds, how)
+    logger.info(f"Shard {shard_id} {how} {seconds:.2f}s after disconnecting")
 
 @tasks.loop(minutes=5)
 async def update_presence():
     server_count = len(bot.guilds)
     await bot.change_presence(activity=discord.Game(name=f'Say "kwhat" for help | {server_count} servers'))
 
+@update_presence.before_loop
+async def before_update_presence():
+    # Started from setup_hook, before there is a gateway connection to use
+    await bot.wait_until_ready()
+
+@tasks.loop(hours=1)
+async def roll_xp_windows():
+    # The weekly and monthly boards move on once a day; checking hourly
+    # keeps them at most an hour late
+    try:
+        await db_manager.roll_xp_windows()
+    except Exception as e:
+        logger.error(f"Error rolling XP windows: {e}")
+
+@roll_xp_windows.before_loop
+async def before_roll_xp_windows():
+    await bot.wait_until_ready()
+
+@bot.event
+async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    if botsettings.voice_xp_enabled:
+        voice_tracker.update(member, after)
+
+@bot.event
+async def on_guild_available(guild: discord.Guild):
+    # Who was already in voice isn't sent as voice state updates
+    if botsettings.voice_xp_enabled:
+        voice_tracker.load_guild(guild)
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    voice_tracker.remove_guild(guild.id)
+
+@tasks.loop(seconds=botsettings.voice_xp_interval)
+async def award_voice_xp():
+    """Give everyone active in voice their XP for this tick, in one transaction."""
+    try:
+        with VOICE_TICK_LATENCY.time("collect"):
+            gains = await voice_tracker.collect()
+        with VOICE_TICK_LATENCY.time("write"):
+            level_ups = await db_manager.add_voice_xp(gains, int(time.time()))
+        with VOICE_TICK_LATENCY.time("rewards"):
+            await asyncio.gather(*(reward_voice_level_up(*level_up) for level_up in level_ups))
+    except Exception as e:
+        logger.error(f"Error awarding voice XP: {e}")
+
+@award_voice_xp.before_loop
+async def before_award_voice_xp():
+    await bot.wait_until_ready()
+
+async def reward_voice_level_up(user_id: int, guild_id: int, new_level: int, total_messages: int):
+    """Level-up rewards for voice XP, announced in the voice channel's chat."""
+    try:
+        guild = bot.get_guild(guild_id)
+        channel_id = voice_tracker.channel_of(guild_id, user_id)
+        if guild is None or channel_id is None:
+            return
+        member = await bot.member_cache.get(guild, user_id)
+        channel = guild.get_channel(channel_id)
+        if member is None or channel is None:
+            return
+        guild_settings = await db_manager.get_guild_settings(guild_id)
+        await reward_progress(member, channel, guild_settings, new_level, True, total_messages)
+    except Exception as e:
+        logger.error(f"Error rewarding voice level-up: {e}")
+
 @bot.command()
 @commands.is_owner()
 async def set(ctx, member: discord.Member, new_level: int):
+    if new_level < 1:
+        await ctx.send("Level must be at least 1.")
+        return
     try:
+        await db_manager.set_user_level(member.id, new_level)
         embed = discord.Embed(
             title="Level Set",
             description=f"Successfully set {member.mention}'s level to {new_level}.",
@@ -78,6 +254,131 @@ async def set(ctx, member: discord.Member, new_level: int):
         logger.error(f"Error in set command: {e}")
         await ctx.send("An error occurred while setting the level.")
 
+def _format_latency(histogram, label: str) -> str:
+    p50 = histogram.quantile(0.5, label)
+    p95 = histogram.quantile(0.95, label)
+    if p50 is None:
+        return "no data"
+    return f"p50 {p50 * 1000:.1f}ms · p95 {p95 * 1000:.1f}ms"
+
+@bot.command()
+@commands.is_owner()
+async def stats(ctx):
+    try:
+        uptime = metrics.REGISTRY.uptime()
+        seen = sum(MESSAGES.values.values())
+        pipeline_stats = xp_pipeline.stats()
+        announce_stats = announcer.stats()
+        
+        embed = discord.Embed(title="📈 Bot Stats", color=discord.Color.blue())
+        embed.add_field(
+            name="Throughput",
+            value=f"Uptime: {uptime / 3600:.1f}h\n"
+                  f"Messages: {int(seen):,} ({seen / uptime:.2f}/s)\n"
+                  f"XP events processed: {pipeline_stats['processed']:,}",
+            inline=False
+        )
+        stages = ("queue_wait", "guild_settings", "update_xp", "achievements", "roles", "process_xp")
+        embed.add_field(
+            name="Message Stages",
+            value="\n".join(f"`{stage}`: {_format_latency(STAGE_LATENCY, stage)}" for stage in stages),
+            inline=False
+        )
+        busiest = sorted(metrics.DB_LATENCY.values, key=lambda labels: metrics.DB_LATENCY.count(*labels), reverse=True)[:6]
+        if busiest:
+            embed.add_field(
+                name="Database Calls",
+                value="\n".join(
+                    f"`{method}` ×{metrics.DB_LATENCY.count(method):,}: {_format_latency(metrics.DB_LATENCY, method)}"
+                    for (method,) in busiest
+                ),
+                inline=False
+            )
+        embed.add_field(
+            name="Queues",
+            value=f"XP: {pipeline_stats['depth']} queued, {pipeline_stats['deferred']:,} deferred, {pipeline_stats['dropped']:,} dropped\n"
+                  f"Announcements: {announce_stats['depth']} queued, p95 {announce_stats['latency_p95_ms']:.0f}ms",
+            inline=False
+        )
+        reconnects = sum(RECONNECT_LATENCY.count(how) for how in ("resumed", "identified"))
+        if botsettings.voice_xp_enabled:
+            embed.add_field(
+                name="Voice",
+                value=f"{len(voice_tracker):,} active in {voice_tracker.channel_count:,} channels\n"
+                      f"Tick: collect {_format_latency(VOICE_TICK_LATENCY, 'collect')}, "
+                      f"write {_format_latency(VOICE_TICK_LATENCY, 'write')}",
+                inline=False
+            )
+        embed.add_field(
+            name="Startup",
+            value=f"Ready after {startup_timings.get('ready', 0):.1f}s (setup {startup_timings.get('setup', 0):.2f}s)\n"
+                  f"Reconnects: {reconnects}, resume {_format_latency(RECONNECT_LATENCY, 'resumed')}",
+            inline=False
+        )
+        embed.add_field(
+            name="Memory",
+            value=f"Peak RSS: {_format_bytes(metrics.peak_rss_bytes())}"
+                  f"{' (low-memory mode)' if botsettings.low_memory_mode else ''}\n"
+                  f"Members cached: {cached_member_count():,}, looked up: {len(bot.member_cache):,} "
+                  f"({bot.member_cache.hit_rate:.1%} hits, {bot.member_cache.queries:,} queries)",
+            inline=False
+        )
+        embed.add_field(
+            name="Caches",
+            value="\n".join(f"{name}: {rate:.1%} hits" for name, rate in db_manager.cache_hit_rates().items())
+                  + f"\ndisplay_names: {bot.display_names.hit_rate:.1%} hits, {len(bot.display_names):,} held, "
+                    f"{bot.display_names.fetched:,} fetched"
+                  + f"\nCooldowns tracked: {len(user_cooldowns):,}",
+            inline=False
+        )
+        await ctx.send(embed=embed)
+    except Exception as e:
+        logger.error(f"Error in stats command: {e}")
+        await ctx.send("An error occurred while collecting stats.")
+
+@bot.command()
+@commands.is_owner()
+async def recomputelevels(ctx, old_base: int, chunk_size: int = 50000):
+    """Re-level every user after LEVEL_UP_BASE changed from ``old_base``."""
+    new_base = botsettings.level_up_base
+    if old_base <= 0 or chunk_size <= 0:
+        await ctx.send("Base and chunk size must be positive.")
+        return
+    if old_base == new_base:
+        await ctx.send(f"Levels are already computed for a base of {new_base}.")
+        return
+    
+    embed = discord.Embed(
+        title="Recomputing Levels",
+        description=f"Re-levelling users from a base of {old_base} to {new_base}...",
+        color=discord.Color.orange()
+    )
+    status = await ctx.send(embed=embed)
+    last_edit = time.monotonic()
+    
+    async def report(table, done, total, elapsed):
+        nonlocal last_edit
+        # Editing is rate limited, so only refresh every few seconds
+        if time.monotonic() - last_edit < 3 and done < total:
+            return
+        last_edit = time.monotonic()
+        rate = done / elapsed if elapsed > 0 else 0
+        embed.description = f"`{table}`: {done:,}/{total:,} rows ({rate:,.0f} rows/s)"
+        try:
+            await status.edit(embed=embed)
+        except discord.HTTPException:
+            pass
+    
+    try:
+        updated = await db_manager.recompute_levels(old_base, new_base, chunk_size, report)
+        embed.title = "Levels Recomputed"
+        embed.description = "\n".join(f"`{table}`: {count:,} rows re-levelled" for table, count in updated.items())
+        embed.color = discord.Color.green()
+        await status.edit(embed=embed)
+    except Exception as e:
+        logger.error(f"Error in recomputelevels command: {e}")
+        await ctx.send("An error occurred while recomputing levels.")
+
 @bot.command()
 async def level(ctx):
     try:
@@ -91,18 +392,19 @@ async def level(ctx):
                 xp, level, total_messages = user_data
             
             xp_needed = level * botsettings.level_up_base
-            user_rank = getrank.get_rank(int(level))
+            user_rank = getrank.get_rank(int(level), guild_id)
             rank_position = await db_manager.get_user_rank(ctx.author.id, guild_id)
             
             embed = discord.Embed(
                 title=f"{ctx.author.display_name}'s Level",
                 color=discord.Color.blue()
             )
-            embed.add_field(name="Level", value=f"{level}", inline=True)
-            embed.add_field(name="XP", value=f"{xp}/{xp_needed}", inline=True)
-            embed.add_field(name="Rank", value=f"#{rank_position}", inline=True)
+            # Levels are global; the rank is within this server when run in one
+            embed.add_field(name="Global Level", value=f"{level}", inline=True)
+            embed.add_field(name="Global XP", value=f"{xp}/{xp_needed}", inline=True)
+            embed.add_field(name="Server Rank" if guild_id else "Global Rank", value=f"#{rank_position}", inline=True)
             embed.add_field(name="Title", value=user_rank, inline=False)
-            embed.add_field(name="Messages Sent", value=f"{total_messages}", inline=True)
+            embed.add_field(name="Messages Sent (all servers)", value=f"{total_messages}", inline=True)
             embed.set_thumbnail(url=ctx.author.display_avatar.url)
             
             await ctx.reply(embed=embed)
@@ -145,7 +447,7 @@ async def what(ctx):
     
     embed.add_field(
         name="📊 Level Commands",
-        value="• `klevel` - Check your XP and level\n• `kboard` - See the leaderboard\n• `krank` - Check your server rank",
+        value="• `klevel` - Check your XP and level\n• `kboard [week|month]` - See the leaderboard\n• `krank` - Check your server rank",
         inline=False
     )
     
@@ -164,65 +466,175 @@ async def what(ctx):
     if ctx.guild and ctx.author.guild_permissions.administrator:
         embed.add_field(
             name="⚙️ Server Admin Commands",
-            value="• `ksetxp` - Set XP multiplier\n• `klevelchannel` - Set level up channel\n• `ktoggleannouncements` - Toggle announcements\n• `kserverconfig` - View server settings",
+            value="• `ksetxp` - Set XP multiplier\n• `klevelchannel` - Set level up channel\n• `ktoggleannouncements` - Toggle announcements\n• `kserverconfig` - View server settings\n• `kaddxprule` - Add an XP rule\n• `kremovexprule` - Remove an XP rule\n• `kxprules` - View XP rules",
             inline=False
         )
         
         embed.add_field(
             name="🎭 Rank Role Commands",
-            value="• `kaddrankrole` - Add rank role for level\n• `kremoverankrole` - Remove rank role\n• `krankroles` - View configured roles\n• `ksyncranks` - Sync all user roles",
+            value="• `kaddrankrole` - Add rank role for level\n• `kremoverankrole` - Remove rank role\n• `krankroles` - View configured roles\n• `ksyncranks` - Sync all user roles (`restart`/`cancel`)\n• `kaddranktitle` - Add custom rank title\n• `kremoveranktitle` - Remove custom rank title\n• `kranktitles` - View rank titles",
             inline=False
         )
     
     if ctx.author.id == botsettings.owner_id:
         embed.add_field(
             name="🔧 Owner Commands",
-            value="• `kset` - Set user level (Owner only)",
+            value="• `kset` - Set user level (Owner only)\n• `krecomputelevels` - Re-level users after changing LEVEL_UP_BASE (Owner only)\n• `kstats` - Latency, throughput and queue stats (Owner only)",
             inline=False
         )
     
     embed.set_footer(text="Gain XP by chatting in servers!")
     await ctx.send(embed=embed)
 
+LEADERBOARD_PAGE_SIZE = 10
+
+
+async def build_leaderboard_embed(rows, guild_id: Optional[int], first_rank: int = 1,
+                                  period: Optional[str] = None) -> Tuple[discord.Embed, bool]:
+    """The board's embed, and whether every row's name was known.
+
+    With a ``period`` the rows are the ``(user_id, xp)`` of that rolling
+    window's board. Users whose names haven't been fetched yet are shown
+    as mentions.
+    """
+    title = f"🏆 {'Server' if guild_id else 'Global'} Leaderboard"
+    if period:
+        title += f" — Last {leveling.PERIODS[period]} Days"
+    embed = discord.Embed(title=title, color=discord.Color.gold())
+    
+    names = await bot.display_names.resolve(row[0] for row in rows)
+    leaderboard_text = ""
+    for index, row in enumerate(rows, start=first_rank):
+        user_id = row[0]
+        name = f"**{names[user_id]}**" if user_id in names else f"<@{user_id}>"
+        medal = "🥇" if index == 1 else "🥈" if index == 2 else "🥉" if index == 3 else f"{index}."
+        if period:
+            leaderboard_text += f"{medal} {name} - {row[1]} XP\n"
+        else:
+            _, level, xp, _ = row
+            leaderboard_text += f"{medal} {name} - Level {level} ({xp}/{level * botsettings.level_up_base} XP)\n"
+    
+    embed.description = leaderboard_text
+    embed.set_footer(text=f"Showing ranks {first_rank}-{first_rank + len(rows) - 1}")
+    return embed, len(names) == len({row[0] for row in rows})
+
+
+class LeaderboardView(discord.ui.View):
+    """Previous/next buttons for kboard.
+    
+    Pages are fetched with keyset cursors; the cursor each visited page
+    started from is kept so going back is just as cheap as going forward.
+    """
+    
+    def __init__(self, author_id: int, guild_id: Optional[int], rows, period: Optional[str] = None):
+        super().__init__(timeout=120)
+        self.author_id = author_id
+        self.guild_id = guild_id
+        self.period = period
+        self.rows = rows
+        self.cursors = [None]
+        self.message: Optional[discord.Message] = None
+        self._update_buttons()
+    
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the person who ran this command can change pages.", ephemeral=True)
+            return False
+        return True
+    
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.pop()
+        await self._show(interaction, self.cursors[-1])
+    
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.append(period_page_cursor(self.rows) if self.period else page_cursor(self.rows))
+        await self._show(interaction, self.cursors[-1])
+    
+    async def _show(self, interaction: discord.Interaction, cursor):
+        first_rank = (len(self.cursors) - 1) * LEADERBOARD_PAGE_SIZE + 1
+        if self.period:
+            self.rows = await db_manager.get_period_leaderboard_page(
+                self.guild_id, self.period, cursor, LEADERBOARD_PAGE_SIZE
+            )
+            if not self.rows and cursor is not None:
+                await self._board_shrank(interaction)
+                return
+            embed, _ = await build_leaderboard_embed(self.rows, self.guild_id, first_rank, self.period)
+        elif cursor is None:
+            # The first page is served from the snapshot cache
+            snapshot = await db_manager.get_leaderboard_snapshot(self.guild_id, LEADERBOARD_PAGE_SIZE)
+            self.rows = snapshot.rows
+            embed = await render_snapshot(snapshot, self.guild_id)
+        else:
+            self.rows = await db_manager.get_leaderboard_page(self.guild_id, cursor, LEADERBOARD_PAGE_SIZE)
+            if not self.rows:
+                await self._board_shrank(interaction)
+                return
+            embed, _ = await build_leaderboard_embed(self.rows, self.guild_id, first_rank)
+        self._update_buttons()
+        await interaction.response.edit_message(embed=embed, view=self)
+    
+    async def _board_shrank(self, interaction: discord.Interaction):
+        # The board shrank since the last page was shown
+        self.cursors.pop()
+        self.rows = []
+        self._update_buttons()
+        await interaction.response.edit_message(view=self)
+    
+    def _update_buttons(self):
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = len(self.rows) < LEADERBOARD_PAGE_SIZE
+    
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
+async def render_snapshot(snapshot, guild_id: Optional[int]) -> discord.Embed:
+    if snapshot.rendered is not None:
+        return snapshot.rendered
+    embed, complete = await build_leaderboard_embed(snapshot.rows, guild_id)
+    # Re-render while names are still being fetched, so they show up once known
+    if complete:
+        snapshot.rendered = embed
+    return embed
+
 @bot.command()
-async def board(ctx):
+async def board(ctx, period: str = None):
     try:
         guild_id = ctx.guild.id if ctx.guild else None
-        results = await db_manager.get_leaderboard(guild_id, limit=10)
+        if period is not None:
+            period = period.lower()
+            if period not in leveling.PERIODS:
+                await ctx.send(f"❌ Period must be one of: {', '.join(leveling.PERIODS)}")
+                return
+            rows = await db_manager.get_period_leaderboard_page(guild_id, period, limit=LEADERBOARD_PAGE_SIZE)
+        else:
+            snapshot = await db_manager.get_leaderboard_snapshot(guild_id, limit=LEADERBOARD_PAGE_SIZE)
+            rows = snapshot.rows
         
-        if not results:
+        if not rows:
             embed = discord.Embed(
                 title="Leaderboard",
-                description="No users found on the leaderboard yet!",
+                description=f"No XP gained in the last {leveling.PERIODS[period]} days yet!" if period
+                            else "No users found on the leaderboard yet!",
                 color=discord.Color.orange()
             )
             await ctx.send(embed=embed)
             return
         
-        embed = discord.Embed(
-            title=f"🏆 {'Server' if guild_id else 'Global'} Leaderboard",
-            color=discord.Color.gold()
-        )
-        
-        leaderboard_text = ""
-        for index, result in enumerate(results, start=1):
-            if guild_id:
-                user_id, level, xp, total_messages = result
-                xp_needed = level * botsettings.level_up_base
-            else:
-                user_id, total_xp, max_level, total_messages = result
-                level = max_level
-                xp = total_xp
-                xp_needed = level * botsettings.level_up_base
-            
-            user = bot.get_user(user_id)
-            if user:
-                medal = "🥇" if index == 1 else "🥈" if index == 2 else "🥉" if index == 3 else f"{index}."
-                leaderboard_text += f"{medal} **{user.display_name}** - Level {level} ({xp}/{xp_needed} XP)\n"
-        
-        embed.description = leaderboard_text
-        embed.set_footer(text=f"Showing top {len(results)} users")
-        await ctx.send(embed=embed)
+        if period:
+            embed, _ = await build_leaderboard_embed(rows, guild_id, period=period)
+        else:
+            embed = await render_snapshot(snapshot, guild_id)
+        view = LeaderboardView(ctx.author.id, guild_id, rows, period)
+        view.message = await ctx.send(embed=embed, view=view)
         
     except Exception as e:
         logger.error(f"Error in board command: {e}")
@@ -256,9 +668,17 @@ async def rank(ctx, member: discord.Member = None):
             description=f"Rank: **#{rank_position}** {'in this server' if guild_id else 'globally'}",
             color=discord.Color.blue()
         )
-        embed.add_field(name="Level", value=level, inline=True)
-        embed.add_field(name="XP", value=f"{xp}/{level * botsettings.level_up_base}", inline=True)
-        embed.add_field(name="Messages", value=total_messages, inline=True)
+        # Levels and XP are global whichever board the rank above is from
+        embed.add_field(name="Global Level", value=level, inline=True)
+        embed.add_field(name="Global XP", value=f"{xp}/{level * botsettings.level_up_base}", inline=True)
+        embed.add_field(name="Messages (all servers)", value=total_messages, inline=True)
+        for period, days in leveling.PERIODS.items():
+            period_rank = await db_manager.get_period_rank(target.id, guild_id, period)
+            embed.add_field(
+                name=f"Last {days} Days",
+                value=f"#{period_rank[1]} ({period_rank[0]} XP)" if period_rank else "No XP yet",
+                inline=True
+            )
         embed.set_thumbnail(url=target.display_avatar.url)
         
         await ctx.send(embed=embed)
@@ -271,108 +691,194 @@ async def rank(ctx, member: discord.Member = None):
 async def on_message(message):
     if message.author == bot.user or message.author.bot:
         return
+    bot.display_names.observe(message.author)
 
     if isinstance(message.channel, discord.DMChannel):
         if message.content.startswith(bot.command_prefix):
             await bot.process_commands(message)
         return
 
-    # Check if message is a bot command - if so, don't give XP
-    if message.content.startswith(bot.command_prefix):
+    # Messages invoking a command earn no XP; others starting with the prefix do
+    if invokes_command(message):
+        MESSAGES.inc("command")
         await bot.process_commands(message)
         return
 
-    current_time = int(time.time())
-    user_key = f"{message.author.id}_{message.guild.id}"
-    
-    if user_key in user_cooldowns:
-        if current_time - user_cooldowns[user_key] < botsettings.xp_cooldown:
-            await bot.process_commands(message)
-            return
-    
-    user_cooldowns[user_key] = current_time
+    with STAGE_LATENCY.time("xp_rules"):
+        denied_by = (await db_manager.get_xp_rules(message.guild.id)).check(message)
+    if denied_by is not None:
+        MESSAGES.inc("denied")
+        XP_RULE_DENIALS.inc(denied_by)
+        return
     
+    current_time = int(time.time())
+    if user_cooldowns.try_acquire(message.author.id, message.guild.id, current_time):
+        MESSAGES.inc("xp")
+        with STAGE_LATENCY.time("enqueue"):
+            await xp_pipeline.submit(message.author.id, message, current_time, time.perf_counter())
+    else:
+        MESSAGES.inc("cooldown")
+
+def invokes_command(message: discord.Message) -> bool:
+    """Whether ``message`` names one of the bot's commands, as process_commands would parse it."""
+    if not message.content.startswith(bot.command_prefix):
+        return False
+    invoked = message.content[len(bot.command_prefix):]
+    return bool(invoked) and not invoked[0].isspace() and invoked.split(None, 1)[0] in bot.all_commands
+
+async def process_xp(message: discord.Message, current_time: int, queued_at: float):
+    """Award XP for a message, then announce achievements and level-ups."""
+    STAGE_LATENCY.observe(time.perf_counter() - queued_at, "queue_wait")
     try:
+        with STAGE_LATENCY.time("process_xp"):
+            await _process_xp(message, current_time)
+    except Exception as e:
+        logger.error(f"Error processing XP gain: {e}")
+
+async def _process_xp(message: discord.Message, current_time: int):
+    with STAGE_LATENCY.time("guild_settings"):
         guild_settings = await db_manager.get_guild_settings(message.guild.id)
-        xp_multiplier = guild_settings[0] if guild_settings else 1.0
-        
-        xp_gain = int(botsettings.xp_per_message * xp_multiplier)
-        
-        new_xp, new_level, leveled_up = await db_manager.update_user_xp(
+    xp_multiplier = guild_settings.xp_multiplier if guild_settings else 1.0
+    
+    xp_gain = int(botsettings.xp_per_message * xp_multiplier)
+    
+    with STAGE_LATENCY.time("update_xp"):
+        new_xp, new_level, leveled_up, total_messages = await db_manager.update_user_xp(
             message.author.id, 
             message.guild.id, 
             xp_gain, 
             current_time
         )
+    
+    await reward_progress(message.author, message.channel, guild_settings, new_level, leveled_up, total_messages)
+
+async def reward_progress(member: discord.Member, channel, guild_settings, new_level: int, leveled_up: bool,
+                          total_messages: int):
+    """Award achievements and rank roles for new progress, announcing them in ``channel``."""
+    with STAGE_LATENCY.time("achievements"):
+        earned_achievements = await db_manager.check_and_award_achievements(
+            member.id, 
+            member.guild.id, 
+            new_level, 
+            total_messages
+        )
+    
+    # Everything announced in the same channel goes out as one message
+    channel_embeds = []
+    for achievement_id, achievement_name, reward_xp in earned_achievements:
+        achievement_embed = discord.Embed(
+            title="🏆 Achievement Unlocked!",
+            description=f"{member.mention} earned the **{achievement_name}** achievement!",
+            color=discord.Color.purple()
+        )
+        if reward_xp > 0:
+            achievement_embed.add_field(name="Bonus XP", value=f"+{reward_xp} XP", inline=True)
+        achievement_embed.set_thumbnail(url=member.display_avatar.url)
+        channel_embeds.append(achievement_embed)
+    
+    if leveled_up:
+        user_rank = getrank.get_rank(new_level, member.guild.id)
+        embed = discord.Embed(
+            title="🎉 Level Up!",
+            description=f"{member.mention} reached **Level {new_level}**!",
+            color=discord.Color.gold()
+        )
+        embed.add_field(name="New Rank", value=user_rank, inline=False)
+        embed.set_thumbnail(url=member.display_avatar.url)
         
-        user_data = await db_manager.get_user_data(message.author.id, message.guild.id)
-        if user_data:
-            _, current_level, total_messages = user_data
-            earned_achievements = await db_manager.check_and_award_achievements(
-                message.author.id, 
-                message.guild.id, 
-                current_level, 
-                total_messages
-            )
-            
-            for achievement_id, achievement_name, reward_xp in earned_achievements:
-                achievement_embed = discord.Embed(
-                    title="🏆 Achievement Unlocked!",
-                    description=f"{message.author.mention} earned the **{achievement_name}** achievement!",
-                    color=discord.Color.purple()
-                )
-                if reward_xp > 0:
-                    achievement_embed.add_field(name="Bonus XP", value=f"+{reward_xp} XP", inline=True)
-                achievement_embed.set_thumbnail(url=message.author.display_avatar.url)
-                await message.channel.send(embed=achievement_embed)
-        
-        if leveled_up:
-            user_rank = getrank.get_rank(new_level)
-            embed = discord.Embed(
-                title="🎉 Level Up!",
-                description=f"{message.author.mention} reached **Level {new_level}**!",
-                color=discord.Color.gold()
-            )
-            embed.add_field(name="New Rank", value=user_rank, inline=False)
-            embed.set_thumbnail(url=message.author.display_avatar.url)
-            
-            try:
-                rank_roles = await db_manager.get_rank_roles_for_level(message.guild.id, new_level)
+        try:
+            with STAGE_LATENCY.time("roles"):
+                rank_roles = await db_manager.get_rank_roles_for_level(member.guild.id, new_level)
                 assigned_roles = []
                 
                 for role_id in rank_roles:
-                    role = message.guild.get_role(role_id)
-                    if role and role not in message.author.roles:
+                    role = member.guild.get_role(role_id)
+                    if role and role not in member.roles:
                         try:
-                            await message.author.add_roles(role, reason=f"Reached level {new_level}")
+                            await member.add_roles(role, reason=f"Reached level {new_level}")
+                            bot.member_cache.forget(member.guild.id, member.id)
                             assigned_roles.append(role.mention)
                         except discord.Forbidden:
-                            logger.warning(f"Cannot assign role {role.name} to {message.author.display_name}")
+                            logger.warning(f"Cannot assign role {role.name} to {member.display_name}")
                         except Exception as e:
                             logger.error(f"Error assigning role: {e}")
-                
-                if assigned_roles:
-                    embed.add_field(
-                        name="🎭 New Roles",
-                        value="\n".join(assigned_roles),
-                        inline=False
-                    )
-            except Exception as e:
-                logger.error(f"Error processing rank roles: {e}")
             
-            if guild_settings and guild_settings[1]:
-                channel = bot.get_channel(guild_settings[1])
-                if channel:
-                    await channel.send(embed=embed)
-                else:
-                    await message.channel.send(embed=embed)
+            if assigned_roles:
+                embed.add_field(
+                    name="🎭 New Roles",
+                    value="\n".join(assigned_roles),
+                    inline=False
+                )
+        except Exception as e:
+            logger.error(f"Error processing rank roles: {e}")
+        
+        if not guild_settings or guild_settings.announcement_enabled:
+            level_up_channel = channel
+            if guild_settings and guild_settings.level_up_channel:
+                level_up_channel = bot.get_channel(guild_settings.level_up_channel) or channel
+            
+            if announcer.digest_interval:
+                announcer.add_to_digest(level_up_channel, f"{member.mention} reached **Level {new_level}** ({user_rank})")
+            elif level_up_channel.id == channel.id:
+                channel_embeds.append(embed)
             else:
-                await message.channel.send(embed=embed)
-                
-    except Exception as e:
-        logger.error(f"Error processing XP gain: {e}")
+                announcer.announce(level_up_channel, [embed])
+    
+    if channel_embeds:
+        announcer.announce(channel, channel_embeds)
+
+# Messages are handed to XP workers so command handling never waits on them
+xp_pipeline = XPPipeline(process_xp)
+# Members active in voice channels, awarded XP by award_voice_xp
+voice_tracker = VoiceTracker(bot)
 
-    await bot.process_commands(message)
+def register_metrics():
+    """Expose the bot's queues, caches and cooldowns as gauges."""
+    registry = metrics.REGISTRY
+    registry.gauge("knott_guilds", "Guilds the bot is in", lambda: len(bot.guilds))
+    registry.gauge("knott_cached_members", "Members held in discord.py's member cache", cached_member_count)
+    registry.gauge("knott_member_lookup_entries", "Members held by the bounded member lookup cache", lambda: len(bot.member_cache))
+    registry.gauge(
+        "knott_display_name_fetches_total", "Users fetched from Discord for their display name",
+        lambda: {("fetched",): bot.display_names.fetched, ("failed",): bot.display_names.failed},
+        ("result",), metric_type="counter"
+    )
+    registry.gauge("knott_peak_rss_bytes", "Peak resident memory of the process", lambda: metrics.peak_rss_bytes() or 0)
+    registry.gauge(
+        "knott_startup_seconds", "Time spent in each startup phase",
+        lambda: {(phase,): seconds for phase, seconds in startup_timings.items()},
+        ("phase",)
+    )
+    registry.gauge("knott_voice_participants", "Members active in voice channels", lambda: len(voice_tracker))
+    registry.gauge("knott_cooldown_entries", "Tracked XP cooldowns", lambda: len(user_cooldowns))
+    registry.gauge("knott_xp_queue_depth", "XP events waiting for a worker", lambda: xp_pipeline.depth)
+    registry.gauge(
+        "knott_xp_events_total", "XP events by outcome",
+        lambda: {(name,): value for name, value in xp_pipeline.stats().items() if name != "depth"},
+        ("result",), metric_type="counter"
+    )
+    registry.gauge("knott_announce_queue_depth", "Announcements waiting to be sent", lambda: announcer.depth)
+    registry.gauge(
+        "knott_announcements_total", "Announcements by outcome",
+        lambda: {("sent",): announcer.sent, ("merged",): announcer.merged, ("dropped",): announcer.dropped, ("failed",): announcer.failed},
+        ("result",), metric_type="counter"
+    )
+    registry.gauge(
+        "knott_announce_latency_seconds", "Recent time from queueing an announcement to sending it",
+        lambda: {
+            ("0.5",): announcer.stats()["latency_p50_ms"] / 1000,
+            ("0.95",): announcer.stats()["latency_p95_ms"] / 1000,
+        },
+        ("quantile",)
+    )
+    registry.gauge(
+        "knott_cache_hit_ratio", "Cache hit ratio since startup",
+        lambda: {(name,): rate for name, rate in db_manager.cache_hit_rates().items()},
+        ("cache",)
+    )
+    if db_manager.xp_buffer is not None:
+        registry.gauge("knott_xp_buffer_pending_events", "XP events not yet flushed to the database",
+                       lambda: db_manager.xp_buffer.pending_events)
 
 if __name__ == "__main__":
     bot.run(botsettings.token)
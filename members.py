@@ -0,0 +1,71 @@
+import logging
+from typing import Dict, Iterable, Optional
+import discord
+import botsettings
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Most user ids one gateway member query may ask for
+QUERY_LIMIT = 100
+
+
+class MemberCache:
+    """Guild members by id, for when discord.py doesn't keep them all.
+
+    In low-memory mode (LOW_MEMORY_MODE) discord.py caches no members and
+    doesn't chunk guilds at startup. Members are then looked up here: hits
+    come from a bounded LRU, misses are fetched with gateway member queries
+    of up to 100 ids each. Members of chunked guilds are served straight
+    from discord.py's cache and never copied into the LRU.
+
+    Cached members don't see gateway updates, so entries expire after
+    ``ttl`` seconds and callers forget members whose roles they change.
+    """
+
+    def __init__(self, bot, maxsize: int = None, ttl: float = None):
+        self.bot = bot
+        self._members = LRUCache(
+            maxsize or botsettings.member_cache_size,
+            ttl=botsettings.member_cache_ttl if ttl is None else ttl
+        )
+        self.queries = 0
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    @property
+    def hit_rate(self) -> float:
+        return self._members.hit_rate
+
+    def remember(self, member: discord.Member):
+        if isinstance(member, discord.Member) and not member.guild.chunked:
+            self._members.set((member.guild.id, member.id), member)
+
+    def forget(self, guild_id: int, user_id: int):
+        self._members.pop((guild_id, user_id))
+
+    async def get(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        return (await self.get_many(guild, [user_id])).get(user_id)
+
+    async def get_many(self, guild: discord.Guild, user_ids: Iterable[int]) -> Dict[int, discord.Member]:
+        """The members among ``user_ids`` that are still in ``guild``."""
+        members = {}
+        missing = []
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if member is None:
+                member = self._members.get((guild.id, user_id), None)
+            if member is not None:
+                members[user_id] = member
+            else:
+                missing.append(user_id)
+
+        if missing and not guild.chunked and self.bot.intents.members:
+            for i in range(0, len(missing), QUERY_LIMIT):
+                batch = missing[i:i + QUERY_LIMIT]
+                self.queries += 1
+                for member in await guild.query_members(user_ids=batch, limit=len(batch), cache=False):
+                    members[member.id] = member
+                    self.remember(member)
+        return members
@@ -0,0 +1,241 @@
+import functools
+import inspect
+import logging
+import sys
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow API calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self.values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {value}" for labels, value in self.values.items()]
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets, per label set."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count per bucket (+Inf last), sum, count]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def time(self, *labels: str) -> _Timer:
+        """Context manager observing how long its body took."""
+        return _Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        entry = self.values.get(labels)
+        return entry[2] if entry else 0
+
+    def quantile(self, q: float, *labels: str) -> Optional[float]:
+        """Estimate of the ``q`` quantile, interpolated within its bucket."""
+        entry = self.values.get(labels)
+        if not entry or not entry[2]:
+            return None
+        rank = q * entry[2]
+        seen = 0
+        for i, bucket_count in enumerate(entry[0]):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, (bucket_counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """A gauge (or counter) read from elsewhere when metrics are collected.
+
+    ``callback`` returns a number, or a dict mapping label value tuples to
+    numbers.
+    """
+
+    def __init__(self, name: str, help: str, callback: Callable[[], Union[float, Dict[Labels, float]]],
+                 labels: Tuple[str, ...] = (), metric_type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labels = labels
+        self.type = metric_type
+
+    def collect(self) -> Dict[Labels, float]:
+        value = self.callback()
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {value}" for labels, value in self.collect().items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Union[Counter, Histogram, CallbackMetric]] = {}
+        self.started = time.time()
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, callback: Callable, labels: Tuple[str, ...] = (),
+              metric_type: str = "gauge") -> CallbackMetric:
+        return self._register(CallbackMetric(name, help, callback, labels, metric_type))
+
+    def uptime(self) -> float:
+        return time.time() - self.started
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                rendered = metric.render()
+            except Exception as e:
+                logger.error(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(rendered)
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        # Registering a name again (e.g. from a reloaded cog) replaces it
+        self.metrics[metric.name] = metric
+        return metric
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident memory of this process, None where it can't be read."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+REGISTRY = Registry()
+
+DB_LATENCY = REGISTRY.histogram("knott_db_call_seconds", "DatabaseManager call latency", ("method",))
+DB_ERRORS = REGISTRY.counter("knott_db_errors_total", "DatabaseManager calls that raised", ("method",))
+STAGE_LATENCY = REGISTRY.histogram("knott_message_stage_seconds", "Latency of each message processing stage", ("stage",))
+RECONNECT_LATENCY = REGISTRY.histogram(
+    "knott_gateway_reconnect_seconds", "Time from a shard losing its gateway connection to having it back", ("how",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+MESSAGES = REGISTRY.counter("knott_messages_total", "Guild messages seen, by whether they earned XP", ("result",))
+VOICE_TICK_LATENCY = REGISTRY.histogram("knott_voice_tick_seconds", "Time spent in each phase of a voice XP tick", ("phase",))
+XP_RULE_DENIALS = REGISTRY.counter("knott_xp_rule_denials_total", "Messages denied XP by a guild's XP rules", ("rule",))
+
+
+def instrument_methods(cls, histogram: Histogram = DB_LATENCY, errors: Counter = DB_ERRORS):
+    """Time every public coroutine method of ``cls``, labelled by method name."""
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(method):
+            continue
+        setattr(cls, name, _timed(method, name, histogram, errors))
+    return cls
+
+
+def _timed(method, name: str, histogram: Histogram, errors: Counter):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            errors.inc(name)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+async def start_http_server(host: str, port: int, registry: Registry = REGISTRY):
+    """Serve ``/metrics`` for Prometheus; returns the runner to clean up on shutdown."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional
+import discord
+import botsettings
+from cache import LRUCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+# Seconds between writes of newly seen names to the database
+FLUSH_INTERVAL = 30
+# Most user fetches waiting at once; ids past this are retried on a later render
+MAX_QUEUED_FETCHES = 500
+
+
+class DisplayNameCache:
+    """Display names of users the client may not have cached, for leaderboards.
+
+    Names are learned from message authors as they arrive and kept in an
+    LRU backed by the ``display_names`` table, which new names are written
+    to in batches. resolve() never waits on Discord: ids found nowhere are
+    fetched in the background, a few at a time and paced to
+    ``fetches_per_second``, so the next render has them.
+    """
+
+    def __init__(self, bot, maxsize: int = None, fetch_concurrency: int = None, fetches_per_second: float = None):
+        self.bot = bot
+        self.db_manager = bot.db_manager
+        # user_id -> name, or None for ids Discord doesn't know
+        self._names = LRUCache(maxsize or botsettings.display_name_cache_size)
+        self._pending: Dict[int, str] = {}
+        self.fetch_concurrency = fetch_concurrency or botsettings.display_name_fetch_concurrency
+        self._fetch_interval = 1 / (fetches_per_second or botsettings.display_name_fetches_per_second)
+        self._next_fetch_at = 0.0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._fetches: Dict[int, asyncio.Task] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.fetched = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    @property
+    def hit_rate(self) -> float:
+        return self._names.hit_rate
+
+    def observe(self, user: discord.abc.User):
+        """Remember a user's current name, e.g. a message author's."""
+        name = user.global_name or user.name
+        if self._names.get(user.id, None, count=False) == name:
+            return
+        self._names.set(user.id, name)
+        self._pending[user.id] = name
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def resolve(self, user_ids: Iterable[int]) -> Dict[int, str]:
+        """Names of the ``user_ids`` known right now; the rest are fetched in the background."""
+        names = {}
+        missing: List[int] = []
+        for user_id in user_ids:
+            name = self._names.get(user_id)
+            if name is MISSING:
+                user = self.bot.get_user(user_id)
+                if user is None:
+                    missing.append(user_id)
+                    continue
+                name = user.display_name
+                self._names.set(user_id, name)
+            if name is not None:
+                names[user_id] = name
+
+        if missing:
+            stored = await self.db_manager.get_display_names(missing)
+            for user_id, name in stored.items():
+                self._names.set(user_id, name)
+                names[user_id] = name
+            for user_id in missing:
+                if user_id not in stored:
+                    self._fetch_later(user_id)
+        return names
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await self.db_manager.save_display_names(list(pending.items()))
+        except Exception:
+            # Keep them for the next flush, unless a newer name arrived meanwhile
+            for user_id, name in pending.items():
+                self._pending.setdefault(user_id, name)
+            raise
+
+    async def close(self):
+        tasks = list(self._fetches.values())
+        if self._flush_task is not None:
+            tasks.append(self._flush_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._flush_task = None
+        await self.flush()
+
+    def _fetch_later(self, user_id: int):
+        if user_id in self._fetches or len(self._fetches) >= MAX_QUEUED_FETCHES:
+            return
+        task = asyncio.create_task(self._fetch(user_id))
+        self._fetches[user_id] = task
+        task.add_done_callback(lambda _: self._fetches.pop(user_id, None))
+
+    async def _fetch(self, user_id: int):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.fetch_concurrency)
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                # Space fetches out so a large board can't use up the rate limit
+                start_at = max(self._next_fetch_at, loop.time())
+                self._next_fetch_at = start_at + self._fetch_interval
+                await asyncio.sleep(start_at - loop.time())
+                user = await self.bot.fetch_user(user_id)
+            self.fetched += 1
+            self.observe(user)
+        except discord.NotFound:
+            self._names.set(user_id, None)
+        except discord.HTTPException as e:
+            self.failed += 1
+            logger.warning(f"Could not fetch user {user_id} for their display name: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error saving display names: {e}")
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+import botsettings
+
+logger = logging.getLogger(__name__)
+
+
+class _Partition:
+    """One worker's queue, plus the items deferred until it has room."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.items: Deque[tuple] = deque()
+        # (args, future) in arrival order; the worker moves them into
+        # ``items`` itself, so nothing submitted later can overtake them
+        self.deferred: Deque[Tuple[tuple, asyncio.Future]] = deque()
+        self.has_items = asyncio.Event()
+        self.busy = False
+
+    def __len__(self) -> int:
+        return len(self.items) + len(self.deferred)
+
+    def offer(self, args: tuple) -> Optional[asyncio.Future]:
+        """Queue ``args``, or return a future that resolves once they are queued."""
+        if not self.deferred and len(self.items) < self.maxsize:
+            self.items.append(args)
+            self.has_items.set()
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self.deferred.append((args, future))
+        return future
+
+    def take(self) -> tuple:
+        args = self.items.popleft()
+        while self.deferred and len(self.items) < self.maxsize:
+            deferred_args, future = self.deferred.popleft()
+            self.items.append(deferred_args)
+            future.set_result(True)
+        if not self.items:
+            self.has_items.clear()
+        return args
+
+
+class XPPipeline:
+    """Bounded queue of XP work, drained by a pool of workers.
+
+    Work is partitioned by user: every item for a user lands in the same
+    worker's queue, so one user's messages are processed in order while
+    different users are processed concurrently.
+
+    ``submit()`` never waits while there is room. When a partition is full
+    the item is deferred for up to ``enqueue_timeout_ms`` milliseconds
+    waiting for space, and dropped if none frees up in time. Both cases are
+    counted, so a backlog shows up as numbers instead of as latency.
+    """
+
+    def __init__(self, handler: Callable[..., Awaitable[Any]], workers: int = None,
+                 max_queue: int = None, enqueue_timeout_ms: int = None):
+        self.handler = handler
+        self.worker_count = workers or botsettings.xp_workers
+        self.max_queue = max_queue or botsettings.xp_queue_size
+        self.enqueue_timeout = (botsettings.xp_enqueue_timeout_ms if enqueue_timeout_ms is None else enqueue_timeout_ms) / 1000
+        self.submitted = 0
+        self.processed = 0
+        self.deferred = 0
+        self.dropped = 0
+        self.failed = 0
+        self._partitions: List[_Partition] = []
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        return sum(len(partition) for partition in self._partitions)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "depth": self.depth,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "deferred": self.deferred,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    async def submit(self, user_id: int, *args) -> bool:
+        """Queue ``handler(*args)`` behind the user's earlier work; False if it was dropped."""
+        self._ensure_workers()
+        partition = self._partitions[user_id % self.worker_count]
+        self.submitted += 1
+
+        future = partition.offer(args)
+        if future is None:
+            return True
+
+        self.deferred += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.enqueue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            if future.done():
+                return True
+            partition.deferred.remove((args, future))
+            self.dropped += 1
+            return False
+
+    async def close(self, timeout: float = 10):
+        """Finish queued work (for up to ``timeout`` seconds), then stop the workers."""
+        if not self._workers:
+            return
+        deadline = time.monotonic() + timeout
+        while any(len(partition) or partition.busy for partition in self._partitions):
+            if time.monotonic() >= deadline:
+                logger.warning(f"Stopping XP workers with {self.depth} events still queued")
+                break
+            await asyncio.sleep(0.05)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _ensure_workers(self):
+        if self._workers:
+            return
+        size = max(1, self.max_queue // self.worker_count)
+        self._partitions = [_Partition(size) for _ in range(self.worker_count)]
+        self._workers = [asyncio.create_task(self._work(partition)) for partition in self._partitions]
+
+    async def _work(self, partition: _Partition):
+        while True:
+            await partition.has_items.wait()
+            args = partition.take()
+            partition.busy = True
+            try:
+                await self.handler(*args)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error processing XP event: {e}")
+            finally:
+                partition.busy = False
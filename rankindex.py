@@ -0,0 +1,299 @@
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import botsettings
+
+_MAX_USER_ID = float("inf")
+
+
+class _Fenwick:
+    """Binary indexed tree over a fixed number of counters."""
+
+    def __init__(self, counts: List[int] = ()):
+        # Built in O(n): each node passes its sum on to its parent
+        tree = [0] + list(counts)
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def add(self, index: int, delta: int):
+        i = index + 1
+        tree = self._tree
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index: int) -> int:
+        """Sum of the counters up to and including ``index``."""
+        i = min(index + 1, len(self._tree) - 1)
+        tree = self._tree
+        total = 0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, position: int) -> Tuple[int, int]:
+        """``(index, offset)`` of the ``position``-th counted item, 0-based."""
+        tree = self._tree
+        i = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            j = i + step
+            if j < len(tree) and tree[j] <= position:
+                i = j
+                position -= tree[j]
+            step >>= 1
+        return i, position
+
+
+class _SortedKeys:
+    """Sorted list of keys, stored as chunks of at most ``2 * load`` keys.
+
+    An insert or removal shifts one chunk and positions come from a
+    Fenwick tree over the chunk lengths, so every operation is
+    logarithmic apart from that bounded shift, however keys are
+    distributed (the tree is only rebuilt when a chunk splits or merges).
+    """
+
+    def __init__(self, load: int = 512):
+        self._load = load
+        self._chunks: List[List[Tuple]] = []
+        self._maxes: List[Tuple] = []
+        self._tree = _Fenwick()
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, key: Tuple):
+        self._len += 1
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            self._tree = _Fenwick([1])
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._chunks):
+            i -= 1
+            self._chunks[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._chunks[i], key)
+        if len(self._chunks[i]) > 2 * self._load:
+            chunk = self._chunks[i]
+            half = len(chunk) // 2
+            self._chunks[i:i + 1] = [chunk[:half], chunk[half:]]
+            self._maxes[i:i + 1] = [chunk[half - 1], chunk[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree.add(i, 1)
+
+    def remove(self, key: Tuple):
+        i = bisect_left(self._maxes, key)
+        chunk = self._chunks[i]
+        del chunk[bisect_left(chunk, key)]
+        self._len -= 1
+        if len(chunk) >= self._load // 2 or len(self._chunks) == 1:
+            if chunk:
+                self._maxes[i] = chunk[-1]
+                self._tree.add(i, -1)
+            else:
+                del self._chunks[i], self._maxes[i]
+                self._tree = _Fenwick()
+            return
+        # Merge a small chunk into a neighbour (and split again if that's too big)
+        j = i + 1 if i + 1 < len(self._chunks) else i - 1
+        low, high = min(i, j), max(i, j)
+        merged = self._chunks[low] + self._chunks[high]
+        if len(merged) > 2 * self._load:
+            half = len(merged) // 2
+            self._chunks[low:high + 1] = [merged[:half], merged[half:]]
+            self._maxes[low:high + 1] = [merged[half - 1], merged[-1]]
+        else:
+            self._chunks[low:high + 1] = [merged]
+            self._maxes[low:high + 1] = [merged[-1]]
+        self._rebuild_tree()
+
+    def count_at_most(self, key: Tuple) -> int:
+        """Number of keys ``<= key``."""
+        i = bisect_right(self._maxes, key)
+        before = self._tree.prefix(i - 1)
+        return before + bisect_right(self._chunks[i], key) if i < len(self._chunks) else before
+
+    def count_below(self, key: Tuple) -> int:
+        """Number of keys ``< key``."""
+        i = bisect_left(self._maxes, key)
+        before = self._tree.prefix(i - 1)
+        return before + bisect_left(self._chunks[i], key) if i < len(self._chunks) else before
+
+    def descending(self, position: int):
+        """Yield the keys from ``position`` (0-based, ascending order) down to the smallest."""
+        if position < 0 or position >= self._len:
+            return
+        i, offset = self._tree.find(position)
+        while i >= 0:
+            chunk = self._chunks[i]
+            for j in range(offset, -1, -1):
+                yield chunk[j]
+            i -= 1
+            if i >= 0:
+                offset = len(self._chunks[i]) - 1
+
+    def _rebuild_tree(self):
+        self._tree = _Fenwick([len(chunk) for chunk in self._chunks])
+
+
+class RankIndex:
+    """Order-statistic index over ``(level, xp)`` scores.
+
+    Every user's ``(level, xp, user_id)`` is kept in one _SortedKeys, so a
+    rank is a logarithmic count of the keys above it, top-K and keyset
+    pages walk down from a position, and updates stay logarithmic even
+    when most users share a level.
+    """
+
+    def __init__(self):
+        # user_id -> (level, xp, total_messages)
+        self._entries: Dict[int, Tuple[int, int, int]] = {}
+        self._keys = _SortedKeys()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._entries
+
+    def get(self, user_id: int) -> Optional[Tuple[int, int, int]]:
+        return self._entries.get(user_id)
+
+    def set_score(self, user_id: int, level: int, xp: int, messages: int):
+        level = max(level, 0)
+        old = self._entries.get(user_id)
+        if old is not None:
+            old_level, old_xp, _ = old
+            if (old_level, old_xp) == (level, xp):
+                self._entries[user_id] = (level, xp, messages)
+                return
+            self._keys.remove((old_level, old_xp, user_id))
+        self._keys.add((level, xp, user_id))
+        self._entries[user_id] = (level, xp, messages)
+
+    def remove(self, user_id: int):
+        old = self._entries.pop(user_id, None)
+        if old is not None:
+            self._keys.remove((old[0], old[1], user_id))
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based rank of a user, or None if the user isn't indexed."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        level, xp, _ = entry
+        # Users with the same level and XP share a rank
+        return len(self._keys) - self._keys.count_at_most((level, xp, _MAX_USER_ID)) + 1
+
+    def top(self, limit: int, offset: int = 0) -> List[Tuple[int, int, int, int]]:
+        """``(user_id, level, xp, total_messages)`` rows, best first."""
+        return self._rows(len(self._keys) - 1 - offset, limit)
+
+    def after(self, level: int, xp: int, user_id: int, limit: int) -> List[Tuple[int, int, int, int]]:
+        """Like top(), but starting below the ``(level, xp, user_id)`` cursor."""
+        return self._rows(self._keys.count_below((level, xp, user_id)) - 1, limit)
+
+    def _rows(self, position: int, limit: int) -> List[Tuple[int, int, int, int]]:
+        rows = []
+        if limit <= 0:
+            return rows
+        for level, xp, user_id in self._keys.descending(position):
+            rows.append((user_id, level, xp, self._entries[user_id][2]))
+            if len(rows) >= limit:
+                break
+        return rows
+
+
+class RankIndexes:
+    """The global rank index plus lazily built per-guild indexes.
+
+    Indexes are built from the database the first time they're needed and
+    then kept current by the XP write path. Updates that arrive while an
+    index is being built are replayed once the build finishes.
+    """
+
+    def __init__(self, db_manager, max_guilds: int = None):
+        self.db_manager = db_manager
+        self.max_guilds = max_guilds or botsettings.rank_index_max_guilds
+        self.global_index: Optional[RankIndex] = None
+        self._guilds: "OrderedDict[int, RankIndex]" = OrderedDict()
+        self._builds: Dict[Optional[int], asyncio.Future] = {}
+        self._pending: Dict[Optional[int], List[Tuple[int, int, int, int]]] = {}
+
+    def loaded(self, guild_id: int = None) -> Optional[RankIndex]:
+        if guild_id is None:
+            return self.global_index
+        index = self._guilds.get(guild_id)
+        if index is not None:
+            self._guilds.move_to_end(guild_id)
+        return index
+
+    async def get(self, guild_id: int = None) -> RankIndex:
+        index = self.loaded(guild_id)
+        if index is not None:
+            return index
+        build = self._builds.get(guild_id)
+        if build is None:
+            build = self._builds[guild_id] = asyncio.ensure_future(self._build(guild_id))
+        return await asyncio.shield(build)
+
+    def set_score(self, guild_id: Optional[int], user_id: int, level: int, xp: int, messages: int):
+        index = self.loaded(guild_id)
+        if index is not None:
+            index.set_score(user_id, level, xp, messages)
+        elif guild_id in self._pending:
+            self._pending[guild_id].append((user_id, level, xp, messages))
+
+    def invalidate(self):
+        """Drop every index, e.g. after levels were rewritten in bulk."""
+        self.global_index = None
+        self._guilds.clear()
+
+    async def _build(self, guild_id: Optional[int]) -> RankIndex:
+        self._pending[guild_id] = []
+        try:
+            index = RankIndex()
+            buffer = self.db_manager.xp_buffer
+            if buffer is None:
+                await self._load(index, guild_id)
+            else:
+                # Hold off flushes so every buffered gain is either in what we
+                # read from the database or still in the buffer afterwards
+                async with buffer.flush_lock:
+                    await self._load(index, guild_id)
+                    if guild_id is None:
+                        for user_id, (xp, level, messages) in buffer.buffered_globals():
+                            index.set_score(user_id, level, xp, messages)
+                    else:
+                        for user_id, (xp, level, messages) in buffer.buffered_servers(guild_id):
+                            index.set_score(user_id, level, xp, messages)
+
+            for user_id, level, xp, messages in self._pending[guild_id]:
+                index.set_score(user_id, level, xp, messages)
+
+            if guild_id is None:
+                self.global_index = index
+            else:
+                self._guilds[guild_id] = index
+                while len(self._guilds) > self.max_guilds:
+                    self._guilds.popitem(last=False)
+            return index
+        finally:
+            self._pending.pop(guild_id, None)
+            self._builds.pop(guild_id, None)
+
+    async def _load(self, index: RankIndex, guild_id: Optional[int]):
+        async for rows in self.db_manager.iter_scores(guild_id):
+            for user_id, level, xp, messages in rows:
+                index.set_score(user_id, level, xp, messages)
@@ -0,0 +1,43 @@
+"""Re-level every stored user after LEVEL_UP_BASE changed.
+
+Run this with the bot stopped, e.g. after raising LEVEL_UP_BASE from 50 to 75:
+
+    python recompute_levels.py --old-base 50 --new-base 75
+"""
+import argparse
+import asyncio
+import botsettings
+from database import DatabaseManager
+
+
+def print_progress(table: str, done: int, total: int, elapsed: float):
+    percent = done / total * 100 if total else 100.0
+    rate = done / elapsed if elapsed > 0 else 0
+    print(f"{table}: {done}/{total} rows ({percent:.1f}%), {rate:,.0f} rows/s")
+
+
+async def run(args):
+    db_manager = DatabaseManager(args.database)
+    await db_manager.connect()
+    try:
+        updated = await db_manager.recompute_levels(args.old_base, args.new_base, args.chunk_size, print_progress)
+    finally:
+        await db_manager.close()
+    for table, count in updated.items():
+        print(f"{table}: {count} rows re-levelled")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-level stored users for a new LEVEL_UP_BASE.")
+    parser.add_argument("--old-base", type=int, required=True, help="LEVEL_UP_BASE the stored levels were earned with")
+    parser.add_argument("--new-base", type=int, default=botsettings.level_up_base, help="LEVEL_UP_BASE to re-level for (default: current setting)")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="rows per transaction")
+    parser.add_argument("--database", default=None, help="database file (default: DATABASE_NAME)")
+    args = parser.parse_args()
+    if args.old_base <= 0 or args.new_base <= 0:
+        parser.error("bases must be positive")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+import discord
+import botsettings
+from database import RankSyncState
+
+logger = logging.getLogger(__name__)
+
+# Seconds between edits of a sync's status message
+STATUS_INTERVAL = 5
+
+
+class RoleLadder:
+    """A guild's rank roles, compiled for diffing member roles against levels.
+
+    Rank roles are cumulative: a member should hold every role whose level
+    they have reached and none of the ones above it. Levels are global
+    levels, the same ones level-ups grant rank roles by. Roles the bot cannot
+    assign are never added or removed.
+    """
+
+    def __init__(self, guild: discord.Guild, rank_roles: Iterable[Tuple[int, int]]):
+        entries = []
+        for level, role_id in sorted(rank_roles):
+            role = guild.get_role(role_id)
+            if role is not None:
+                entries.append((level, role))
+        self.levels = [level for level, _ in entries]
+        self.roles = [role for _, role in entries]
+        self.assignable = {role.id for role in self.roles if role.is_assignable()}
+
+    def __len__(self) -> int:
+        return len(self.roles)
+
+    def plan(self, current: List[discord.Role], level: int) -> Optional[List[discord.Role]]:
+        """The member's full role list after syncing, or None if nothing changes."""
+        earned = self.roles[:bisect_right(self.levels, level)]
+        wanted = {role.id for role in earned}
+        current_ids = {role.id for role in current}
+
+        remove = {role.id for role in self.roles if role.id in current_ids and role.id not in wanted} & self.assignable
+        add = {role.id: role for role in earned if role.id not in current_ids and role.id in self.assignable}
+        if not add and not remove:
+            return None
+        return [role for role in current if not role.is_default() and role.id not in remove] + list(add.values())
+
+
+class RoleSyncJobs:
+    """Background rank role syncs, at most one per guild.
+
+    A sync pages through every user tracked in the guild, diffs each member's
+    roles against the rank role ladder and applies the difference with a
+    single member edit. Edits from all syncs share one semaphore; discord.py
+    queues them further on the per-route rate limit buckets, so a large sync
+    slows down instead of tripping 429s. Progress is checkpointed after every
+    page, so a sync interrupted by a restart resumes where it stopped.
+    """
+
+    def __init__(self, bot, concurrency: int = None, page_size: int = None):
+        self.bot = bot
+        self.db_manager = bot.db_manager
+        self.concurrency = concurrency or botsettings.role_sync_concurrency
+        self.page_size = page_size or botsettings.role_sync_page_size
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._jobs: Dict[int, asyncio.Task] = {}
+
+    def running(self, guild_id: int) -> bool:
+        return guild_id in self._jobs
+
+    async def start(self, guild: discord.Guild, channel: discord.abc.Messageable, restart: bool = False) -> RankSyncState:
+        """Start a sync, resuming a checkpointed one unless ``restart`` is set."""
+        state = None if restart else await self.db_manager.get_rank_sync_state(guild.id)
+        resumed = state is not None
+
+        embed = discord.Embed(title="Rank Sync Started", color=discord.Color.blue())
+        if resumed:
+            embed.title = "Rank Sync Resumed"
+            embed.description = f"Continuing after {state.processed:,} users."
+        status = await channel.send(embed=embed)
+
+        if state is None:
+            state = RankSyncState(guild.id, channel.id, status.id)
+        else:
+            state = state._replace(channel_id=channel.id, message_id=status.id)
+        await self.db_manager.save_rank_sync_state(state)
+        self._spawn(guild, state, status)
+        return state
+
+    async def cancel(self, guild_id: int) -> bool:
+        """Stop a guild's sync and drop its checkpoint; False if none existed."""
+        task = self._jobs.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+        existed = task is not None or await self.db_manager.get_rank_sync_state(guild_id) is not None
+        await self.db_manager.clear_rank_sync_state(guild_id)
+        return existed
+
+    async def resume_all(self):
+        """Restart every checkpointed sync, e.g. after the bot restarted."""
+        for state in await self.db_manager.get_rank_sync_states():
+            guild = self.bot.get_guild(state.guild_id)
+            if guild is None or self.running(guild.id):
+                continue
+            channel = guild.get_channel(state.channel_id) if state.channel_id else None
+            status = channel.get_partial_message(state.message_id) if channel and state.message_id else None
+            self._spawn(guild, state, status)
+            logger.info(f"Resumed rank sync for guild {guild.id} after {state.processed} users")
+
+    def stop_all(self):
+        """Cancel running syncs but keep their checkpoints for resume_all()."""
+        for task in self._jobs.values():
+            task.cancel()
+        self._jobs.clear()
+
+    def _spawn(self, guild: discord.Guild, state: RankSyncState, status: Optional[discord.Message]):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        task = asyncio.create_task(self._run(guild, state, status))
+        self._jobs[guild.id] = task
+        task.add_done_callback(lambda t: self._jobs.pop(guild.id, None) if self._jobs.get(guild.id) is t else None)
+
+    async def _run(self, guild: discord.Guild, state: RankSyncState, status: Optional[discord.Message]):
+        try:
+            ladder = RoleLadder(guild, await self.db_manager.get_rank_roles(guild.id))
+            total = await self.db_manager.count_guild_users(guild.id)
+            after = None
+            if state.last_user_id is not None:
+                after = (state.last_level, state.last_xp, state.last_user_id)
+            started = time.monotonic()
+            last_report = started
+            start_processed = state.processed
+
+            while True:
+                rows = await self.db_manager.get_guild_levels_page(guild.id, after, self.page_size)
+                if not rows:
+                    break
+                members = await self.bot.member_cache.get_many(guild, [user_id for user_id, _, _, _ in rows])
+                results = await asyncio.gather(*(
+                    self._sync_member(members[user_id], ladder, self._current_level(user_id, global_level))
+                    for user_id, _, _, global_level in rows if user_id in members
+                ))
+
+                user_id, level, xp, _ = rows[-1]
+                after = (level, xp, user_id)
+                state = state._replace(
+                    last_level=level, last_xp=xp, last_user_id=user_id,
+                    processed=state.processed + len(rows),
+                    changed=state.changed + results.count(True),
+                    failed=state.failed + results.count(False)
+                )
+                await self.db_manager.save_rank_sync_state(state)
+
+                if time.monotonic() - last_report >= STATUS_INTERVAL:
+                    last_report = time.monotonic()
+                    rate = (state.processed - start_processed) / (last_report - started)
+                    await self._report(status, state, total, f"{rate:,.0f} users/s")
+
+            await self.db_manager.clear_rank_sync_state(guild.id)
+            await self._report(status, state, total, done=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error syncing rank roles for guild {guild.id}: {e}")
+            await self._report(status, state, None, "Stopped by an error, run `ksyncranks` to resume.")
+
+    def _current_level(self, user_id: int, level: int) -> int:
+        # Prefer gains that are still waiting in the write-behind buffer
+        if self.db_manager.xp_buffer is not None:
+            buffered = self.db_manager.xp_buffer.get_global(user_id)
+            if buffered:
+                return buffered[1]
+        return level
+
+    async def _sync_member(self, member: discord.Member, ladder: RoleLadder, level: int) -> Optional[bool]:
+        """True if the member's roles were changed, False if that failed, None if nothing to do."""
+        if ladder.plan(member.roles, level) is None:
+            return None
+        async with self._semaphore:
+            # Plan again, the member's roles may have changed while waiting
+            roles = ladder.plan(member.roles, level)
+            if roles is None:
+                return None
+            try:
+                updated = await member.edit(roles=roles, reason="Rank role sync")
+                if updated is not None:
+                    self.bot.member_cache.remember(updated)
+                else:
+                    self.bot.member_cache.forget(member.guild.id, member.id)
+                return True
+            except discord.HTTPException as e:
+                logger.warning(f"Cannot sync rank roles for {member.display_name}: {e}")
+                return False
+
+    async def _report(self, status: Optional[discord.Message], state: RankSyncState, total: Optional[int],
+                      note: str = None, done: bool = False):
+        if status is None:
+            return
+        if done:
+            embed = discord.Embed(
+                title="Rank Sync Complete",
+                description=f"Checked {state.processed:,} users and updated roles for {state.changed:,}.",
+                color=discord.Color.green()
+            )
+        else:
+            progress = f"{state.processed:,}/{total:,}" if total else f"{state.processed:,}"
+            embed = discord.Embed(
+                title="Rank Sync Running",
+                description=f"Checked {progress} users, updated roles for {state.changed:,}.",
+                color=discord.Color.blue()
+            )
+        if state.failed:
+            embed.add_field(name="Failed", value=f"{state.failed:,} members could not be updated", inline=False)
+        if note:
+            embed.set_footer(text=note)
+        try:
+            await status.edit(embed=embed)
+        except discord.HTTPException:
+            pass
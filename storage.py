@@ -0,0 +1,317 @@
+"""Single-writer storage process for sharded deployments.
+
+Several shard processes can't all write the same SQLite file without
+fighting over its lock, so when the bot runs sharded (see launcher.py) one
+storage process owns every write. Shards keep reading through their own WAL
+reader connections and send each DatabaseManager write method call here
+over a Unix socket; the storage process runs it and broadcasts what changed
+so every shard can update its caches and rank indexes.
+
+Run it on its own (launcher.py does this for you):
+
+    python storage.py --socket /tmp/knott.sock
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import pickle
+import signal
+import struct
+from typing import Dict, FrozenSet, Iterable, List, Optional
+import botsettings
+
+logger = logging.getLogger(__name__)
+
+# Every frame is a 4-byte length followed by a pickled list of messages:
+#   shard -> storage: ("hello", shard_ids, shard_count), ("call", request_id, method, args, kwargs)
+#   storage -> shard: ("result", request_id, value), ("error", request_id, message), ("change", change)
+HEADER = struct.Struct("!I")
+# How long a shard keeps retrying to reach a storage process that is starting up
+CONNECT_TIMEOUT = 30
+
+
+class StorageError(Exception):
+    """A write failed in the storage process."""
+
+
+def shard_for(guild_id: int, shard_count: int) -> int:
+    """The shard Discord delivers ``guild_id``'s events to."""
+    return (guild_id >> 22) % shard_count
+
+
+class _Connection:
+    """One end of a storage socket.
+
+    Messages sent during the same event loop iteration go out as a single
+    frame, so concurrent XP workers share one write and one wakeup.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._outgoing: List[tuple] = []
+
+    def send(self, message: tuple):
+        if not self._outgoing:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._outgoing.append(message)
+
+    def _flush(self):
+        messages, self._outgoing = self._outgoing, []
+        if self.writer.is_closing():
+            return
+        payload = pickle.dumps(messages, protocol=pickle.HIGHEST_PROTOCOL)
+        self.writer.write(HEADER.pack(len(payload)) + payload)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def receive(self) -> List[tuple]:
+        (size,) = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+        return pickle.loads(await self.reader.readexactly(size))
+
+    def close(self):
+        self.writer.close()
+
+
+class StorageServer:
+    """Runs shards' write calls on the one DatabaseManager allowed to write.
+
+    Consecutive ``update_user_xp`` calls in a frame are applied as one
+    transaction. Score changes of a guild are only sent to the shard that
+    owns the guild; everything else goes to every shard.
+    """
+
+    def __init__(self, db_manager, path: str, methods: Iterable[str]):
+        self.db_manager = db_manager
+        self.path = path
+        self.methods = frozenset(methods)
+        self.calls = 0
+        self.batches = 0
+        # Connected shards -> the shard ids they run (None = all of them)
+        self._shards: Dict[_Connection, Optional[FrozenSet[int]]] = {}
+        self._shard_count = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        db_manager.on_change = self._broadcast
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, self.path)
+        # Calls are pickled, so only this user may connect
+        os.chmod(self.path, 0o600)
+        logger.info(f"Storage process listening on {self.path}")
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for connection in list(self._shards):
+            connection.close()
+        await self._server.wait_closed()
+        self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = _Connection(reader, writer)
+        try:
+            while True:
+                messages = await connection.receive()
+                await self._handle(connection, messages)
+                await connection.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Error serving shard connection: {e}")
+        finally:
+            self._shards.pop(connection, None)
+            connection.close()
+
+    async def _handle(self, connection: _Connection, messages: List[tuple]):
+        i = 0
+        while i < len(messages):
+            message = messages[i]
+            if message[0] == "hello":
+                _, shard_ids, shard_count = message
+                self._shards[connection] = frozenset(shard_ids) if shard_ids else None
+                self._shard_count = shard_count or self._shard_count
+                i += 1
+                continue
+
+            _, request_id, method, args, kwargs = message
+            if method == "update_user_xp" and not kwargs:
+                end = i + 1
+                while end < len(messages) and messages[end][0] == "call" and messages[end][2] == method and not messages[end][4]:
+                    end += 1
+                await self._run_xp_batch(connection, messages[i:end])
+                i = end
+                continue
+
+            self.calls += 1
+            if method not in self.methods:
+                connection.send(("error", request_id, f"{method} is not a write method"))
+            else:
+                try:
+                    result = await getattr(self.db_manager, method)(*args, **kwargs)
+                    connection.send(("result", request_id, result))
+                except Exception as e:
+                    logger.error(f"Error running {method} for a shard: {e}")
+                    connection.send(("error", request_id, f"{type(e).__name__}: {e}"))
+            i += 1
+
+    async def _run_xp_batch(self, connection: _Connection, calls: List[tuple]):
+        self.calls += len(calls)
+        self.batches += 1
+        try:
+            results = await self.db_manager.update_user_xp_batch([args for _, _, _, args, _ in calls])
+        except Exception as e:
+            logger.error(f"Error applying {len(calls)} XP events: {e}")
+            for _, request_id, _, _, _ in calls:
+                connection.send(("error", request_id, f"{type(e).__name__}: {e}"))
+            return
+        for (_, request_id, _, _, _), result in zip(calls, results):
+            connection.send(("result", request_id, result))
+
+    def _broadcast(self, change: tuple):
+        guild_id = change[1] if change[0] in ("score", "guild_settings") else None
+        for connection, shard_ids in self._shards.items():
+            if guild_id is None or shard_ids is None or not self._shard_count \
+                    or shard_for(guild_id, self._shard_count) in shard_ids:
+                connection.send(("change", change))
+
+
+class StorageClient:
+    """A shard's link to the storage process.
+
+    ``call()`` sends a write and waits for its result. Changes broadcast by
+    the storage process are handed to ``db_manager.apply_change()``; they
+    are sent before the result of the write that caused them, so a shard
+    always sees its own writes in its caches. After a reconnect everything
+    cached is dropped, since changes may have been missed in between.
+    """
+
+    def __init__(self, path: str, db_manager, shard_ids: List[int] = None, shard_count: int = None):
+        self.path = path
+        self.db_manager = db_manager
+        self.shard_ids = botsettings.shard_ids if shard_ids is None else shard_ids
+        self.shard_count = botsettings.shard_count if shard_count is None else shard_count
+        self._connection: Optional[_Connection] = None
+        self._receiver: Optional[asyncio.Task] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+
+    async def call(self, method: str, args: tuple, kwargs: dict):
+        connection = await self._connect()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        connection.send(("call", request_id, method, args, kwargs))
+        try:
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def close(self):
+        if self._receiver is not None:
+            self._receiver.cancel()
+            self._receiver = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def _connect(self) -> _Connection:
+        if self._connection is not None:
+            return self._connection
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._connection is not None:
+                return self._connection
+            deadline = asyncio.get_running_loop().time() + CONNECT_TIMEOUT
+            delay = 0.1
+            while True:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.path)
+                    break
+                except (FileNotFoundError, ConnectionError):
+                    if asyncio.get_running_loop().time() >= deadline:
+                        raise
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 2.0)
+
+            connection = _Connection(reader, writer)
+            connection.send(("hello", self.shard_ids, self.shard_count))
+            self.db_manager.reset_cached_state()
+            self._receiver = asyncio.create_task(self._receive(connection))
+            self._connection = connection
+            return connection
+
+    async def _receive(self, connection: _Connection):
+        try:
+            while True:
+                for message in await connection.receive():
+                    kind = message[0]
+                    if kind == "change":
+                        self.db_manager.apply_change(message[1])
+                        continue
+                    future = self._pending.get(message[1])
+                    if future is None or future.done():
+                        continue
+                    if kind == "result":
+                        future.set_result(message[2])
+                    else:
+                        future.set_exception(StorageError(message[2]))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.error(f"Lost connection to the storage process: {e}")
+        finally:
+            if self._connection is connection:
+                self._connection = None
+            connection.close()
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Lost connection to the storage process"))
+
+
+async def serve(path: str):
+    from database import DatabaseManager, WRITE_METHODS
+    import metrics
+
+    # Buffered XP would be invisible to the shards' readers, so write through
+    db_manager = DatabaseManager(storage_socket="", write_behind=False)
+    await db_manager.init_database()
+    await db_manager.initialize_default_achievements()
+    server = StorageServer(db_manager, path, WRITE_METHODS)
+    await server.start()
+    metrics_runner = None
+    if botsettings.metrics_port:
+        metrics_runner = await metrics.start_http_server(botsettings.metrics_host, botsettings.metrics_port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    logger.info(f"Storage process stopping after {server.calls} calls")
+    await server.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the storage process that owns all database writes.")
+    parser.add_argument("--socket", default=botsettings.storage_socket or None, help="Unix socket to listen on (default: STORAGE_SOCKET)")
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error("set --socket or STORAGE_SOCKET")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.socket))
+
+
+if __name__ == "__main__":
+    main()
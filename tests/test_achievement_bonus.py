@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+import pytest
+
+import botsettings
+import leveling
+from database import DatabaseManager
+
+
+async def _award_bonus(db_path: str, write_behind: bool):
+    db_manager = DatabaseManager(db_path, write_behind=write_behind)
+    try:
+        await db_manager.init_database()
+        await db_manager.initialize_default_achievements()
+        await db_manager.update_user_xp(1, 100, 10, int(time.time()))
+        # Every level achievement at once: thousands of XP, worth many levels
+        earned = await db_manager.check_and_award_achievements(1, 100, 375, 1)
+        if write_behind:
+            await db_manager.xp_buffer.flush()
+        async with db_manager._read() as db:
+            async with db.execute("SELECT xp, level FROM users WHERE user_id = 1 AND guild_id = 100") as cursor:
+                xp, level = await cursor.fetchone()
+        return sum(reward for _, _, reward in earned), xp, level
+    finally:
+        await db_manager.close()
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_bonus_xp_keeps_server_level_normalized(tmp_path, write_behind):
+    reward, xp, level = asyncio.run(_award_bonus(str(tmp_path / "knott.db"), write_behind))
+    assert reward > 2 * botsettings.level_up_base
+    assert 0 <= xp < leveling.xp_needed(level)
+    assert leveling.total_xp(level, xp) == 10 + reward
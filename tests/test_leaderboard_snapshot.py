@@ -0,0 +1,30 @@
+import asyncio
+import time
+
+from database import DatabaseManager
+
+
+async def _buffered_boards(db_path: str):
+    db_manager = DatabaseManager(db_path, write_behind=True)
+    try:
+        await db_manager.init_database()
+        now = int(time.time())
+        await db_manager.update_user_xp(1, 100, 30, now)
+        await db_manager.update_user_xp(2, 100, 20, now)
+        first = await db_manager.get_leaderboard_snapshot(100, 10)
+        # User 3 overtakes both while the gain is still buffered
+        await db_manager.update_user_xp(3, 100, 40, now)
+        second = await db_manager.get_leaderboard_snapshot(100, 10)
+        await db_manager.xp_buffer.flush()
+        after_flush = await db_manager.get_leaderboard_snapshot(100, 10)
+        flushed = await db_manager.get_leaderboard(100, 10)
+        return first, second, after_flush, flushed
+    finally:
+        await db_manager.close()
+
+
+def test_snapshots_include_buffered_gains(tmp_path):
+    first, second, after_flush, flushed = asyncio.run(_buffered_boards(str(tmp_path / "knott.db")))
+    assert [row[0] for row in first.rows] == [1, 2]
+    assert [row[0] for row in second.rows] == [3, 1, 2]
+    assert after_flush.rows == flushed
@@ -0,0 +1,25 @@
+import asyncio
+
+from database import INDEXED_QUERIES, DatabaseManager
+
+
+async def _query_plan_problems(db_path: str, drop_index: str = None):
+    db_manager = DatabaseManager(str(db_path), write_behind=False)
+    try:
+        await db_manager.init_database()
+        if drop_index:
+            async with db_manager._write() as db:
+                await db.execute(f"DROP INDEX {drop_index}")
+        return await db_manager.check_query_plans()
+    finally:
+        await db_manager.close()
+
+
+def test_hot_queries_use_their_indexes(tmp_path):
+    assert asyncio.run(_query_plan_problems(tmp_path / "knott.db")) == []
+
+
+def test_missing_index_is_reported(tmp_path):
+    index = INDEXED_QUERIES[0][2]
+    problems = asyncio.run(_query_plan_problems(tmp_path / "knott.db", drop_index=index))
+    assert problems and all(index in problem for problem in problems)
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from rankindex import RankIndex, _SortedKeys
+
+
+def _expected_rows(model):
+    order = sorted(((level, xp, user_id) for user_id, (level, xp, _) in model.items()), reverse=True)
+    return [(user_id, level, xp, model[user_id][2]) for level, xp, user_id in order]
+
+
+def _check(index, model):
+    rows = _expected_rows(model)
+    assert len(index) == len(model)
+    assert index.top(len(rows) + 5) == rows
+    assert index.top(7, 5) == rows[5:12]
+    for position, (user_id, level, xp, _) in enumerate(rows):
+        # Users with the same (level, xp) share a rank
+        assert index.rank(user_id) == 1 + sum(1 for row in rows if (row[1], row[2]) > (level, xp))
+        assert index.after(level, xp, user_id, 9) == rows[position + 1:position + 10]
+
+
+# Small chunk sizes force splits, merges and emptied chunks after a few keys
+@pytest.mark.parametrize("load", [2, 3, 8, 512])
+def test_matches_sorted_model(load):
+    rng = random.Random(load)
+    index = RankIndex()
+    index._keys = _SortedKeys(load)
+    model = {}
+    for step in range(4000):
+        user_id = rng.randint(1, 200)
+        if rng.random() < 0.15:
+            index.remove(user_id)
+            model.pop(user_id, None)
+        else:
+            # Few distinct scores, so ties on (level, xp) are common
+            score = (rng.randint(0, 5), rng.randint(0, 10), rng.randint(0, 9))
+            index.set_score(user_id, *score)
+            model[user_id] = score
+        if step % 101 == 0:
+            _check(index, model)
+    _check(index, model)
+
+    for user_id in list(model):
+        index.remove(user_id)
+        del model[user_id]
+    _check(index, model)
+    assert index.top(5) == [] and index.rank(1) is None
+
+
+def test_huge_level_needs_no_memory():
+    index = RankIndex()
+    index.set_score(1, 5, 10, 1)
+    index.set_score(2, 10 ** 12, 0, 1)
+    assert index.rank(2) == 1 and index.rank(1) == 2
+    assert index.top(1) == [(2, 10 ** 12, 0, 1)]
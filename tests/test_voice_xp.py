@@ -0,0 +1,170 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import botsettings
+import leveling
+from database import DatabaseManager
+
+BASE = botsettings.level_up_base
+
+
+async def _open(db_path: str, write_behind: bool) -> DatabaseManager:
+    db_manager = DatabaseManager(db_path, write_behind=write_behind)
+    await db_manager.init_database()
+    await db_manager.initialize_default_achievements()
+    return db_manager
+
+
+async def _stored(db_manager: DatabaseManager):
+    if db_manager.xp_buffer is not None:
+        await db_manager.xp_buffer.flush()
+    async with db_manager._read() as db:
+        async with db.execute(
+            "SELECT user_id, global_xp, global_level, total_global_messages FROM global_users ORDER BY user_id"
+        ) as cursor:
+            global_rows = [tuple(row) for row in await cursor.fetchall()]
+        async with db.execute(
+            "SELECT user_id, guild_id, xp, level, total_messages FROM users ORDER BY user_id, guild_id"
+        ) as cursor:
+            server_rows = [tuple(row) for row in await cursor.fetchall()]
+    return global_rows, server_rows
+
+
+async def _voice_then_text(db_path: str, write_behind: bool):
+    db_manager = await _open(db_path, write_behind)
+    try:
+        now = int(time.time())
+        # Voice only: the user has a row but has never sent a message
+        voice_level_ups = await db_manager.add_voice_xp([(1, 100, BASE - 5)], now)
+        text_result = await db_manager.update_user_xp(1, 100, 10, now)
+        return voice_level_ups, text_result
+    finally:
+        await db_manager.close()
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_text_level_up_after_voice_only_xp(tmp_path, write_behind):
+    voice_level_ups, text_result = asyncio.run(_voice_then_text(str(tmp_path / "knott.db"), write_behind))
+    assert voice_level_ups == []
+    assert text_result == (5, 2, True, 1)
+
+
+async def _voice_only(db_path: str, write_behind: bool):
+    db_manager = await _open(db_path, write_behind)
+    try:
+        now = int(time.time())
+        ticks = []
+        for _ in range(3):
+            # User 2's gains are a whole level's worth, so the first one levels a new row up
+            ticks.append(await db_manager.add_voice_xp([(1, 100, BASE // 2 + 1), (2, 100, BASE)], now))
+        return ticks, await _stored(db_manager)
+    finally:
+        await db_manager.close()
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_voice_only_level_ups(tmp_path, write_behind):
+    ticks, (global_rows, server_rows) = asyncio.run(_voice_only(str(tmp_path / "knott.db"), write_behind))
+    assert ticks[0] == [(2, 100, 2, 0)]
+    assert ticks[1] == [(1, 100, 2, 0)]
+    assert ticks[2] == [(2, 100, 3, 0)]
+
+    expected = {}
+    for user_id, gain in ((1, BASE // 2 + 1), (2, BASE)):
+        xp, level = 0, 1
+        for _ in range(3):
+            xp, level, _ = leveling.apply_xp(xp, level, gain)
+        expected[user_id] = (xp, level)
+    assert global_rows == [(user_id, xp, level, 0) for user_id, (xp, level) in expected.items()]
+    assert server_rows == [(user_id, 100, xp, level, 0) for user_id, (xp, level) in expected.items()]
+
+
+async def _mixed(db_path: str, write_behind: bool):
+    db_manager = await _open(db_path, write_behind)
+    try:
+        now = int(time.time())
+        for tick in range(20):
+            # User 1 only talks, user 2 is only in voice, user 3 does both in two servers
+            await db_manager.update_user_xp(1, 100, 7, now)
+            await db_manager.update_user_xp(3, 200, 7, now)
+            await db_manager.add_voice_xp([(2, 100, 3), (3, 100, 3 + tick % 2)], now)
+        return await _stored(db_manager)
+    finally:
+        await db_manager.close()
+
+
+def test_mixed_voice_and_text_match_between_modes(tmp_path):
+    direct = asyncio.run(_mixed(str(tmp_path / "direct.db"), False))
+    buffered = asyncio.run(_mixed(str(tmp_path / "buffered.db"), True))
+    assert direct == buffered
+    global_rows, server_rows = direct
+    assert [row[3] for row in global_rows] == [20, 0, 20]
+    assert [(row[0], row[1], row[4]) for row in server_rows] == [(1, 100, 20), (2, 100, 0), (3, 100, 0), (3, 200, 20)]
+    total = {user_id: leveling.total_xp(level, xp) for user_id, xp, level, _ in global_rows}
+    assert total == {1: 140, 2: 60, 3: 140 + 70}
+
+
+async def _voice_during_flushes(db_path: str):
+    db_manager = await _open(db_path, True)
+    try:
+        now = int(time.time())
+        tasks = []
+        for tick in range(50):
+            # New users each tick, so every add_voice() loads states while flushes run
+            gains = [(tick * 10 + i, 100 + i % 3, 1) for i in range(10)]
+            tasks.append(db_manager.add_voice_xp(gains, now))
+            tasks.append(db_manager.xp_buffer.flush())
+        await asyncio.gather(*tasks)
+        return await _stored(db_manager)
+    finally:
+        await db_manager.close()
+
+
+def test_buffered_voice_survives_concurrent_flushes(tmp_path):
+    global_rows, server_rows = asyncio.run(_voice_during_flushes(str(tmp_path / "knott.db")))
+    assert len(global_rows) == len(server_rows) == 500
+    assert all(xp == 1 and level == 1 for _, xp, level, _ in global_rows)
+
+
+async def _award_tick(db_path: str, write_behind: bool, monkeypatch):
+    import main
+
+    db_manager = await _open(db_path, write_behind)
+    try:
+        announced = []
+        channel = SimpleNamespace(id=10)
+        guild = SimpleNamespace(id=100, get_channel=lambda channel_id: channel, get_role=lambda role_id: None)
+        member = SimpleNamespace(
+            id=1, bot=False, guild=guild, roles=[], mention="<@1>",
+            display_avatar=SimpleNamespace(url="https://example.com/a.png"), display_name="one",
+        )
+
+        async def collect():
+            return [(1, 100, BASE)]
+
+        async def get_member(guild, user_id):
+            return member
+
+        monkeypatch.setattr(main, "db_manager", db_manager)
+        monkeypatch.setattr(main.voice_tracker, "collect", collect)
+        monkeypatch.setattr(main.voice_tracker, "channel_of", lambda guild_id, user_id: channel.id)
+        monkeypatch.setattr(main.bot, "get_guild", lambda guild_id: guild)
+        monkeypatch.setattr(main.bot.member_cache, "get", get_member)
+        monkeypatch.setattr(main.announcer, "announce", lambda channel, embeds: announced.append((channel, embeds)))
+        await main.award_voice_xp.coro()
+        return announced, await db_manager.get_global_user_data(1)
+    finally:
+        await db_manager.close()
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_voice_tick_rewards_level_ups(tmp_path, monkeypatch, write_behind):
+    announced, global_info = asyncio.run(_award_tick(str(tmp_path / "knott.db"), write_behind, monkeypatch))
+    assert len(announced) == 1
+    channel, embeds = announced[0]
+    assert channel.id == 10
+    assert "🎉 Level Up!" in [embed.title for embed in embeds]
+    assert global_info[1] == 2
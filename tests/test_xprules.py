@@ -0,0 +1,29 @@
+from types import SimpleNamespace
+
+import pytest
+
+import xprules
+
+
+def _message(content: str):
+    return SimpleNamespace(content=content, channel=SimpleNamespace(id=1), author=SimpleNamespace(roles=()))
+
+
+@pytest.mark.parametrize("pattern", ["(a+)+", "(a|a)*", "(.*)*x", "(a)\\1"])
+def test_backtracking_patterns_are_rejected(pattern):
+    with pytest.raises(ValueError):
+        xprules.parse_rule(xprules.PATTERN, pattern)
+
+
+def test_safe_pattern_is_accepted():
+    pattern = xprules.parse_rule(xprules.PATTERN, r"(?i:free\s*nitro)")
+    xprules.check_pattern_cost([pattern])
+    rules = xprules.XPRules([(xprules.PATTERN, pattern)])
+    assert rules.check(_message("get FREE  Nitro here")) == xprules.PATTERN
+    assert rules.check(_message("a" * 5000)) is None
+
+
+def test_unsafe_stored_pattern_is_skipped():
+    rules = xprules.XPRules([(xprules.PATTERN, "(a+)+$"), (xprules.PATTERN, "spam")])
+    assert rules.check(_message("a" * 50 + "!")) is None
+    assert rules.check(_message("spam")) == xprules.PATTERN
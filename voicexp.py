@@ -0,0 +1,168 @@
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+import discord
+import botsettings
+
+logger = logging.getLogger(__name__)
+
+
+class VoiceParticipant:
+    __slots__ = ("channel_id", "active_since", "role_ids")
+
+    def __init__(self, channel_id: int, active_since: float, role_ids: Optional[Tuple[int, ...]]):
+        self.channel_id = channel_id
+        self.active_since = active_since
+        # None until the member has been looked up (see load_guild())
+        self.role_ids = role_ids
+
+
+class VoiceTracker:
+    """Who is active in which voice channel, for awarding voice XP.
+
+    Kept up to date from voice state updates, entirely in memory. Members
+    count as active while in a voice channel that isn't the AFK channel
+    and neither muted nor deafened. collect() is run once per tick and
+    returns the XP every active member of a busy enough channel earned, so
+    the whole tick can be written in one transaction.
+    """
+
+    def __init__(self, bot, interval: int = None, xp_per_tick: int = None, min_members: int = None):
+        self.bot = bot
+        self.db_manager = bot.db_manager
+        self.interval = interval or botsettings.voice_xp_interval
+        self.xp_per_tick = botsettings.voice_xp_per_tick if xp_per_tick is None else xp_per_tick
+        self.min_members = botsettings.voice_xp_min_members if min_members is None else min_members
+        # (guild_id, user_id) -> where and since when the member is active
+        self._participants: Dict[Tuple[int, int], VoiceParticipant] = {}
+        # guild_id -> channel_id -> active user ids
+        self._guilds: Dict[int, Dict[int, Set[int]]] = {}
+        # guild_id -> users seen in voice at startup whose member data isn't known yet
+        self._unresolved: Dict[int, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._participants)
+
+    @property
+    def channel_count(self) -> int:
+        return sum(len(channels) for channels in self._guilds.values())
+
+    def channel_of(self, guild_id: int, user_id: int) -> Optional[int]:
+        participant = self._participants.get((guild_id, user_id))
+        return participant.channel_id if participant else None
+
+    def update(self, member: discord.Member, state: discord.VoiceState):
+        """Track ``member``'s new voice state."""
+        if member.bot:
+            return
+        if not _is_active(state):
+            self._remove(member.guild.id, member.id)
+            return
+        self._add(member.guild.id, member.id, state.channel.id, tuple(role.id for role in member.roles))
+
+    def load_guild(self, guild: discord.Guild):
+        """Track everyone already in ``guild``'s voice channels, e.g. after startup."""
+        self.remove_guild(guild.id)
+        for channel in guild.voice_channels + guild.stage_channels:
+            for user_id, state in channel.voice_states.items():
+                if not _is_active(state):
+                    continue
+                member = guild.get_member(user_id)
+                if member is None:
+                    # Not cached (low-memory mode): looked up at the next tick
+                    self._add(guild.id, user_id, channel.id, None)
+                    self._unresolved.setdefault(guild.id, set()).add(user_id)
+                elif not member.bot:
+                    self._add(guild.id, user_id, channel.id, tuple(role.id for role in member.roles))
+
+    def remove_guild(self, guild_id: int):
+        for user_ids in self._guilds.pop(guild_id, {}).values():
+            for user_id in user_ids:
+                del self._participants[(guild_id, user_id)]
+        self._unresolved.pop(guild_id, None)
+
+    async def collect(self) -> List[Tuple[int, int, int]]:
+        """``(user_id, guild_id, xp_gain)`` for every member who earned voice XP this tick.
+
+        Members must have been active for a whole interval, in a channel
+        with at least ``min_members`` active members, and pass their
+        guild's channel and role XP rules.
+        """
+        await self._resolve_members()
+        cutoff = time.monotonic() - self.interval
+        gains = []
+        for guild_id, channels in list(self._guilds.items()):
+            busy = [(channel_id, list(user_ids)) for channel_id, user_ids in channels.items()
+                    if len(user_ids) >= self.min_members]
+            if not busy:
+                continue
+            guild_settings = await self.db_manager.get_guild_settings(guild_id)
+            xp_gain = int(self.xp_per_tick * (guild_settings.xp_multiplier if guild_settings else 1.0))
+            rules = await self.db_manager.get_xp_rules(guild_id)
+            if xp_gain <= 0:
+                continue
+            for channel_id, user_ids in busy:
+                for user_id in user_ids:
+                    participant = self._participants.get((guild_id, user_id))
+                    if participant is None or participant.active_since > cutoff:
+                        continue
+                    if rules.check_voice(channel_id, participant.role_ids or ()) is None:
+                        gains.append((user_id, guild_id, xp_gain))
+        return gains
+
+    async def _resolve_members(self):
+        """Look up members found in voice at startup, dropping bots and those who left."""
+        unresolved, self._unresolved = self._unresolved, {}
+        for guild_id, user_ids in unresolved.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            try:
+                members = await self.bot.member_cache.get_many(guild, user_ids)
+            except Exception as e:
+                logger.warning(f"Could not look up voice members of guild {guild_id}: {e}")
+                self._unresolved.setdefault(guild_id, set()).update(user_ids)
+                continue
+            for user_id in user_ids:
+                participant = self._participants.get((guild_id, user_id))
+                if participant is None or participant.role_ids is not None:
+                    continue
+                member = members.get(user_id)
+                if member is None or member.bot:
+                    self._remove(guild_id, user_id)
+                else:
+                    participant.role_ids = tuple(role.id for role in member.roles)
+
+    def _add(self, guild_id: int, user_id: int, channel_id: int, role_ids: Optional[Tuple[int, ...]]):
+        participant = self._participants.get((guild_id, user_id))
+        if participant is None:
+            self._participants[(guild_id, user_id)] = VoiceParticipant(channel_id, time.monotonic(), role_ids)
+        else:
+            # Moving channels keeps the time already spent active
+            if participant.channel_id != channel_id:
+                self._discard(guild_id, participant.channel_id, user_id)
+                participant.channel_id = channel_id
+            participant.role_ids = role_ids
+        self._guilds.setdefault(guild_id, {}).setdefault(channel_id, set()).add(user_id)
+
+    def _remove(self, guild_id: int, user_id: int):
+        participant = self._participants.pop((guild_id, user_id), None)
+        if participant is not None:
+            self._discard(guild_id, participant.channel_id, user_id)
+
+    def _discard(self, guild_id: int, channel_id: int, user_id: int):
+        channels = self._guilds.get(guild_id)
+        if channels is None or channel_id not in channels:
+            return
+        channels[channel_id].discard(user_id)
+        if not channels[channel_id]:
+            del channels[channel_id]
+            if not channels:
+                del self._guilds[guild_id]
+
+
+def _is_active(state: discord.VoiceState) -> bool:
+    return (
+        state.channel is not None and not state.afk
+        and not (state.self_mute or state.self_deaf or state.mute or state.deaf)
+    )
@@ -0,0 +1,293 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+import botsettings
+import leveling
+import xplog
+
+logger = logging.getLogger(__name__)
+
+
+class XPWriteBuffer:
+    """Write-behind accumulator for XP gains.
+
+    The global and per-server totals of every user touched since the last
+    flush are kept in memory, so level-ups are detected immediately. They are
+    written back in one transaction every ``flush_interval_ms`` milliseconds
+    or every ``flush_max_events`` events, whichever comes first.
+
+    With ``event_log_dir`` (XP_EVENT_LOG_DIR) every change is first appended
+    to an XPEventLog, each flush doubles as a snapshot that lets the log
+    drop what it covers, and recover() replays whatever a crash left
+    unflushed.
+    """
+
+    def __init__(self, db_manager, flush_interval_ms: int = None, flush_max_events: int = None,
+                 event_log_dir: str = None):
+        self.db_manager = db_manager
+        self.flush_interval = (flush_interval_ms or botsettings.xp_flush_interval_ms) / 1000
+        self.flush_max_events = flush_max_events or botsettings.xp_flush_max_events
+        event_log_dir = event_log_dir or botsettings.xp_event_log_dir
+        self.log: Optional[xplog.XPEventLog] = xplog.XPEventLog(event_log_dir) if event_log_dir else None
+        # user_id -> [global_xp, global_level, total_global_messages, last_global_message_time]
+        self._globals: Dict[int, List[int]] = {}
+        # (user_id, guild_id) -> [xp, level, total_messages, last_message_time]
+        self._servers: Dict[Tuple[int, int], List[int]] = {}
+        self._dirty_globals = set()
+        self._dirty_servers = set()
+        # (user_id, guild_id, day) -> XP gained since the last flush, for the rolling-window boards
+        self._period_gains: Dict[Tuple[int, int, int], int] = {}
+        self._events = 0
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    @property
+    def pending_events(self) -> int:
+        return self._events
+
+    @property
+    def flush_lock(self) -> asyncio.Lock:
+        """Held while flushing; hold it to keep the buffer from being written out."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        return self._flush_lock
+
+    async def add(self, user_id: int, guild_id: int, xp_gain: int, current_time: int) -> Tuple[int, int, bool, int]:
+        self._ensure_loop()
+        state, server = await self._load(user_id, guild_id)
+        if self.log is not None:
+            self.log.append(xplog.GAIN, user_id, guild_id, xp_gain, current_time)
+        leveled_up = self._apply_gain(user_id, guild_id, state, server, xp_gain, current_time)
+
+        self._events += 1
+        if self._events >= self.flush_max_events and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+        return state[0], state[1], leveled_up, state[2]
+
+    async def add_voice(self, gains: List[Tuple[int, int, int]], current_time: int) -> List[bool]:
+        """Buffer voice XP ``(user_id, guild_id, xp_gain)`` gains, which count no message.
+
+        Users not buffered yet are loaded together in a few queries. Returns
+        whether each gain raised the user's global level, in order.
+        """
+        self._ensure_loop()
+        # A flush meanwhile would drop users this still has to apply gains to
+        async with self.flush_lock:
+            missing = [(user_id, guild_id) for user_id, guild_id, _ in gains
+                       if user_id not in self._globals or (user_id, guild_id) not in self._servers]
+            if missing:
+                states = await self.db_manager.get_xp_states(missing)
+                for (user_id, guild_id), (global_row, server_row) in states.items():
+                    self._globals.setdefault(user_id, list(global_row) if global_row else [0, 1, 0, 0])
+                    self._servers.setdefault((user_id, guild_id), list(server_row) if server_row else [0, 1, 0, 0])
+
+            leveled_up = []
+            for user_id, guild_id, xp_gain in gains:
+                if self.log is not None:
+                    self.log.append(xplog.VOICE, user_id, guild_id, xp_gain, current_time)
+                leveled_up.append(self._apply_voice(
+                    user_id, guild_id, self._globals[user_id], self._servers[(user_id, guild_id)], xp_gain, current_time
+                ))
+
+        self._events += len(gains)
+        if self._events >= self.flush_max_events and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+        return leveled_up
+
+    async def add_bonus(self, user_id: int, guild_id: int, xp: int) -> Tuple[int, int, int]:
+        """Buffer bonus server XP (e.g. achievement rewards) and return the new server totals."""
+        _, server = await self._load(user_id, guild_id)
+        if self.log is not None:
+            self.log.append(xplog.BONUS, user_id, guild_id, xp, 0)
+        self._apply_bonus(user_id, guild_id, server, xp)
+        return server[0], server[1], server[2]
+
+    def get_global(self, user_id: int) -> Optional[Tuple[int, int, int]]:
+        """Buffered (global_xp, global_level, total_global_messages), if the user is buffered."""
+        state = self._globals.get(user_id)
+        return (state[0], state[1], state[2]) if state else None
+
+    def get_server(self, user_id: int, guild_id: int) -> Optional[Tuple[int, int, int]]:
+        """Buffered (xp, level, total_messages) in a server, if buffered."""
+        server = self._servers.get((user_id, guild_id))
+        return (server[0], server[1], server[2]) if server else None
+
+    def set_global_level(self, user_id: int, level: int, xp: int) -> bool:
+        """Overwrite a buffered user's global level; False if the user isn't buffered."""
+        state = self._globals.get(user_id)
+        if state is None:
+            return False
+        if self.log is not None:
+            self.log.append(xplog.SET_LEVEL, user_id, 0, level, xp)
+        self._apply_level(user_id, state, level, xp)
+        return True
+
+    def buffered_globals(self):
+        """Yield ``(user_id, (global_xp, global_level, total_global_messages))`` for buffered users."""
+        for user_id, state in list(self._globals.items()):
+            yield user_id, (state[0], state[1], state[2])
+
+    def buffered_servers(self, guild_id: int):
+        """Yield ``(user_id, (xp, level, total_messages))`` for buffered users of a server."""
+        for (user_id, server_guild_id), server in list(self._servers.items()):
+            if server_guild_id == guild_id:
+                yield user_id, (server[0], server[1], server[2])
+
+    def recompute_levels(self, old_base: int, new_base: int):
+        """Re-level buffered state after the XP curve changed."""
+        for states in (self._globals.values(), self._servers.values()):
+            for state in states:
+                total = leveling.total_xp(state[1], state[0], old_base)
+                state[1], state[0] = leveling.level_for_total(total, new_base)
+        self._dirty_globals.update(self._globals)
+        self._dirty_servers.update(self._servers)
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self._dirty_globals and not self._dirty_servers:
+                return
+            dirty_globals, self._dirty_globals = self._dirty_globals, set()
+            dirty_servers, self._dirty_servers = self._dirty_servers, set()
+            period_gains, self._period_gains = self._period_gains, {}
+            self._events = 0
+
+            global_rows = [(user_id, *self._globals[user_id]) for user_id in dirty_globals]
+            server_rows = [(user_id, guild_id, *self._servers[(user_id, guild_id)]) for user_id, guild_id in dirty_servers]
+            # Every event logged so far is in these rows or was in an earlier flush
+            log_lsn = self.log.last_lsn if self.log is not None else None
+            try:
+                await self.db_manager.write_xp_batch(
+                    global_rows, server_rows, log_lsn, [(*key, xp) for key, xp in period_gains.items()]
+                )
+            except Exception:
+                # Mark everything dirty again so the next flush retries it
+                self._dirty_globals |= dirty_globals
+                self._dirty_servers |= dirty_servers
+                for key, xp in period_gains.items():
+                    self._period_gains[key] = self._period_gains.get(key, 0) + xp
+                raise
+
+            # State that was not touched again during the write is now fully
+            # persisted, so stop holding it in memory
+            for user_id in dirty_globals - self._dirty_globals:
+                self._globals.pop(user_id, None)
+            for key in dirty_servers - self._dirty_servers:
+                self._servers.pop(key, None)
+            if self.log is not None:
+                self.log.checkpoint(log_lsn)
+
+    async def recover(self) -> int:
+        """Replay logged events the database doesn't have yet and flush them.
+
+        Must run before anything is buffered; returns the number of events replayed.
+        """
+        if self.log is None:
+            return 0
+        replayed = 0
+        for kind, user_id, guild_id, value, extra in self.log.recover(await self.db_manager.get_xp_log_lsn()):
+            if kind == xplog.SET_LEVEL:
+                self._apply_level(user_id, await self._load_global(user_id), value, extra)
+            else:
+                state, server = await self._load(user_id, guild_id)
+                if kind == xplog.GAIN:
+                    self._apply_gain(user_id, guild_id, state, server, value, extra)
+                elif kind == xplog.VOICE:
+                    self._apply_voice(user_id, guild_id, state, server, value, extra)
+                else:
+                    self._apply_bonus(user_id, guild_id, server, value)
+            replayed += 1
+        if replayed:
+            logger.info(f"Replayed {replayed} XP events from {self.log.directory}")
+            await self.flush()
+        return replayed
+
+    async def close(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self.flush()
+        if self.log is not None:
+            self.log.close()
+
+    def _apply_gain(self, user_id: int, guild_id: int, state: List[int], server: List[int],
+                    xp_gain: int, current_time: int) -> bool:
+        state[0], state[1], leveled_up = leveling.apply_xp(state[0], state[1], xp_gain)
+        state[2] += 1
+        state[3] = current_time
+        self._dirty_globals.add(user_id)
+
+        server[0], server[1], _ = leveling.apply_xp(server[0], server[1], xp_gain)
+        server[2] += 1
+        server[3] = current_time
+        self._dirty_servers.add((user_id, guild_id))
+        self._add_period_gain(user_id, guild_id, xp_gain, current_time)
+        return leveled_up
+
+    def _apply_voice(self, user_id: int, guild_id: int, state: List[int], server: List[int],
+                     xp_gain: int, current_time: int) -> bool:
+        state[0], state[1], leveled_up = leveling.apply_xp(state[0], state[1], xp_gain)
+        self._dirty_globals.add(user_id)
+
+        server[0], server[1], _ = leveling.apply_xp(server[0], server[1], xp_gain)
+        self._dirty_servers.add((user_id, guild_id))
+        self._add_period_gain(user_id, guild_id, xp_gain, current_time)
+        return leveled_up
+
+    def _add_period_gain(self, user_id: int, guild_id: int, xp_gain: int, current_time: int):
+        key = (user_id, guild_id, leveling.xp_day(current_time))
+        self._period_gains[key] = self._period_gains.get(key, 0) + xp_gain
+
+    def _apply_bonus(self, user_id: int, guild_id: int, server: List[int], xp: int):
+        server[0], server[1] = leveling.apply_bonus(server[0], server[1], xp)
+        self._dirty_servers.add((user_id, guild_id))
+
+    def _apply_level(self, user_id: int, state: List[int], level: int, xp: int):
+        state[0] = xp
+        state[1] = level
+        self._dirty_globals.add(user_id)
+
+    async def _load(self, user_id: int, guild_id: int) -> Tuple[List[int], List[int]]:
+        state = self._globals.get(user_id)
+        server = self._servers.get((user_id, guild_id))
+        if state is None or server is None:
+            # A flush meanwhile could write out and drop the half that is
+            # buffered, and the stale row read here would then replace it
+            async with self.flush_lock:
+                state = self._globals.get(user_id)
+                server = self._servers.get((user_id, guild_id))
+                if state is None or server is None:
+                    global_row, server_row = await self.db_manager.get_xp_state(user_id, guild_id)
+                    # Another message may have loaded this user while we were waiting
+                    state = self._globals.setdefault(user_id, list(global_row) if global_row else [0, 1, 0, 0])
+                    server = self._servers.setdefault((user_id, guild_id), list(server_row) if server_row else [0, 1, 0, 0])
+        return state, server
+
+    async def _load_global(self, user_id: int) -> List[int]:
+        state = self._globals.get(user_id)
+        if state is None:
+            async with self.flush_lock:
+                global_row, _ = await self.db_manager.get_xp_state(user_id, 0)
+                state = self._globals.setdefault(user_id, list(global_row) if global_row else [0, 1, 0, 0])
+        return state
+
+    def _ensure_loop(self):
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                if self.log is not None:
+                    await self.log.sync()
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing buffered XP: {e}")
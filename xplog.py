@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import struct
+import zlib
+from typing import Iterator, List, Optional, Tuple
+import botsettings
+
+logger = logging.getLogger(__name__)
+
+# Event kinds
+GAIN = 1        # user_id, guild_id, xp_gain, message time
+BONUS = 2       # user_id, guild_id, bonus server xp, 0
+SET_LEVEL = 3   # user_id, 0, global level, global xp
+VOICE = 4       # user_id, guild_id, xp_gain, tick time (no message counted)
+
+RECORD = struct.Struct("<BQQiI")
+CHECKSUM = struct.Struct("<I")
+RECORD_SIZE = RECORD.size + CHECKSUM.size
+SEGMENT_SUFFIX = ".xplog"
+
+
+class XPEventLog:
+    """Append-only log of the XP changes held by the write-behind buffer.
+
+    Events are fixed-size binary records, each with its own checksum,
+    appended to segment files named after the sequence number (LSN) of
+    their first record. The buffer's flushes are the snapshots: each one
+    stores the last LSN it covers in the database, after which every
+    segment holding only older events is deleted. Recovery replays the
+    events after the stored LSN on top of the tables.
+
+    Records are written as they happen, so a crash of the process loses
+    nothing; the periodic ``sync()`` bounds what a power loss can take.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes or botsettings.xp_event_log_segment_mb * 1024 * 1024
+        # None until recover() has found where the log left off
+        self.next_lsn: Optional[int] = None
+        self._fd: Optional[int] = None
+        self._segment_first = 0
+        self._segment_size = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def last_lsn(self) -> int:
+        return self.next_lsn - 1
+
+    def segments(self) -> List[Tuple[int, str]]:
+        """``(first LSN, path)`` of every segment, oldest first."""
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+                segments.append((int(name[:-len(SEGMENT_SUFFIX)]), os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def recover(self, snapshot_lsn: int) -> Iterator[Tuple[int, int, int, int, int]]:
+        """Yield ``(kind, user_id, guild_id, value, extra)`` for events after ``snapshot_lsn``.
+
+        Reading stops at the first torn or corrupt record of a segment.
+        Afterwards new events are numbered after everything seen.
+        """
+        last_lsn = snapshot_lsn
+        for first_lsn, path in self.segments():
+            with open(path, "rb") as f:
+                data = f.read()
+            lsn = first_lsn
+            for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+                body = data[offset:offset + RECORD.size]
+                (checksum,) = CHECKSUM.unpack_from(data, offset + RECORD.size)
+                if zlib.crc32(body) != checksum:
+                    logger.warning(f"Ignoring XP log {path} from record {lsn} on: checksum mismatch")
+                    break
+                if lsn > snapshot_lsn:
+                    yield RECORD.unpack(body)
+                last_lsn = max(last_lsn, lsn)
+                lsn += 1
+        self.next_lsn = last_lsn + 1
+
+    def append(self, kind: int, user_id: int, guild_id: int, value: int, extra: int) -> int:
+        """Write one event and return its LSN."""
+        if self.next_lsn is None:
+            raise RuntimeError("XP event log used before recovery")
+        if self._fd is None or self._segment_size >= self.segment_bytes:
+            self._open_segment()
+        body = RECORD.pack(kind, user_id, guild_id, value, extra)
+        os.write(self._fd, body + CHECKSUM.pack(zlib.crc32(body)))
+        self._segment_size += RECORD_SIZE
+        lsn = self.next_lsn
+        self.next_lsn += 1
+        return lsn
+
+    async def sync(self):
+        """fsync the current segment without blocking the event loop."""
+        if self._fd is None:
+            return
+        # A duplicate, so rotating the segment meanwhile can't close it under us
+        fd = os.dup(self._fd)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, os.fsync, fd)
+        finally:
+            os.close(fd)
+
+    def checkpoint(self, snapshot_lsn: int):
+        """Delete every segment whose events are all at or before ``snapshot_lsn``."""
+        if self._fd is not None and self.last_lsn <= snapshot_lsn:
+            # Start the next event in a fresh segment so this one can go too
+            self._close_segment()
+        segments = self.segments()
+        for i, (first_lsn, path) in enumerate(segments):
+            if self._fd is not None and first_lsn == self._segment_first:
+                break
+            last_lsn = segments[i + 1][0] - 1 if i + 1 < len(segments) else self.last_lsn
+            if last_lsn > snapshot_lsn:
+                break
+            os.unlink(path)
+
+    def close(self):
+        self._close_segment()
+
+    def _open_segment(self):
+        self._close_segment()
+        self._segment_first = self.next_lsn
+        path = os.path.join(self.directory, f"{self.next_lsn:020d}{SEGMENT_SUFFIX}")
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self._segment_size = 0
+
+    def _close_segment(self):
+        if self._fd is None:
+            return
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
@@ -0,0 +1,216 @@
+import logging
+import re
+import time
+from typing import Iterable, Optional, Pattern, Set, Tuple
+import discord
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+# Rule types, as stored in the xp_rules table
+CHANNEL = "channel"        # value: channel id; its threads are covered too
+ROLE = "role"              # value: role id
+MIN_LENGTH = "minlength"   # value: characters; one per guild
+PATTERN = "pattern"        # value: regular expression searched for in the message
+RULE_TYPES = (CHANNEL, ROLE, MIN_LENGTH, PATTERN)
+
+MAX_RULES = 100
+MAX_PATTERN_LENGTH = 200
+# Patterns only search this much of a message, which bounds their worst case
+MAX_SCAN_LENGTH = 1000
+# Seconds a guild's patterns may take on the worst message found when a pattern is added
+PATTERN_TIME_BUDGET = 0.005
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, getattr(sre_constants, "POSSESSIVE_REPEAT", None)}
+_GROUPS = {sre_constants.SUBPATTERN, getattr(sre_constants, "ATOMIC_GROUP", None)}
+# Runs of these catch most slow patterns, together with the characters a pattern names
+_PROBE_CHARACTERS = "a0 !\n"
+
+
+def parse_rule(rule: str, value: str) -> str:
+    """Check a rule an admin entered and return its value as stored.
+
+    Raises ValueError with a message fit to show the admin.
+    """
+    if rule not in RULE_TYPES:
+        raise ValueError(f"Rule type must be one of: {', '.join(RULE_TYPES)}")
+    if rule in (CHANNEL, ROLE, MIN_LENGTH):
+        if not value.isdigit():
+            raise ValueError(f"A {rule} rule needs a number")
+        if rule == MIN_LENGTH and int(value) > 2000:
+            raise ValueError("Minimum length can be at most 2000 characters")
+        return str(int(value))
+    if len(value) > MAX_PATTERN_LENGTH:
+        raise ValueError(f"Patterns can be at most {MAX_PATTERN_LENGTH} characters")
+    try:
+        # Patterns are combined, so flags have to be scoped, e.g. (?i:spam)
+        re.compile(f"(?:{value})")
+    except re.error as e:
+        raise ValueError(f"Invalid pattern: {e}")
+    _probe_characters(value)
+    return value
+
+
+def check_pattern_cost(patterns: Iterable[str]):
+    """Raise ValueError if ``patterns`` together are too slow to run on every message.
+
+    They are timed on runs of every character they name (and a few
+    common ones) of growing length up to MAX_SCAN_LENGTH, stopping at the
+    first run over PATTERN_TIME_BUDGET, so a slow pattern is caught
+    before it has taken much longer than that.
+    """
+    patterns = list(patterns)
+    if not patterns:
+        return
+    compiled = _compile_patterns(patterns)
+    characters = set(_PROBE_CHARACTERS)
+    for pattern in patterns:
+        characters |= _probe_characters(pattern)
+    length = MAX_SCAN_LENGTH // 8
+    while True:
+        for character in sorted(characters):
+            text = character * length
+            started = time.perf_counter()
+            for pattern in compiled:
+                pattern.search(text)
+            if time.perf_counter() - started > PATTERN_TIME_BUDGET:
+                raise ValueError(
+                    "That pattern would make checking messages too slow. "
+                    "Avoid several unbounded repeats like `.*` in a row, or remove other patterns first"
+                )
+        if length >= MAX_SCAN_LENGTH:
+            return
+        length = min(length * 2, MAX_SCAN_LENGTH)
+
+
+def _probe_characters(pattern: str) -> Set[str]:
+    """Characters ``pattern`` names, raising ValueError for constructs that can backtrack exponentially.
+
+    Repeats may not contain other repeats or alternatives, and
+    backreferences and lookarounds aren't supported, which leaves
+    patterns whose worst case grows polynomially with the message length.
+    """
+    characters: Set[str] = set()
+    _walk_pattern(sre_parse.parse(f"(?:{pattern})"), characters, False)
+    return characters
+
+
+def _walk_pattern(subpattern, characters: Set[str], repeated: bool):
+    for op, av in subpattern:
+        if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            raise ValueError("Patterns can't use backreferences")
+        if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            raise ValueError("Patterns can't use lookahead or lookbehind")
+        if op in _REPEATS:
+            if repeated:
+                raise ValueError("Patterns can't repeat something that repeats, e.g. `(a+)+`")
+            _walk_pattern(av[2], characters, True)
+        elif op == sre_constants.BRANCH:
+            if repeated:
+                raise ValueError("Patterns can't repeat alternatives, e.g. `(a|ab)+`; use a character class like `[ab]+`")
+            for branch in av[1]:
+                _walk_pattern(branch, characters, repeated)
+        elif op in _GROUPS:
+            _walk_pattern(av[-1] if op == sre_constants.SUBPATTERN else av, characters, repeated)
+        elif op == sre_constants.LITERAL:
+            characters.add(chr(av))
+        elif op == sre_constants.IN:
+            for item_op, item_av in av:
+                if item_op == sre_constants.LITERAL:
+                    characters.add(chr(item_av))
+                elif item_op == sre_constants.RANGE:
+                    characters.update((chr(item_av[0]), chr(item_av[1])))
+
+
+def _compile_patterns(patterns: Iterable[str]) -> Tuple[Pattern, ...]:
+    """As few regexes as match wherever any of ``patterns`` does.
+
+    Patterns without groups are joined into one alternation; any with
+    groups keep their own, as their group numbers and names would clash.
+    """
+    combined, separate = [], []
+    for pattern in patterns:
+        compiled = re.compile(f"(?:{pattern})")
+        if compiled.groups:
+            separate.append(compiled)
+        else:
+            combined.append(compiled.pattern)
+    if combined:
+        separate.insert(0, re.compile("|".join(combined)))
+    return tuple(separate)
+
+
+def _safe_patterns(patterns: Iterable[str]):
+    """Skip stored patterns parse_rule() would now reject."""
+    for pattern in patterns:
+        try:
+            _probe_characters(pattern)
+        except (ValueError, re.error) as e:
+            logger.warning(f"Ignoring XP rule pattern {pattern!r}: {e}")
+            continue
+        yield pattern
+
+
+class XPRules:
+    """A guild's XP eligibility rules, compiled for checking every message.
+
+    Channel and role ids become frozensets and the patterns are joined
+    into one regex, so a check is a few set lookups and (patterns with
+    groups aside) at most one scan of the message.
+    """
+
+    __slots__ = ("rules", "channels", "roles", "min_length", "patterns")
+
+    def __init__(self, rules: Iterable[Tuple[str, str]] = ()):
+        self.rules = tuple(sorted(rules))
+        channels, roles, patterns = set(), set(), []
+        self.min_length = 0
+        for rule, value in self.rules:
+            if rule == CHANNEL:
+                channels.add(int(value))
+            elif rule == ROLE:
+                roles.add(int(value))
+            elif rule == MIN_LENGTH:
+                self.min_length = int(value)
+            elif rule == PATTERN:
+                patterns.append(value)
+        self.channels = frozenset(channels)
+        self.roles = frozenset(roles)
+        self.patterns = _compile_patterns(_safe_patterns(patterns))
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def check(self, message: discord.Message) -> Optional[str]:
+        """The type of the rule denying ``message`` XP, or None if it earns XP."""
+        if self.channels:
+            channel = message.channel
+            if channel.id in self.channels or getattr(channel, "parent_id", None) in self.channels:
+                return CHANNEL
+        if self.roles and not self.roles.isdisjoint(role.id for role in getattr(message.author, "roles", ())):
+            return ROLE
+        if len(message.content) < self.min_length:
+            return MIN_LENGTH
+        if self.patterns:
+            content = message.content[:MAX_SCAN_LENGTH]
+            for pattern in self.patterns:
+                if pattern.search(content):
+                    return PATTERN
+        return None
+
+    def check_voice(self, channel_id: int, role_ids: Iterable[int]) -> Optional[str]:
+        """Like check(), for time in a voice channel: only channel and role rules apply."""
+        if channel_id in self.channels:
+            return CHANNEL
+        if self.roles and not self.roles.isdisjoint(role_ids):
+            return ROLE
+        return None
+
+
+# Shared by every guild without rules
+NO_RULES = XPRules()